@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Vectorized aggregation of coverage data in the format produced by
+nyx-eval/convert_coverage.sh (i.e. time,subject,fuzzer,run,cov_type,cov).
+
+Can be imported from plotting scripts and notebooks:
+
+    import sys
+    sys.path.append("scripts/analysis")
+    import covagg
+    mean_df = covagg.aggregate(covagg.load("data/proftpd.csv"), 1440, 10)
+"""
+
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import covreduce
+import covstore
+
+COV_TYPES = ("b_abs", "b_per", "l_abs", "l_per")
+# Columns identifying a single coverage curve
+KEYS = ["subject", "fuzzer", "cov_type", "run"]
+
+
+def load(path,
+         subjects: Optional[Iterable[str]] = None,
+         resolution: Optional[float] = None,
+         chunksize: int = covreduce.CHUNKSIZE) -> pd.DataFrame:
+    """
+    Reads a coverage CSV keeping the row order of the file. `path` can also
+    be a store made by covstore.py, in which case only the given subjects
+    are read. With a resolution (in seconds), the CSV is read `chunksize`
+    rows at a time and downsampled while reading (see covreduce.py).
+    """
+    subjects = None if subjects is None else list(subjects)
+    if covstore.is_store(path):
+        df = covstore.CovStore(path).select(subject=subjects)
+        if resolution is None:
+            return df
+        return pd.concat(covreduce.reduce([df], resolution),
+                         ignore_index=True)
+    chunks = covreduce.read_merged([path], chunksize)
+    if subjects is not None:
+        chunks = (c[c["subject"].isin(subjects)] for c in chunks)
+    if resolution is None and subjects is None:
+        return pd.read_csv(path, dtype=covreduce.DTYPES)
+    return pd.concat(covreduce.reduce(chunks, resolution), ignore_index=True)
+
+
+def sample(df: pd.DataFrame,
+           offsets: Union[Iterable[float], np.ndarray],
+           cut: bool = True) -> pd.DataFrame:
+    """
+    Samples every curve in `df` at the given offsets (in seconds) from the
+    start of its run.
+
+    The sampled value is the one of the last row (in file order) with a
+    time less or equal than start + offset, where start is the time of the
+    first row of the run; this is the same as slicing each run by time and
+    taking the last row. Without `cut` all samples are the last row of the
+    run. Returns a frame with columns KEYS + ["time", "cov"] where time is
+    the offset.
+    """
+    offsets = np.asarray(offsets, dtype=np.float64)
+    df = df[KEYS + ["time", "cov"]].reset_index(drop=True)
+    if df.empty or offsets.size == 0:
+        return pd.DataFrame(columns=KEYS + ["time", "cov"])
+
+    # Rows that can be selected with a given cut-off are those whose suffix
+    # minimum of time is below it. Suffix minima are monotonic within a run,
+    # so the last row under a cut-off can be found with a single as-of join.
+    start = df.groupby(KEYS, sort=False,
+                       observed=True)["time"].transform("first")
+    reach = df.iloc[::-1].groupby(KEYS, sort=False,
+                                  observed=True)["time"].cummin()
+    right = df[KEYS + ["cov"]].assign(reach=(reach - start).astype(np.float64))
+    right = right.sort_values("reach", kind="stable")
+
+    curves = df[KEYS].drop_duplicates()
+    left = curves.loc[curves.index.repeat(offsets.size)].reset_index(drop=True)
+    left["time"] = np.tile(offsets, len(curves))
+    left["_at"] = left["time"] if cut else np.inf
+    left = left.sort_values("_at", kind="stable")
+
+    out = pd.merge_asof(left,
+                        right,
+                        left_on="_at",
+                        right_on="reach",
+                        by=KEYS,
+                        direction="backward")
+    return out[KEYS + ["time", "cov"]].sort_values(KEYS + ["time"],
+                                                   ignore_index=True)
+
+
+def aggregate(df: pd.DataFrame,
+              cut_off: int,
+              step: int,
+              runs: Optional[int] = None,
+              subjects: Optional[Iterable[str]] = None,
+              cut: bool = True) -> pd.DataFrame:
+    """
+    Computes the coverage table used by profuzzbench_plot.py: for each
+    subject, fuzzer and coverage type the median (for *_abs) or mean (for
+    *_per) across runs, every `step` minutes up to `cut_off` minutes.
+
+    `runs` restricts to runs numbered 1..runs (all runs by default).
+    Returns columns subject, fuzzer, cov_type, time (minutes), cov; time 0
+    is always 0 coverage.
+    """
+    df = df[df["cov_type"].isin(COV_TYPES)]
+    if runs is not None:
+        df = df[df["run"].between(1, runs)]
+    if subjects is not None:
+        df = df[df["subject"].isin(list(subjects))]
+
+    minutes = np.arange(1, cut_off + 1, step)
+    samples = sample(df, minutes * 60, cut=cut)
+    samples["time"] = (samples["time"] // 60).astype(np.int64)
+
+    cov = samples.groupby(["subject", "fuzzer", "cov_type", "time"],
+                          observed=True)["cov"]
+    stats = pd.DataFrame({"median": cov.median(), "mean": cov.mean()})
+    stats = stats.reset_index()
+    is_abs = stats["cov_type"].str.endswith("_abs")
+    stats["cov"] = np.where(is_abs, stats["median"], stats["mean"])
+
+    zero = stats[["subject", "fuzzer", "cov_type"]].drop_duplicates()
+    zero = zero.assign(time=0, cov=0.0)
+    mean_df = pd.concat([zero, stats[zero.columns]], ignore_index=True)
+    return mean_df.sort_values(["subject", "fuzzer", "cov_type", "time"],
+                               ignore_index=True)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Streaming downsampling of coverage timelines.
+
+Coverage is read in chunks and folded, per curve (subject, fuzzer, run,
+coverage type), into a step function with a fixed resolution: the first row
+of every run is kept as it is (it is the start of the run for covagg), then
+one row per time bin of `resolution` seconds: the last row in the bin, i.e.
+the maximum coverage when it only grows. Bins end at multiples of the
+resolution after the start (inclusive), so sampling the reduced curves at
+those offsets with covagg.sample gives the same coverage as before (as long
+as the time of a trial doesn't go back by more than a bin across chunks).
+Only the last, still open, bin of every curve is kept between chunks, so
+memory does not depend on how long the trials ran.
+
+Both the merged CSVs (time,subject,fuzzer,run,cov_type,cov) and the raw
+outputs of coverage.sh (cov_over_time.csv or coverage.csv, i.e.
+time,l_per,l_abs,b_per,b_abs) can be reduced:
+
+    covreduce.py merged -R 60 -o data/live555-1m.csv data/live555.csv
+    covreduce.py raw -R 1 -t exim -f nyx -r 1 -a -o exim.csv coverage.csv
+
+covagg.load() uses it to read CSVs with a resolution.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["time", "subject", "fuzzer", "run", "cov_type", "cov"]
+DTYPES = {
+    "time": np.int64,
+    "subject": str,
+    "fuzzer": str,
+    "run": np.int64,
+    "cov_type": str,
+    "cov": np.float64
+}
+# Columns identifying a single coverage curve
+KEYS = ["subject", "fuzzer", "cov_type", "run"]
+# Coverage types in the order of the raw CSVs
+RAW_TYPES = ["l_per", "l_abs", "b_per", "b_abs"]
+CHUNKSIZE = 1 << 20
+
+
+def empty(columns: List[str]) -> pd.DataFrame:
+    """ Empty frame with the dtypes of the coverage columns. """
+    return pd.DataFrame({
+        c: pd.Series(dtype=DTYPES.get(c, np.int64))
+        for c in columns
+    })
+
+
+class Reducer:
+    """ Folds chunks of coverage rows into fixed-resolution step functions. """
+    def __init__(self, resolution: float):
+        if resolution <= 0:
+            raise ValueError("The resolution must be positive")
+        self.resolution = resolution
+        # Time of the first row of every curve
+        self._starts = empty(KEYS + ["start"])
+        # Last (open) bin of every curve
+        self._pending = empty(KEYS + ["bin", "time", "cov"])
+
+    def feed(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """ Reduced rows of the bins closed by `chunk` (in COLUMNS). """
+        chunk = chunk[COLUMNS].reset_index(drop=True)
+        if chunk.empty:
+            return chunk
+
+        # First rows of new curves are kept as they are
+        known = chunk.merge(self._starts[KEYS].assign(_known=True),
+                            on=KEYS,
+                            how="left")["_known"].fillna(False).to_numpy(bool)
+        firsts = chunk[~known].drop_duplicates(KEYS)
+        self._starts = pd.concat([
+            self._starts,
+            firsts[KEYS].assign(start=firsts["time"].to_numpy())
+        ],
+                                 ignore_index=True)
+        rest = chunk.drop(firsts.index)
+
+        # Like covagg.sample, a row counts from the earliest time of the rows
+        # after it (the time of the fuzzer may go back); the open bins come
+        # first, their time is already the one of their last row
+        work = pd.concat([self._pending[KEYS + ["time", "cov"]], rest],
+                         ignore_index=True)
+        work["time"] = work.iloc[::-1].groupby(
+            KEYS, sort=False, observed=True)["time"].cummin()
+        work = work.merge(self._starts, on=KEYS, how="left").merge(
+            self._pending[KEYS + ["bin"]].rename(columns={"bin": "open"}),
+            on=KEYS,
+            how="left")
+        # Bin k is (start + (k - 1) * resolution, start + k * resolution];
+        # bins before the open one are already written and don't change
+        work["bin"] = -((work["start"] - work["time"]) // self.resolution)
+        work["bin"] = work["bin"].where(~(work["bin"] < work["open"]),
+                                        work["open"]).astype(np.int64)
+        bins = work.groupby(KEYS + ["bin"], sort=False, observed=True)
+        out = bins[["time", "cov"]].last().reset_index()
+        last = ~out.duplicated(KEYS, keep="last")
+        self._pending = out[last].reset_index(drop=True)
+        return pd.concat([firsts, out[~last][COLUMNS]],
+                         ignore_index=True).astype(DTYPES)
+
+    def flush(self) -> pd.DataFrame:
+        """ Rows of the bins still open. """
+        out = self._pending[COLUMNS].reset_index(drop=True).astype(DTYPES)
+        self._pending = self._pending.iloc[0:0]
+        return out
+
+
+def read_merged(paths: Iterable[Union[str, Path]],
+                chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """ Chunks of merged coverage CSVs, in file order. """
+    for p in paths:
+        yield from pd.read_csv(p, dtype=DTYPES, chunksize=chunksize)
+
+
+def read_raw(path: Union[str, Path],
+             subject: str,
+             fuzzer: str,
+             run: int,
+             chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    Chunks of a raw coverage CSV of coverage.sh converted to the merged
+    format (as convert_coverage.sh does).
+    """
+    for raw in pd.read_csv(path, skipinitialspace=True, chunksize=chunksize):
+        raw.columns = [c.strip() for c in raw.columns]
+        raw = raw.rename(columns={raw.columns[0]: "time"})
+        long = raw.melt(id_vars=["time"],
+                        value_vars=RAW_TYPES,
+                        var_name="cov_type",
+                        value_name="cov",
+                        ignore_index=False)
+        # Back to the row order of the file, types in the order of RAW_TYPES
+        long = long.sort_index(kind="stable").reset_index(drop=True)
+        long["subject"] = subject
+        long["fuzzer"] = fuzzer
+        long["run"] = run
+        yield long.astype(DTYPES)[COLUMNS]
+
+
+def reduce(chunks: Iterable[pd.DataFrame],
+           resolution: Optional[float]) -> Iterator[pd.DataFrame]:
+    """ Reduced chunks; without a resolution, the chunks as they are. """
+    if resolution is None:
+        yield from chunks
+        return
+    reducer = Reducer(resolution)
+    for chunk in chunks:
+        out = reducer.feed(chunk)
+        if not out.empty:
+            yield out
+    yield reducer.flush()
+
+
+def write(chunks: Iterable[pd.DataFrame], out, append: bool = False) -> int:
+    """ Writes chunks as a merged CSV; returns the number of rows. """
+    rows = 0
+    header = not append
+    for chunk in chunks:
+        chunk.to_csv(out, header=header, index=False, columns=COLUMNS)
+        header = False
+        rows += len(chunk)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Downsample coverage timelines to a fixed resolution")
+    parser.add_argument("-R",
+                        "--resolution",
+                        type=float,
+                        required=True,
+                        help="Seconds per bin")
+    parser.add_argument("-c",
+                        "--chunksize",
+                        type=int,
+                        default=CHUNKSIZE,
+                        help="Rows read at a time")
+    parser.add_argument("-o",
+                        "--output",
+                        type=Path,
+                        help="Output CSV (default stdout)")
+    parser.add_argument("-a",
+                        "--append",
+                        action="store_true",
+                        help="Append to the output (without header)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    merged = sub.add_parser("merged", help="Merged coverage CSVs")
+    merged.add_argument("csvs", nargs="+", type=Path)
+    raw = sub.add_parser("raw", help="Raw coverage CSV of a trial")
+    raw.add_argument("-t", "--target", required=True, help="Subject")
+    raw.add_argument("-f", "--fuzzer", required=True, help="Fuzzer column")
+    raw.add_argument("-r", "--run", type=int, required=True, help="Run")
+    raw.add_argument("csv", type=Path)
+    args = parser.parse_args()
+
+    if args.cmd == "merged":
+        chunks = read_merged(args.csvs, args.chunksize)
+    else:
+        chunks = read_raw(args.csv, args.target, args.fuzzer, args.run,
+                          args.chunksize)
+    try:
+        if args.output is None:
+            write(reduce(chunks, args.resolution), sys.stdout, args.append)
+        else:
+            with args.output.open("a" if args.append else "w",
+                                  newline="") as f:
+                write(reduce(chunks, args.resolution), f, args.append)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
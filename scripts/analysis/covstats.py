@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Statistics over coverage data (time,subject,fuzzer,run,cov_type,cov), for
+every subject, fuzzer and coverage type at once:
+
+- bands: median coverage over time with either the interquartile range or a
+  bootstrap confidence interval of the median;
+- summary: final coverage (at the cut-off) of each fuzzer;
+- comparisons: for every pair of fuzzers on a subject, Mann-Whitney U test
+  and Vargha-Delaney A12 effect size of the final coverage.
+
+Curves are sampled once (see covagg.sample) into an array indexed by curve
+group, time and run, and all statistics are computed on it with NumPy.
+
+    covstats.py -i data/exim.csv -c 1440 -s 10 -o exim-summary.csv \\
+        -m exim-tests.csv -P figures/
+"""
+
+import argparse
+import sys
+from itertools import combinations
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from scipy import stats  # noqa: E402
+
+import covagg  # noqa: E402
+import profuzzbench_plot  # noqa: E402
+
+# Columns identifying a group of curves (one curve per run)
+GROUP = ["subject", "fuzzer", "cov_type"]
+BANDS = ("iqr", "bootstrap")
+
+
+def matrix(df: pd.DataFrame,
+           offsets: np.ndarray,
+           runs: Optional[int] = None,
+           subjects: Optional[Iterable[str]] = None,
+           cut: bool = True) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Samples all curves at the given offsets (in seconds). Returns the groups
+    (GROUP columns, sorted) and an array of shape (groups, offsets, runs)
+    with NaN for the runs missing in a group.
+    """
+    df = df[df["cov_type"].isin(covagg.COV_TYPES)]
+    if runs is not None:
+        df = df[df["run"].between(1, runs)]
+    if subjects is not None:
+        df = df[df["subject"].isin(list(subjects))]
+    samples = covagg.sample(df, offsets, cut=cut)
+    # One row per curve, samples sorted by time
+    cov = samples["cov"].to_numpy(np.float64).reshape(-1, len(offsets))
+    curves = samples[covagg.KEYS].iloc[::len(offsets)].reset_index(drop=True)
+    grouped = curves.groupby(GROUP, sort=True, observed=True)
+    g = grouped.ngroup().to_numpy()
+    r = grouped.cumcount().to_numpy()
+    groups = curves[GROUP].drop_duplicates().sort_values(GROUP,
+                                                         ignore_index=True)
+    values = np.full((len(groups), len(offsets), r.max(initial=-1) + 1),
+                     np.nan)
+    values[g, :, r] = cov
+    return groups, values
+
+
+def bootstrap_ci(values: np.ndarray,
+                 boot: int = 1000,
+                 ci: float = 0.95,
+                 seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap interval of the median of every (group, time) in
+    `values` (shape (groups, times, runs), NaN for missing runs).
+    """
+    rng = np.random.default_rng(seed)
+    lo = np.full(values.shape[:2], np.nan)
+    hi = np.full(values.shape[:2], np.nan)
+    alpha = (1 - ci) / 2
+    for i, v in enumerate(values):
+        v = v[:, ~np.isnan(v).all(axis=0)]
+        if v.shape[1] == 0:
+            continue
+        # Resampled runs, shared by all times: (boot, runs)
+        idx = rng.integers(0, v.shape[1], size=(boot, v.shape[1]))
+        medians = np.median(v[:, idx], axis=2)
+        lo[i], hi[i] = np.quantile(medians, [alpha, 1 - alpha], axis=1)
+    return lo, hi
+
+
+def bands(df: pd.DataFrame,
+          cut_off: int,
+          step: int,
+          runs: Optional[int] = None,
+          subjects: Optional[Iterable[str]] = None,
+          band: str = "iqr",
+          boot: int = 1000,
+          ci: float = 0.95,
+          cut: bool = True) -> pd.DataFrame:
+    """
+    Median coverage across runs every `step` minutes up to `cut_off`, with
+    the interquartile range or the bootstrap interval of the median (lo,
+    hi). Returns columns subject, fuzzer, cov_type, time (minutes), cov
+    (median), lo, hi, runs; time 0 is always 0 coverage.
+    """
+    if band not in BANDS:
+        raise ValueError(f"Unknown band '{band}'")
+    minutes = np.arange(1, cut_off + 1, step)
+    groups, values = matrix(df, minutes * 60, runs, subjects, cut)
+    with np.errstate(all="ignore"):
+        median = np.nanmedian(values, axis=2)
+        if band == "iqr":
+            lo, hi = np.nanpercentile(values, [25, 75], axis=2)
+        else:
+            lo, hi = bootstrap_ci(values, boot, ci)
+    n = (~np.isnan(values)).sum(axis=2)
+
+    times = np.concatenate([[0], minutes])
+    zero = np.zeros((len(groups), 1))
+    out = groups.loc[groups.index.repeat(len(times))].reset_index(drop=True)
+    out["time"] = np.tile(times, len(groups))
+    out["cov"] = np.hstack([zero, median]).ravel()
+    out["lo"] = np.hstack([zero, lo]).ravel()
+    out["hi"] = np.hstack([zero, hi]).ravel()
+    out["runs"] = np.hstack([n[:, :1], n]).ravel()
+    return out
+
+
+def final(df: pd.DataFrame,
+          cut_off: int,
+          runs: Optional[int] = None,
+          subjects: Optional[Iterable[str]] = None,
+          cut: bool = True) -> Tuple[pd.DataFrame, np.ndarray]:
+    """ Coverage of every run at the cut-off: groups and (groups, runs). """
+    groups, values = matrix(df, np.array([cut_off * 60.0]), runs, subjects,
+                            cut)
+    return groups, values[:, 0, :]
+
+
+def a12(x: np.ndarray, y: np.ndarray) -> float:
+    """
+    Vargha-Delaney A12: probability that a run of x has more coverage than
+    a run of y (ties count half).
+    """
+    gt = (x[:, None] > y[None, :]).sum()
+    eq = (x[:, None] == y[None, :]).sum()
+    return (gt + 0.5 * eq) / (len(x) * len(y))
+
+
+def summary(groups: pd.DataFrame, values: np.ndarray) -> pd.DataFrame:
+    """ Final coverage of every subject, fuzzer and coverage type. """
+    with np.errstate(all="ignore"):
+        q1, median, q3 = np.nanpercentile(values, [25, 50, 75], axis=1)
+        out = groups.assign(runs=(~np.isnan(values)).sum(axis=1),
+                            median=median,
+                            q1=q1,
+                            q3=q3,
+                            mean=np.nanmean(values, axis=1),
+                            std=np.nanstd(values, axis=1, ddof=1))
+    return out
+
+
+def compare(groups: pd.DataFrame,
+            values: np.ndarray,
+            alpha: float = 0.05) -> pd.DataFrame:
+    """
+    Pairwise comparisons of the final coverage of the fuzzers on each
+    subject and coverage type: Mann-Whitney U (two-sided) and A12 of the
+    first fuzzer over the second.
+    """
+    rows = []
+    for (subject, cov_type), grp in groups.groupby(["subject", "cov_type"],
+                                                   sort=True):
+        for i, j in combinations(grp.index, 2):
+            x = values[i][~np.isnan(values[i])]
+            y = values[j][~np.isnan(values[j])]
+            if len(x) == 0 or len(y) == 0:
+                continue
+            u, p = stats.mannwhitneyu(x, y, alternative="two-sided")
+            rows.append({
+                "subject": subject,
+                "cov_type": cov_type,
+                "fuzzer_a": groups.at[i, "fuzzer"],
+                "fuzzer_b": groups.at[j, "fuzzer"],
+                "median_a": np.median(x),
+                "median_b": np.median(y),
+                "a12": a12(x, y),
+                "u": u,
+                "p": p,
+                "significant": p < alpha
+            })
+    return pd.DataFrame(rows,
+                        columns=[
+                            "subject", "cov_type", "fuzzer_a", "fuzzer_b",
+                            "median_a", "median_b", "a12", "u", "p",
+                            "significant"
+                        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Coverage statistics, tests and confidence bands")
+    parser.add_argument("-i",
+                        "--csv_file",
+                        required=True,
+                        help="Full path to results.csv or a covstore.py store")
+    parser.add_argument("-p",
+                        "--put",
+                        action="append",
+                        help="Subjects to analyze (default all)")
+    parser.add_argument("-r",
+                        "--runs",
+                        type=int,
+                        help="Only use runs 1..runs (default all)")
+    parser.add_argument("-R",
+                        "--resolution",
+                        type=float,
+                        help="Downsample to bins of this many seconds while "
+                        "reading (see covreduce.py)")
+    parser.add_argument("-c",
+                        "--cut_off",
+                        type=int,
+                        required=True,
+                        help="Cut-off time in minutes")
+    parser.add_argument("-s",
+                        "--step",
+                        type=int,
+                        required=True,
+                        help="Time step in minutes")
+    parser.add_argument("-b",
+                        "--band",
+                        choices=BANDS,
+                        default="iqr",
+                        help="Band around the median [default: iqr]")
+    parser.add_argument("-n",
+                        "--boot",
+                        type=int,
+                        default=1000,
+                        help="Bootstrap resamples [default: 1000]")
+    parser.add_argument("--ci",
+                        type=float,
+                        default=0.95,
+                        help="Bootstrap confidence level [default: 0.95]")
+    parser.add_argument("-a",
+                        "--alpha",
+                        type=float,
+                        default=0.05,
+                        help="Significance level [default: 0.05]")
+    parser.add_argument("-o", "--summary", help="Summary CSV")
+    parser.add_argument("-m", "--comparisons", help="Pairwise tests CSV")
+    parser.add_argument("-B", "--bands", help="Bands over time CSV")
+    parser.add_argument("-P",
+                        "--plot-dir",
+                        type=Path,
+                        help="Write one shaded plot per subject here")
+    parser.add_argument("-f",
+                        "--format",
+                        default="png",
+                        help="Figure format [default: png]")
+    args = parser.parse_args()
+
+    df = covagg.load(args.csv_file,
+                     subjects=args.put,
+                     resolution=args.resolution)
+    if df.empty:
+        print("No coverage data", file=sys.stderr)
+        sys.exit(1)
+    cut = profuzzbench_plot.CUT
+
+    groups, values = final(df, args.cut_off, args.runs, args.put, cut)
+    summ = summary(groups, values)
+    tests = compare(groups, values, args.alpha)
+    with pd.option_context("display.max_rows", None, "display.width", 120):
+        print(summ.to_string(index=False, float_format="%.2f"))
+        print()
+        print(tests.to_string(index=False, float_format="%.3g"))
+    if args.summary:
+        summ.to_csv(args.summary, index=False)
+    if args.comparisons:
+        tests.to_csv(args.comparisons, index=False)
+
+    if args.bands or args.plot_dir:
+        bands_df = bands(df,
+                         args.cut_off,
+                         args.step,
+                         runs=args.runs,
+                         subjects=args.put,
+                         band=args.band,
+                         boot=args.boot,
+                         ci=args.ci,
+                         cut=cut)
+        if args.bands:
+            bands_df.to_csv(args.bands, index=False)
+        if args.plot_dir:
+            args.plot_dir.mkdir(parents=True, exist_ok=True)
+            for subject, grp in bands_df.groupby("subject"):
+                out = args.plot_dir.joinpath(f"{subject}.{args.format}")
+                profuzzbench_plot.plot(grp, out)
+                print(f"Saved {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Columnar store for coverage data (time,subject,fuzzer,run,cov_type,cov).
+
+A store is a directory with one NumPy array per column plus an index; the
+string columns are saved as category codes. Rows are sorted by (subject,
+fuzzer, run) keeping the original order of rows within a run, so each
+(subject, fuzzer, run) is a contiguous slice which is read through a memory
+map without loading the rest of the store:
+
+    covstore.py ingest -o data/all.pfbstore data/*.csv
+    covstore.py info data/all.pfbstore
+    covstore.py cat -s exim -f nyx data/all.pfbstore > exim-nyx.csv
+
+From Python:
+
+    store = covstore.CovStore("data/all.pfbstore")
+    df = store.select(subject="exim", fuzzer=["nyx", "aflnet"])
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+VERSION = 1
+META = "meta.json"
+INDEX = "index.npy"
+CATEGORICAL = ("subject", "fuzzer", "cov_type")
+COLUMNS = {
+    "time": np.int64,
+    "subject": np.uint16,
+    "fuzzer": np.uint16,
+    "run": np.int32,
+    "cov_type": np.uint8,
+    "cov": np.float64,
+}
+INDEX_DTYPE = np.dtype([("subject", np.uint16), ("fuzzer", np.uint16),
+                        ("run", np.int32), ("start", np.int64),
+                        ("stop", np.int64)])
+
+Selector = Union[None, str, int, Iterable]
+# (subject, fuzzer, run)
+RunKey = Tuple[str, str, int]
+
+
+def is_store(path: Union[str, Path]) -> bool:
+    return Path(path).joinpath(META).is_file()
+
+
+def read_csv(path: Union[str, Path]) -> pd.DataFrame:
+    return pd.read_csv(path,
+                       dtype={
+                           "time": np.int64,
+                           "subject": "category",
+                           "fuzzer": "category",
+                           "run": np.int32,
+                           "cov_type": "category",
+                           "cov": np.float64
+                       })
+
+
+def read_csvs(csvs: Iterable[Union[str, Path]]) -> pd.DataFrame:
+    """ Reads and concatenates coverage CSVs keeping their row order. """
+    return pd.concat([read_csv(p) for p in csvs], ignore_index=True)
+
+
+def run_keys(df: pd.DataFrame) -> Set[RunKey]:
+    runs = df[["subject", "fuzzer", "run"]].drop_duplicates()
+    return set(
+        zip(runs["subject"].astype(str), runs["fuzzer"].astype(str),
+            runs["run"].astype(int)))
+
+
+def write(df: pd.DataFrame, path: Union[str, Path]):
+    """
+    Writes `df` as a store at `path`, replacing any existing store there.
+    The store is written to a temporary directory first and moved in place.
+    """
+    path = Path(path)
+    df = df.astype({c: "category" for c in CATEGORICAL})
+    categories = {}
+    codes = {}
+    for c in CATEGORICAL:
+        cats = sorted(str(x) for x in df[c].cat.categories)
+        categories[c] = cats
+        codes[c] = pd.Categorical(df[c].astype(str), categories=cats).codes
+    if len(categories["cov_type"]) > np.iinfo(COLUMNS["cov_type"]).max or \
+            max(len(categories["subject"]), len(categories["fuzzer"])) > \
+            np.iinfo(COLUMNS["subject"]).max:
+        raise ValueError("Too many distinct values in categorical columns")
+
+    cols = {
+        "time": df["time"].to_numpy(),
+        "subject": codes["subject"],
+        "fuzzer": codes["fuzzer"],
+        "run": df["run"].to_numpy(),
+        "cov_type": codes["cov_type"],
+        "cov": df["cov"].to_numpy(),
+    }
+    cols = {c: np.asarray(a).astype(COLUMNS[c]) for c, a in cols.items()}
+    # Stable sort to keep the order of rows inside each run
+    order = np.lexsort((cols["run"], cols["fuzzer"], cols["subject"]))
+    cols = {c: a[order] for c, a in cols.items()}
+
+    n = len(order)
+    if n:
+        keys = np.stack([cols["subject"], cols["fuzzer"], cols["run"]])
+        change = np.flatnonzero((keys[:, 1:] != keys[:, :-1]).any(axis=0))
+        starts = np.concatenate([[0], change + 1])
+    else:
+        starts = np.array([], dtype=np.int64)
+    index = np.empty(len(starts), dtype=INDEX_DTYPE)
+    index["subject"] = cols["subject"][starts]
+    index["fuzzer"] = cols["fuzzer"][starts]
+    index["run"] = cols["run"][starts]
+    index["start"] = starts
+    index["stop"] = np.append(starts[1:], n)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent))
+    try:
+        for c, a in cols.items():
+            np.save(tmp.joinpath(f"{c}.npy"), a)
+        np.save(tmp.joinpath(INDEX), index)
+        meta = {"version": VERSION, "rows": n, "categories": categories}
+        with tmp.joinpath(META).open("w") as f:
+            json.dump(meta, f, indent=2)
+        if path.exists():
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+class CovStore:
+    """ Read-only access to a store; columns are memory mapped. """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with self.path.joinpath(META).open() as f:
+            meta = json.load(f)
+        if meta.get("version") != VERSION:
+            raise ValueError(f"{path}: unsupported store version "
+                             f"{meta.get('version')}")
+        self.rows: int = meta["rows"]
+        self.categories: Dict[str, List[str]] = meta["categories"]
+        self.index = np.load(self.path.joinpath(INDEX))
+        self._cols = {
+            c: np.load(self.path.joinpath(f"{c}.npy"), mmap_mode="r")
+            for c in COLUMNS
+        }
+
+    def run_keys(self) -> Set[RunKey]:
+        return set((self.subjects[s], self.fuzzers[f], int(r))
+                   for s, f, r in zip(self.index["subject"],
+                                      self.index["fuzzer"], self.index["run"]))
+
+    @property
+    def subjects(self) -> List[str]:
+        return self.categories["subject"]
+
+    @property
+    def fuzzers(self) -> List[str]:
+        return self.categories["fuzzer"]
+
+    def _codes(self, col: str, sel: Selector) -> Optional[np.ndarray]:
+        if sel is None:
+            return None
+        if isinstance(sel, str):
+            sel = [sel]
+        cats = self.categories[col]
+        return np.array([cats.index(s) for s in sel if s in cats], dtype=int)
+
+    def slices(self,
+               subject: Selector = None,
+               fuzzer: Selector = None,
+               run: Selector = None) -> np.ndarray:
+        """ Index entries (i.e. runs) matching the selection. """
+        mask = np.ones(len(self.index), dtype=bool)
+        for col, sel in (("subject", subject), ("fuzzer", fuzzer)):
+            codes = self._codes(col, sel)
+            if codes is not None:
+                mask &= np.isin(self.index[col], codes)
+        if run is not None:
+            runs = [run] if isinstance(run, int) else list(run)
+            mask &= np.isin(self.index["run"], runs)
+        return self.index[mask]
+
+    def select(self,
+               subject: Selector = None,
+               fuzzer: Selector = None,
+               run: Selector = None,
+               cov_type: Selector = None) -> pd.DataFrame:
+        """
+        Loads the rows for the given subjects, fuzzers and runs (each can be
+        a single value or a list; None selects all) in the same format as
+        the CSVs, with categorical string columns.
+        """
+        entries = self.slices(subject, fuzzer, run)
+        if len(entries):
+            take = np.concatenate(
+                [np.arange(s, e) for s, e in zip(entries["start"],
+                                                 entries["stop"])])
+        else:
+            take = np.array([], dtype=np.int64)
+        if cov_type is not None:
+            codes = self._codes("cov_type", cov_type)
+            take = take[np.isin(self._cols["cov_type"][take], codes)]
+
+        data = {}
+        for c in COLUMNS:
+            a = self._cols[c][take]
+            if c in CATEGORICAL:
+                a = pd.Categorical.from_codes(a.astype(np.int64),
+                                              categories=self.categories[c])
+                a = a.remove_unused_categories()
+            data[c] = a
+        return pd.DataFrame(data)
+
+
+def ingest(csvs: List[Path], path: Path, append: bool = False):
+    """
+    Writes the CSVs (added to the store with `append`) as a store. Raises
+    ValueError if a run (subject, fuzzer, run) is in more than one of them
+    or already in the store: the rows would be merged into a single curve.
+    """
+    frames = []
+    # Where each run comes from
+    sources: Dict[RunKey, str] = {}
+    if append and is_store(path):
+        store = CovStore(path)
+        frames.append(store.select())
+        sources = {k: str(path) for k in store.run_keys()}
+    for csv in csvs:
+        df = read_csv(csv)
+        for key in sorted(run_keys(df)):
+            if key in sources:
+                raise ValueError(f"{csv}: run {key[2]} of {key[1]} on "
+                                 f"{key[0]} is also in {sources[key]}")
+            sources[key] = str(csv)
+        frames.append(df)
+    write(pd.concat(frames, ignore_index=True), path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Columnar store for coverage CSVs")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("ingest", help="Convert CSVs into a store")
+    p.add_argument("-o", "--output", type=Path, required=True, help="Store")
+    p.add_argument("-a",
+                   "--append",
+                   action="store_true",
+                   help="Add the CSVs to the existing store")
+    p.add_argument("csvs", type=Path, nargs="+", metavar="csv")
+
+    p = sub.add_parser("info", help="Print the content of a store")
+    p.add_argument("store", type=Path)
+
+    p = sub.add_parser("cat", help="Print (a slice of) a store as CSV")
+    p.add_argument("-s", "--subject", action="append")
+    p.add_argument("-f", "--fuzzer", action="append")
+    p.add_argument("-r", "--run", type=int, action="append")
+    p.add_argument("-c", "--cov-type", action="append")
+    p.add_argument("store", type=Path)
+
+    args = parser.parse_args()
+
+    if args.cmd == "ingest":
+        try:
+            ingest(args.csvs, args.output, append=args.append)
+        except ValueError as e:
+            print(f"[!] {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.cmd == "info":
+        store = CovStore(args.store)
+        print(f"{args.store}: {store.rows} rows, {len(store.index)} runs")
+        for c in CATEGORICAL:
+            print(f"  {c}: {', '.join(store.categories[c])}")
+    elif args.cmd == "cat":
+        store = CovStore(args.store)
+        df = store.select(args.subject, args.fuzzer, args.run, args.cov_type)
+        df.to_csv(sys.stdout, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,8 @@
 
 import argparse
 import matplotlib.pyplot as plt
-import pandas as pd
-import statistics
+
+import covagg
 
 CUT = True
 LOG = False
@@ -11,73 +11,58 @@ LOG = False
 
 def main(csv_file, put, runs, cut_off, step, out_file):
     #Read the results
-    df = pd.read_csv(csv_file)
-
-    #Calculate the mean of code coverage
-    #Store in a list first for efficiency
-    mean_list = []
-
-    fuzzers = df.fuzzer.unique()
-    for subject in [put]:
-        # for fuzzer in ['aflnet', 'aflnwe']:
-        for fuzzer in fuzzers:
-            for cov_type in ['b_abs', 'b_per', 'l_abs', 'l_per']:
-                #get subject & fuzzer & cov_type-specific dataframe
-                df1 = df[(df['subject'] == subject) & (df['fuzzer'] == fuzzer)
-                         & (df['cov_type'] == cov_type)]
-
-                mean_list.append((subject, fuzzer, cov_type, 0, 0.0))
-                agg_f = statistics.median if '_abs' in cov_type else statistics.mean
-                for time in range(1, cut_off + 1, step):
-                    cov = []
-                    for run in range(1, runs + 1, 1):
-                        #get run-specific data frame
-                        df2 = df1[df1['run'] == run]
-
-                        if CUT:
-                            #get the starting time for this run
-                            start = df2.iloc[0, 0]
-
-                            #get all rows given a cutoff time
-                            df2 = df2[df2['time'] <= start + time * 60]
-
-                        #update total coverage and #runs
-                        cov.append(df2.iloc[-1, 5])
-
-                    #add a new row
-                    mean_list.append(
-                        (subject, fuzzer, cov_type, time, agg_f(cov)))
-
-    #Convert the list to a dataframe
-    mean_df = pd.DataFrame(
-        mean_list, columns=['subject', 'fuzzer', 'cov_type', 'time', 'cov'])
+    df = covagg.load(csv_file, subjects=[put])
+
+    #Calculate the median/mean of code coverage over all runs
+    mean_df = covagg.aggregate(df,
+                               cut_off,
+                               step,
+                               runs=runs,
+                               subjects=[put],
+                               cut=CUT)
+
+    plot(mean_df, out_file)
+
+
+def draw(ax, grp, label):
+    """ Plots a curve, shading its band if grp has lo and hi (covstats). """
+    line, = ax.plot(grp['time'], grp['cov'], label=label)
+    if 'lo' in grp and 'hi' in grp:
+        ax.fill_between(grp['time'],
+                        grp['lo'],
+                        grp['hi'],
+                        color=line.get_color(),
+                        alpha=0.2,
+                        linewidth=0)
+
 
+def plot(mean_df, out_file):
     fig, axes = plt.subplots(2, 2, figsize=(20, 10))
     fig.suptitle("Code coverage analysis")
 
     for key, grp in mean_df.groupby(['fuzzer', 'cov_type']):
         if key[1] == 'b_abs':
-            axes[0, 0].plot(grp['time'], grp['cov'], label=key[0])
+            draw(axes[0, 0], grp, key[0])
             #axes[0, 0].set_title('Edge coverage over time (#edges)')
             axes[0, 0].set_xlabel('Time (in min)')
             axes[0, 0].set_ylabel('#edges')
             if LOG:
                 axes[0, 0].set_yscale('log')
         if key[1] == 'b_per':
-            axes[1, 0].plot(grp['time'], grp['cov'], label=key[0])
+            draw(axes[1, 0], grp, key[0])
             #axes[1, 0].set_title('Edge coverage over time (%)')
             axes[1, 0].set_ylim([0, 100])
             axes[1, 0].set_xlabel('Time (in min)')
             axes[1, 0].set_ylabel('Edge coverage (%)')
         if key[1] == 'l_abs':
-            axes[0, 1].plot(grp['time'], grp['cov'], label=key[0])
+            draw(axes[0, 1], grp, key[0])
             #axes[0, 1].set_title('Line coverage over time (#lines)')
             axes[0, 1].set_xlabel('Time (in min)')
             axes[0, 1].set_ylabel('#lines')
             if LOG:
                 axes[0, 1].set_yscale('log')
         if key[1] == 'l_per':
-            axes[1, 1].plot(grp['time'], grp['cov'], label=key[0])
+            draw(axes[1, 1], grp, key[0])
             #axes[1, 1].set_title('Line coverage over time (%)')
             axes[1, 1].set_ylim([0, 100])
             axes[1, 1].set_xlabel('Time (in min)')
@@ -91,6 +76,7 @@ def main(csv_file, put, runs, cut_off, step, out_file):
 
     #Save to file
     plt.savefig(out_file)
+    plt.close(fig)
 
 
 # Parse the input arguments
@@ -100,7 +86,7 @@ if __name__ == '__main__':
                         '--csv_file',
                         type=str,
                         required=True,
-                        help="Full path to results.csv")
+                        help="Full path to results.csv or a covstore.py store")
     parser.add_argument('-p',
                         '--put',
                         type=str,
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Renders coverage plots for many result CSVs (e.g. data/*.csv) at once.
+
+Each CSV is parsed once and one figure per subject found in it is rendered;
+CSVs are processed in parallel on a process pool. Figures whose input CSV
+and plot parameters did not change since the last render are skipped (see
+MANIFEST in the output directory).
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import covagg  # noqa: E402
+import covstore  # noqa: E402
+import profuzzbench_plot  # noqa: E402
+
+MANIFEST = ".plot-manifest.json"
+
+
+def find_csvs(inputs: List[str]) -> List[Path]:
+    """
+    Expands directories and glob patterns into a list of CSV files; stores
+    made by covstore.py are kept as they are.
+    """
+    csvs = []
+    for i in inputs:
+        if covstore.is_store(i):
+            csvs.append(Path(i))
+        elif os.path.isdir(i):
+            csvs.extend(sorted(Path(i).glob("*.csv")))
+        elif glob.has_magic(i):
+            csvs.extend(Path(p) for p in sorted(glob.glob(i)))
+        else:
+            csvs.append(Path(i))
+    # Remove duplicates keeping order
+    return list(dict.fromkeys(p.resolve() for p in csvs))
+
+
+def figure_prefixes(csvs: List[Path]) -> Dict[Path, str]:
+    """
+    Figure names are based on the CSV name; CSVs with the same name in
+    different directories (e.g. data/x.csv, data/split/x.csv) are prefixed
+    with their parent directory name.
+    """
+    stems = [p.stem for p in csvs]
+    return {
+        p: p.stem if stems.count(p.stem) == 1 else f"{p.parent.name}-{p.stem}"
+        for p in csvs
+    }
+
+
+def signature(csv: Path, params: Dict) -> Dict:
+    """ What a render depends on: the input file and the plot parameters. """
+    st = csv.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, **params}
+
+
+def render(csv: Path, prefix: str, outdir: Path, runs: Optional[int],
+           cut_off: int, step: int, fmt: str) -> List[str]:
+    """ Renders all subjects in `csv`, returns the paths of the figures. """
+    df = covagg.load(csv)
+    mean_df = covagg.aggregate(df,
+                               cut_off,
+                               step,
+                               runs=runs,
+                               cut=profuzzbench_plot.CUT)
+    subjects = mean_df["subject"].unique()
+    figures = []
+    for subject in subjects:
+        name = prefix if len(subjects) == 1 else f"{prefix}-{subject}"
+        out_file = outdir.joinpath(f"{name}.{fmt}")
+        profuzzbench_plot.plot(mean_df[mean_df["subject"] == subject],
+                               out_file)
+        figures.append(str(out_file))
+    return figures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Plot coverage for many result CSVs in parallel")
+    parser.add_argument("inputs",
+                        nargs="+",
+                        help="CSV files, directories, glob patterns or stores")
+    parser.add_argument("-o",
+                        "--outdir",
+                        type=Path,
+                        required=True,
+                        help="Output directory for the figures")
+    parser.add_argument("-r",
+                        "--runs",
+                        type=int,
+                        default=None,
+                        help="Number of runs (default: all runs in the CSV)")
+    parser.add_argument("-c",
+                        "--cut_off",
+                        type=int,
+                        required=True,
+                        help="Cut-off time in minutes")
+    parser.add_argument("-s",
+                        "--step",
+                        type=int,
+                        required=True,
+                        help="Time step in minutes")
+    parser.add_argument("-F",
+                        "--format",
+                        default="png",
+                        help="Figures file format (default: png)")
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="Number of parallel processes")
+    parser.add_argument("-f",
+                        "--force",
+                        action="store_true",
+                        help="Render even if inputs did not change")
+    args = parser.parse_args()
+
+    csvs = find_csvs(args.inputs)
+    if not csvs:
+        print("No CSV files found", file=sys.stderr)
+        sys.exit(1)
+
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    manifest_path = args.outdir.joinpath(MANIFEST)
+    manifest = {}
+    if manifest_path.exists():
+        with manifest_path.open() as f:
+            manifest = json.load(f)
+
+    params = {
+        "runs": args.runs,
+        "cut_off": args.cut_off,
+        "step": args.step,
+        "format": args.format
+    }
+    prefixes = figure_prefixes(csvs)
+    todo = []
+    for csv in csvs:
+        sig = signature(csv, {**params, "name": prefixes[csv]})
+        prev = manifest.get(str(csv))
+        if not args.force and prev is not None and prev["sig"] == sig \
+                and all(os.path.exists(p) for p in prev["figures"]):
+            print(f"{csv}: up to date")
+            continue
+        todo.append((csv, sig))
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+        futures = {
+            ex.submit(render, csv, prefixes[csv], args.outdir, args.runs,
+                      args.cut_off, args.step, args.format): (csv, sig)
+            for csv, sig in todo
+        }
+        for fut in as_completed(futures):
+            csv, sig = futures[fut]
+            try:
+                figures = fut.result()
+            except Exception as e:
+                print(f"{csv}: failed ({e!r})", file=sys.stderr)
+                manifest.pop(str(csv), None)
+                failed += 1
+                continue
+            manifest[str(csv)] = {"sig": sig, "figures": figures}
+            print(f"{csv}: {', '.join(figures)}")
+
+    with manifest_path.open("w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
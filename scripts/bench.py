@@ -0,0 +1,995 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the evaluation pipeline itself: loading, reducing, merging and
+aggregating coverage CSVs, plots and statistics, Nyx spec conversion, input
+selection for coverage (trial_inputs.py), replay throughput and runqueue
+scheduling overhead.
+
+Every stage runs on synthetic data made in a temporary directory (coverage
+CSVs shaped like data/*.csv, corpora of Nyx specs and AFLNet inputs); replay
+goes to a dummy TCP server on localhost, standing in for the subjects, with
+and without nyx-eval/forksrv.c preloaded. A stage is run once with
+tracemalloc for its peak (Python and NumPy) memory, then timed `-r` times.
+
+Results are appended, one JSON object per stage, to a file together with the
+commit they were measured on, so that two commits can be compared:
+
+    bench.py run -o bench-results.jsonl
+    bench.py run -k csv -k plot -n 4 -o bench-results.jsonl
+    bench.py compare -o bench-results.jsonl 691920c HEAD
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import posixpath
+import random
+import re
+import selectors
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import tracemalloc
+import urllib.parse
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+HERE = Path(__file__).absolute().parent
+sys.path.append(str(HERE.joinpath("analysis")))
+sys.path.append(str(HERE.joinpath("nyx-eval")))
+import covagg  # noqa: E402
+import covreduce  # noqa: E402
+import covstats  # noqa: E402
+import containers  # noqa: E402
+import covstore  # noqa: E402
+import profuzzbench_plot  # noqa: E402
+import runqueue  # noqa: E402
+import trial_inputs  # noqa: E402
+from trial_inputs import nyx2aflnet  # noqa: E402
+
+RESULTS = "bench-results.jsonl"
+SUBJECTS = ["lightftp", "exim"]
+FUZZERS = ["aflnet", "aflnwe", "nyx"]
+# FTP-like commands of the synthetic inputs
+COMMANDS = [
+    b"USER ubuntu", b"PASS ubuntu", b"SYST", b"PWD", b"TYPE I", b"PASV",
+    b"LIST", b"CWD /tmp", b"MKD bench", b"RMD bench", b"RETR a.txt",
+    b"STOR b.txt", b"NOOP", b"QUIT"
+]
+
+
+class Skipped(Exception):
+    """ A stage that can't run here (e.g. no compiler for forksrv.c). """
+
+
+# A stage: given a temporary directory and the scale, builds its inputs and
+# yields the function to measure, which returns the number of items done
+Setup = Callable[[Path, int], ContextManager[Callable[[], int]]]
+
+
+class Bench:
+    def __init__(self, name: str, unit: str, setup: Setup):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+
+
+BENCHES: Dict[str, Bench] = {}
+
+
+def bench(name: str, unit: str):
+    def register(f):
+        BENCHES[name] = Bench(name, unit, contextlib.contextmanager(f))
+        return f
+
+    return register
+
+
+# Synthetic data
+
+
+def coverage_frame(subjects: List[str],
+                   runs: int,
+                   points: int,
+                   seed: int = 0) -> pd.DataFrame:
+    """
+    Coverage as convert_coverage.sh writes it: for every run `points` times
+    over 24 hours (denser at the start) with growing line and branch
+    coverage, 4 rows per time.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for subject in subjects:
+        for fuzzer in FUZZERS:
+            for run in range(1, runs + 1):
+                start = 1600000000 + int(rng.integers(0, 10**6))
+                offsets = np.sort(rng.random(points)**3 * 86400).astype(int)
+                offsets[0] = 0
+                lines = 400 + np.cumsum(rng.poisson(0.5, points))
+                branches = 150 + np.cumsum(rng.poisson(0.3, points))
+                t = np.repeat(start + offsets, 4)
+                cov = np.stack([
+                    np.round(lines / 50, 1), lines,
+                    np.round(branches / 30, 1), branches
+                ],
+                               axis=1).ravel()
+                frames.append(
+                    pd.DataFrame({
+                        "time": t,
+                        "subject": subject,
+                        "fuzzer": fuzzer,
+                        "run": run,
+                        "cov_type": np.tile(covreduce.RAW_TYPES, points),
+                        "cov": cov
+                    }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def coverage_csv(path: Path, scale: int, subjects: List[str] = SUBJECTS,
+                 seed: int = 0) -> int:
+    """ Writes a merged coverage CSV; returns its number of rows. """
+    df = coverage_frame(subjects, 10, 250 * scale, seed)
+    df.to_csv(path, index=False)
+    return len(df)
+
+
+def raw_csv(path: Path, points: int, seed: int = 0):
+    """ Writes a raw coverage CSV of a run, as coverage.sh does. """
+    df = coverage_frame(SUBJECTS[:1], 1, points, seed)
+    df = df[df["fuzzer"] == FUZZERS[0]]
+    wide = df.pivot_table(index="time",
+                          columns="cov_type",
+                          values="cov",
+                          aggfunc="last",
+                          sort=True)
+    with path.open("w") as f:
+        f.write("Time,l_per,l_abs,b_per,b_abs\n")
+        for t, row in wide[covreduce.RAW_TYPES].iterrows():
+            f.write(f"{t}, {row['l_per']}, {int(row['l_abs'])}, "
+                    f"{row['b_per']}, {int(row['b_abs'])}\n")
+
+
+def messages(rng: random.Random) -> List[bytes]:
+    """ Payloads of an input, one command per packet. """
+    return [
+        rng.choice(COMMANDS) + b"\r\n" for _ in range(rng.randint(1, 10))
+    ]
+
+
+def spec(packets: List[bytes], rng: random.Random) -> str:
+    """ A Nyx-Net reproducible spec sending `packets`. """
+    lines = ["# synthetic spec"]
+    for i, p in enumerate(packets):
+        if rng.random() < 0.5:
+            lines.append(f"packet(data={p!r})")
+        else:
+            lines.append(f"packet_raw(inputs=[{i}], borrows=[], "
+                         f"data={p!r})")
+    return "\n".join(lines) + "\n"
+
+
+def corpus(n: int, dups: float = 0.3, seed: int = 0) -> List[List[bytes]]:
+    """ `n` inputs, a fraction `dups` of them duplicates of earlier ones. """
+    rng = random.Random(seed)
+    inputs: List[List[bytes]] = []
+    for _ in range(n):
+        if inputs and rng.random() < dups:
+            inputs.append(rng.choice(inputs))
+        else:
+            inputs.append(messages(rng))
+    return inputs
+
+
+def aflnet_input(packets: List[bytes]) -> bytes:
+    """ An input in the AFLNet replay format (length-prefixed packets). """
+    return b"".join(struct.pack("<I", len(p)) + p for p in packets)
+
+
+def trial_archive(path: Path, n: int, seed: int = 0):
+    """ Archive of an AFLNet trial with `n` replayable inputs. """
+    with tarfile.open(path, "w:gz") as tar:
+
+        def add(name: str, data: Optional[bytes], mtime: int):
+            info = tarfile.TarInfo(f"out-bench-aflnet/{name}")
+            info.mtime = mtime
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+        add("replayable-queue", None, 1600000000)
+        add("queue", None, 1600000000)
+        for i, packets in enumerate(corpus(n, seed=seed)):
+            data = aflnet_input(packets)
+            add(f"replayable-queue/id:{i:06d},src:000000", data,
+                1600000000 + i)
+            # Not selected, only streamed over
+            add(f"queue/id:{i:06d},src:000000", data, 1600000000 + i)
+        add("fuzzer_stats", b"execs_done : 1000\n", 1600086400)
+
+
+# Dummy server
+
+
+def serve():
+    """
+    Dummy line-based server: a greeting, then a reply to every line, until
+    the client closes. Prints its port once listening.
+    """
+    srv = socket.socket()
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(128)
+    print(srv.getsockname()[1], flush=True)
+    while True:
+        conn, _ = srv.accept()
+        buf = b""
+        conn.sendall(b"220 bench\r\n")
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buf += data
+            while b"\r\n" in buf:
+                line, buf = buf.split(b"\r\n", 1)
+                conn.sendall(b"221 bye\r\n" if line ==
+                             b"QUIT" else b"200 ok\r\n")
+        conn.close()
+
+
+@contextlib.contextmanager
+def dummy_server(env: Optional[Dict[str, str]] = None) -> Iterator[int]:
+    """ Runs the dummy server; yields its port. """
+    p = subprocess.Popen(
+        [sys.executable, __file__, "serve"],
+        stdout=subprocess.PIPE,
+        env=None if env is None else dict(os.environ, **env),
+        universal_newlines=True)
+    try:
+        port = p.stdout.readline().strip()
+        if not port:
+            raise Skipped("the dummy server did not start")
+        yield int(port)
+    finally:
+        p.kill()
+        p.wait()
+
+
+def replay(port: int, packets: List[bytes], timeout: float = 5):
+    """
+    Sends an input like aflnet-replay: every packet waits for the reply to
+    the previous one (no fixed sleeps), then waits for the server to close.
+    """
+    with socket.create_connection(("127.0.0.1", port), timeout) as c:
+        sel = selectors.DefaultSelector()
+        sel.register(c, selectors.EVENT_READ)
+        pending = 1  # the greeting
+        buf = b""
+        for p in packets + [None]:
+            while pending > 0:
+                if not sel.select(timeout):
+                    raise TimeoutError("no reply from the dummy server")
+                data = c.recv(4096)
+                if not data:
+                    return
+                buf += data
+                n = buf.count(b"\r\n")
+                pending -= n
+                buf = buf[buf.rfind(b"\r\n") + 2:] if n else buf
+            if p is None:
+                break
+            c.sendall(p)
+            pending = 1
+        c.shutdown(socket.SHUT_WR)
+        while c.recv(4096):
+            pass
+        sel.close()
+
+
+# Fake Docker API
+
+
+class FakeContainer:
+    def __init__(self, name: str, body: Dict):
+        self.id = os.urandom(32).hex()
+        self.name = name
+        self.cmd: List[str] = body.get("Cmd") or []
+        self.labels: Dict[str, str] = body.get("Labels") or {}
+        # Path in the container -> contents
+        self.files: Dict[str, bytes] = {}
+        self.state = "created"
+        self.status = 0
+        self.log = b""
+
+    def execute(self) -> int:
+        """ Runs the command: cp SRC DEST, sleep SECONDS or exit STATUS. """
+        cmd = self.cmd
+        if cmd[:1] == ["cp"] and len(cmd) == 3:
+            if cmd[1] not in self.files:
+                self.log += f"cp: {cmd[1]}: No such file\r\n".encode()
+                return 1
+            self.files[cmd[2]] = self.files[cmd[1]]
+            return 0
+        if cmd[:1] == ["sleep"] and len(cmd) == 2:
+            threading.Event().wait(float(cmd[1]))
+            return 0
+        if cmd[:1] == ["exit"] and len(cmd) == 2:
+            return int(cmd[1])
+        self.log += f"fake: {' '.join(cmd)}: command not found\r\n".encode()
+        return 127
+
+
+class FakeDocker(socketserver.ThreadingUnixStreamServer):
+    """
+    The endpoints of the Docker Engine API used by containers.py, served on
+    a Unix socket. Containers have their files in memory and only run `cp`,
+    `sleep` and `exit` (see FakeContainer.execute).
+    """
+    daemon_threads = True
+    # Connecting to a Unix socket with a full backlog fails (EAGAIN)
+    request_queue_size = 128
+
+    def __init__(self, path: str):
+        super().__init__(path, FakeDockerHandler)
+        self.containers: Dict[str, FakeContainer] = {}
+        self.cv = threading.Condition()
+        self.requests = 0
+
+    def find(self, ref: str) -> Optional[FakeContainer]:
+        for c in self.containers.values():
+            if c.id.startswith(ref) or c.name == ref:
+                return c
+        return None
+
+    def handle_error(self, request, client_address):
+        # Clients going away, e.g. containers.py interrupted
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def run(self, c: FakeContainer):
+        status = c.execute()
+        with self.cv:
+            if c.state == "running":
+                c.state = "exited"
+                c.status = status
+            self.cv.notify_all()
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeDocker
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: object = None):
+        if isinstance(body, bytes):
+            data, ctype = body, "application/octet-stream"
+        elif body is None:
+            data, ctype = b"", "text/plain"
+        else:
+            data, ctype = json.dumps(body).encode(), "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def error(self, status: int, message: str):
+        self.reply(status, {"message": message})
+
+    def body(self) -> bytes:
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            data = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b""):
+                        pass
+                    return data
+                data += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def handle_one(self, method: str):
+        srv = self.server
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")
+        body = self.body()
+        with srv.cv:
+            srv.requests += 1
+        if parts == ["_ping"]:
+            return self.reply(200, b"OK")
+        if parts == ["containers", "create"] and method == "POST":
+            name = query.get("name") or os.urandom(4).hex()
+            with srv.cv:
+                if srv.find(name) is not None:
+                    return self.error(409, f"Conflict: name {name} in use")
+                c = FakeContainer(name, json.loads(body))
+                srv.containers[c.id] = c
+            return self.reply(201, {"Id": c.id, "Warnings": []})
+        if parts == ["containers", "json"]:
+            labels = json.loads(query.get("filters", "{}")).get("label", [])
+            out = []
+            with srv.cv:
+                for c in srv.containers.values():
+                    if all(k.partition("=")[0] in c.labels for k in labels):
+                        out.append({
+                            "Id": c.id,
+                            "Names": [f"/{c.name}"],
+                            "Labels": c.labels,
+                            "State": c.state
+                        })
+            return self.reply(200, out)
+        if len(parts) < 2 or parts[0] != "containers":
+            return self.error(404, "page not found")
+        with srv.cv:
+            c = srv.find(parts[1])
+        if c is None:
+            return self.error(404, f"No such container: {parts[1]}")
+        action = parts[2] if len(parts) > 2 else None
+        if action is None and method == "DELETE":
+            with srv.cv:
+                if c.state == "running":
+                    if query.get("force") not in ("1", "true"):
+                        return self.error(409, "container is running")
+                    c.state = "exited"
+                    c.status = 137
+                del srv.containers[c.id]
+                srv.cv.notify_all()
+            return self.reply(204)
+        if action == "start" and method == "POST":
+            with srv.cv:
+                if c.state != "created":
+                    return self.reply(304)
+                c.state = "running"
+            threading.Thread(target=srv.run, args=(c, ), daemon=True).start()
+            return self.reply(204)
+        if action == "wait" and method == "POST":
+            with srv.cv:
+                srv.cv.wait_for(lambda: c.state == "exited")
+            return self.reply(200, {"StatusCode": c.status})
+        if action == "logs":
+            return self.reply(200, c.log)
+        if action == "archive" and method == "PUT":
+            root = query.get("path", "/")
+            with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+                for m in tar:
+                    if m.isfile():
+                        path = posixpath.join(root, m.name)
+                        c.files[path] = tar.extractfile(m).read()
+            return self.reply(200)
+        if action == "archive" and method == "GET":
+            path = query.get("path", "")
+            if path not in c.files:
+                return self.error(404, f"Could not find the file {path}")
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w") as tar:
+                info = tarfile.TarInfo(posixpath.basename(path))
+                info.size = len(c.files[path])
+                tar.addfile(info, io.BytesIO(c.files[path]))
+            return self.reply(200, buf.getvalue())
+        return self.error(404, "page not found")
+
+    def do_GET(self):
+        self.handle_one("GET")
+
+    def do_POST(self):
+        self.handle_one("POST")
+
+    def do_PUT(self):
+        self.handle_one("PUT")
+
+    def do_DELETE(self):
+        self.handle_one("DELETE")
+
+
+@contextlib.contextmanager
+def fake_docker(path: Path) -> Iterator[FakeDocker]:
+    """ Serves the fake Docker API on `path` in a thread. """
+    srv = FakeDocker(str(path))
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        yield srv
+    finally:
+        srv.shutdown()
+        srv.server_close()
+        path.unlink()
+
+
+# Stages
+
+
+@bench("csv_load", "rows")
+def bench_csv_load(tmp: Path, scale: int):
+    path = tmp.joinpath("cov.csv")
+    coverage_csv(path, scale)
+    yield lambda: len(covagg.load(path))
+
+
+@bench("csv_load_reduced", "rows")
+def bench_csv_load_reduced(tmp: Path, scale: int):
+    path = tmp.joinpath("cov.csv")
+    rows = coverage_csv(path, scale)
+    chunksize = max(rows // 8, 1)
+
+    def run() -> int:
+        covagg.load(path, resolution=60, chunksize=chunksize)
+        return rows
+
+    yield run
+
+
+@bench("csv_convert_raw", "rows")
+def bench_csv_convert_raw(tmp: Path, scale: int):
+    path = tmp.joinpath("cov_over_time.csv")
+    raw_csv(path, 20000 * scale)
+
+    def run() -> int:
+        chunks = covreduce.read_raw(path, "lightftp", "aflnet", 1)
+        with open(os.devnull, "w") as f:
+            return covreduce.write(covreduce.reduce(chunks, 1), f)
+
+    yield run
+
+
+@bench("csv_merge", "rows")
+def bench_csv_merge(tmp: Path, scale: int):
+    csvs = []
+    rows = 0
+    for i, subject in enumerate(SUBJECTS):
+        csvs.append(tmp.joinpath(f"{subject}.csv"))
+        rows += coverage_csv(csvs[-1], scale, [subject], seed=i)
+    store = tmp.joinpath("all.pfbstore")
+
+    def run() -> int:
+        covstore.ingest(csvs, store)
+        return rows
+
+    yield run
+
+
+@bench("aggregate", "curves")
+def bench_aggregate(tmp: Path, scale: int):
+    df = coverage_frame(SUBJECTS, 10, 250 * scale)
+    curves = df.groupby(covagg.KEYS).ngroups
+
+    def run() -> int:
+        covagg.aggregate(df, 1440, 10)
+        return curves
+
+    yield run
+
+
+@bench("stats", "curves")
+def bench_stats(tmp: Path, scale: int):
+    df = coverage_frame(SUBJECTS, 10, 250 * scale)
+    curves = df.groupby(covagg.KEYS).ngroups
+
+    def run() -> int:
+        groups, values = covstats.final(df, 1440)
+        covstats.compare(groups, values)
+        covstats.bands(df, 1440, 10, band="bootstrap", boot=200)
+        return curves
+
+    yield run
+
+
+@bench("plot", "figures")
+def bench_plot(tmp: Path, scale: int):
+    df = coverage_frame(SUBJECTS[:1], 10, 250 * scale)
+    mean_df = covagg.aggregate(df, 1440, 10)
+    out = tmp.joinpath("cov_over_time.png")
+
+    def run() -> int:
+        profuzzbench_plot.plot(mean_df, out)
+        return 1
+
+    yield run
+
+
+@bench("nyx2aflnet", "specs")
+def bench_nyx2aflnet(tmp: Path, scale: int):
+    rng = random.Random(0)
+    d = tmp.joinpath("corpus")
+    d.mkdir()
+    for i, packets in enumerate(corpus(2000 * scale)):
+        d.joinpath(f"cov_{i:06d}.py").write_text(spec(packets, rng))
+    files = sorted(d.iterdir())
+
+    def run() -> int:
+        # Duplicates in a run still hit the cache
+        nyx2aflnet.clear_cache()
+        for f in files:
+            nyx2aflnet.convert(str(f))
+        return len(files)
+
+    yield run
+
+
+@bench("trial_inputs", "inputs")
+def bench_trial_inputs(tmp: Path, scale: int):
+    archive = tmp.joinpath("out-bench-aflnet-000.tar.gz")
+    trial_archive(archive, 2000 * scale)
+    mapping = {
+        "out-bench-aflnet/replayable-queue":
+        "home/ubuntu/experiments/replayable-queue"
+    }
+
+    def run() -> int:
+        inputs = trial_inputs.read_archive(str(archive), mapping)
+        selected, total, _ = trial_inputs.select(inputs, unique=True)
+        with open(os.devnull, "wb") as f:
+            trial_inputs.write(iter(selected), f)
+        return total
+
+    yield run
+
+
+@bench("replay", "inputs")
+def bench_replay(tmp: Path, scale: int):
+    inputs = corpus(200 * scale)
+    with dummy_server() as port:
+
+        def run() -> int:
+            for packets in inputs:
+                replay(port, packets)
+            return len(inputs)
+
+        yield run
+
+
+@bench("replay_forksrv", "inputs")
+def bench_replay_forksrv(tmp: Path, scale: int):
+    so = tmp.joinpath("forksrv.so")
+    try:
+        subprocess.run([
+            "gcc", "-shared", "-fPIC", "-O2", "-o",
+            str(so),
+            str(HERE.joinpath("nyx-eval", "forksrv.c")), "-ldl"
+        ],
+                       check=True,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        raise Skipped("could not build forksrv.so")
+    inputs = corpus(200 * scale)
+    with dummy_server({"LD_PRELOAD": str(so)}) as port:
+
+        def run() -> int:
+            for packets in inputs:
+                replay(port, packets)
+            return len(inputs)
+
+        yield run
+
+
+@bench("runqueue", "jobs")
+def bench_runqueue(tmp: Path, scale: int):
+    # Every phase runs a script that exits right away
+    scripts = tmp.joinpath("scripts")
+    scripts.joinpath("nyx-eval").mkdir(parents=True)
+    stub = scripts.joinpath("nyx-eval", "coverage.sh")
+    stub.write_text("#!/bin/sh\nexit 0\n")
+    stub.chmod(0o755)
+    outdir = tmp.joinpath("out")
+    outdir.mkdir()
+    # As run_queue, without the cores other processes are pinned to
+    taken = runqueue.taken_cores()
+    cores = sorted(c for c in os.sched_getaffinity(0) if c not in taken)
+    if not cores:
+        raise Skipped("no free cores")
+    saved = runqueue.SCRIPTS_PATH
+    runqueue.SCRIPTS_PATH = str(scripts)
+
+    def run() -> int:
+        tasks = [
+            runqueue.Task(runqueue.Fuzzer("aflnet"),
+                          runqueue.Target("lightftp"),
+                          outdir,
+                          1,
+                          trial_idx=i,
+                          only_cov=True,
+                          shard=j,
+                          shards=2) for i in range(25 * scale)
+            for j in range(2)
+        ]
+        jobs = runqueue.build_graph(tasks)
+        sched = runqueue.Scheduler(jobs, runqueue.CorePool(cores),
+                                   len(cores), 4)
+        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
+            sched.run()
+        if not all(j.ok for j in sched.jobs):
+            raise RuntimeError("runqueue: some jobs failed")
+        return len(jobs)
+
+    try:
+        yield run
+    finally:
+        runqueue.SCRIPTS_PATH = saved
+
+
+@bench("containers", "containers")
+def bench_containers(tmp: Path, scale: int):
+    # The lifecycle of coverage containers: the files of the pipeline and
+    # the inputs of a trial in, a result out
+    archive = tmp.joinpath("out-bench-aflnet-000.tar.gz")
+    trial_archive(archive, 100)
+    workdir = "/home/ubuntu/experiments"
+    sampler = str(HERE.joinpath("nyx-eval", "cov_sample.sh"))
+    specs = [
+        containers.Spec(
+            f"bench-cov-{i}",
+            "pfb-bench-cov",
+            ["cp", f"{workdir}/cov_sample.sh", f"{workdir}/coverage.tar.gz"],
+            cpuset=str(i % os.cpu_count()),
+            cpus=1,
+            put=[(sampler, f"{workdir}/cov_sample.sh")],
+            inputs=[
+                containers.Inputs(str(archive), [
+                    ("out-bench-aflnet/replayable-queue",
+                     f"{workdir}/replayable-queue")
+                ],
+                                  unique=True)
+            ],
+            get=[(f"{workdir}/coverage.tar.gz",
+                  str(tmp.joinpath(f"coverage-{i}.tar.gz")), False)])
+        for i in range(20 * scale)
+    ]
+    with fake_docker(tmp.joinpath("docker.sock")) as srv:
+        manager = containers.ContainerManager(
+            containers.DockerClient(srv.server_address))
+
+        def run() -> int:
+            with open(os.devnull, "w") as f:
+                codes = manager.run(specs, log=f)
+            if codes != [0] * len(specs) or srv.containers:
+                raise RuntimeError(f"containers: exit status {codes}")
+            return len(specs)
+
+        yield run
+
+
+# Runs and results
+
+
+def git_commit() -> Dict:
+    """ Commit of the tree and whether it has uncommitted changes. """
+    def git(*args: str) -> Optional[str]:
+        try:
+            p = subprocess.run(["git", "-C", str(HERE)] + list(args),
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL,
+                               universal_newlines=True)
+        except OSError:
+            return None
+        return p.stdout.strip() if p.returncode == 0 else None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status)}
+
+
+def measure(b: Bench, scale: int, repeat: int) -> Dict:
+    """ Peak memory of a run of the stage, then `repeat` timed runs. """
+    with tempfile.TemporaryDirectory(prefix="pfb-bench-") as tmp:
+        with b.setup(Path(tmp), scale) as run:
+            # Also warms up caches and lazy imports
+            tracemalloc.start()
+            try:
+                run()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            seconds = []
+            for _ in range(repeat):
+                start = perf_counter()
+                items = run()
+                seconds.append(perf_counter() - start)
+    best = min(seconds)
+    return {
+        "bench": b.name,
+        "scale": scale,
+        "items": items,
+        "unit": b.unit,
+        "seconds": seconds,
+        "best": best,
+        "rate": items / best if best > 0 else None,
+        "peak_bytes": peak
+    }
+
+
+def run_benches(names: List[str], scale: int, repeat: int,
+                out: Optional[Path]) -> bool:
+    meta = dict(git_commit(),
+                date=datetime.now().isoformat(timespec="seconds"),
+                host=platform.node(),
+                python=platform.python_version())
+    ok = True
+    for name in names:
+        b = BENCHES[name]
+        try:
+            r = measure(b, scale, repeat)
+        except Skipped as e:
+            print(f"{name:18} skipped: {e}")
+            continue
+        except Exception as e:
+            print(f"{name:18} failed: {e!r}")
+            ok = False
+            continue
+        print(f"{name:18} {r['rate']:12.1f} {b.unit}/s "
+              f"({r['items']} in {r['best']:.3f}s, "
+              f"peak {r['peak_bytes'] / 2**20:.1f} MiB)")
+        if out is not None:
+            with out.open("a") as f:
+                f.write(json.dumps(dict(meta, **r)) + "\n")
+    return ok
+
+
+def read_results(path: Path) -> List[Dict]:
+    with path.open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def resolve(rev: str) -> str:
+    """ Full hash of a revision, or `rev` itself to match as a prefix. """
+    try:
+        p = subprocess.run(
+            ["git", "-C",
+             str(HERE), "rev-parse", "--verify", f"{rev}^{{commit}}"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+    except OSError:
+        return rev
+    return p.stdout.strip() if p.returncode == 0 else rev
+
+
+def latest(results: List[Dict], rev: str) -> Dict[tuple, Dict]:
+    """ Latest result of every stage and scale measured on `rev`. """
+    rev = resolve(rev)
+    out = {}
+    for r in results:
+        if (r.get("commit") or "").startswith(rev):
+            out[(r["bench"], r["scale"])] = r
+    return out
+
+
+def compare(results: List[Dict], base: str, head: str,
+            threshold: float) -> bool:
+    """
+    Prints the change of throughput and peak memory of every stage from
+    `base` to `head`; False if a stage got slower by more than `threshold`.
+    """
+    old, new = latest(results, base), latest(results, head)
+    if not old or not new:
+        missing = base if not old else head
+        raise ValueError(f"no results for {missing}")
+    ok = True
+    print(f"{'stage':18} {'scale':>5} {'base/s':>12} {'head/s':>12} "
+          f"{'speed':>7} {'memory':>7}")
+    for key in sorted(set(old) & set(new)):
+        o, n = old[key], new[key]
+        speed = n["rate"] / o["rate"] if o["rate"] and n["rate"] else 1
+        mem = n["peak_bytes"] / o["peak_bytes"] if o["peak_bytes"] else 1
+        flag = ""
+        if speed < 1 - threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{key[0]:18} {key[1]:5} {o['rate']:12.1f} {n['rate']:12.1f} "
+              f"{speed:6.2f}x {mem:6.2f}x{flag}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:18} {key[1]:5} only measured on "
+              f"{'base' if key in old else 'head'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the evaluation pipeline")
+    parser.add_argument("-o",
+                        "--results",
+                        type=Path,
+                        default=Path(RESULTS),
+                        help=f"Results file [default: {RESULTS}]")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="Run the benchmarks")
+    run.add_argument("-k",
+                     "--select",
+                     action="append",
+                     help="Only run stages matching this regex")
+    run.add_argument("-n",
+                     "--scale",
+                     type=int,
+                     default=1,
+                     help="Size of the synthetic data [default: 1]")
+    run.add_argument("-r",
+                     "--repeat",
+                     type=int,
+                     default=3,
+                     help="Timed runs per stage [default: 3]")
+    run.add_argument("--no-save",
+                     action="store_true",
+                     help="Don't append the results to the file")
+    sub.add_parser("list", help="List the stages")
+    cmp = sub.add_parser("compare", help="Compare the results of commits")
+    cmp.add_argument("-t",
+                     "--threshold",
+                     type=float,
+                     default=0.1,
+                     help="Slowdown reported as regression [default: 0.1]")
+    cmp.add_argument("base", help="Base commit")
+    cmp.add_argument("head",
+                     nargs="?",
+                     default="HEAD",
+                     help="Commit to compare [default: HEAD]")
+    sub.add_parser("serve",
+                   help="Run the dummy server the replay stages send to")
+    fake = sub.add_parser("fake-docker",
+                          help="Serve the fake Docker API of the benchmarks")
+    fake.add_argument("socket", type=Path, help="Path of the Unix socket")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        serve()
+    elif args.cmd == "fake-docker":
+        print(f"Fake Docker API on unix://{args.socket.absolute()}")
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            with fake_docker(args.socket):
+                threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    elif args.cmd == "list":
+        for b in BENCHES.values():
+            print(f"{b.name:18} {b.unit}/s")
+    elif args.cmd == "run":
+        names = [
+            n for n in BENCHES if args.select is None or any(
+                re.search(k, n) for k in args.select)
+        ]
+        if not names:
+            parser.error("no stage matches")
+        if args.scale < 1 or args.repeat < 1:
+            parser.error("scale and repeat must be positive")
+        out = None if args.no_save else args.results
+        start = time()
+        ok = run_benches(names, args.scale, args.repeat, out)
+        print(f"Done in {time() - start:.0f}s" +
+              ("" if out is None else f", results in {out}"))
+        sys.exit(0 if ok else 1)
+    else:
+        try:
+            ok = compare(read_results(args.results), args.base, args.head,
+                         args.threshold)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
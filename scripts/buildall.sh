@@ -9,21 +9,16 @@ if [ ! -d "$subjectsdir" ]; then
 fi
 
 tmp=$(mktemp)
-for subject_dir in "$subjectsdir"/*; do
-    subject=$(basename "$subject_dir")
-    echo "* Subj: $subject"
-    for target_dir in "$subject_dir"/*; do
-        target=$(basename "$target_dir")
-        echo "  + $target"
-        echo "    $target_dir"
-        target_tag="${target,,}"
-        if [ "$target" = PureFTPD ]; then
-            target_tag='pure-ftpd'
-        fi
-        image="pfb-$target_tag"
-        echo "sudo docker build -t $image $target_dir" >> "$tmp"
-    done
-done
+# Names and directories of the subjects, from their subject.json
+if ! subjects=$(python3 "$ROOTDIR/scripts/subjects.py" -d "$subjectsdir" list); then
+    exit 1
+fi
+while read -r target target_dir; do
+    echo "  + $target"
+    echo "    $target_dir"
+    image="pfb-$target"
+    echo "sudo docker build -t $image $target_dir" >> "$tmp"
+done <<< "$subjects"
 
 echo "Running commands from $tmp"
 parallel -j20 < "$tmp"
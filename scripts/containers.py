@@ -0,0 +1,734 @@
+#!/usr/bin/env python3
+"""
+Runs the containers of the pipeline through the Docker Engine API on its
+Unix socket (DOCKER_HOST or /var/run/docker.sock), instead of a `sudo
+docker` process for every create, cp, start, wait and rm.
+
+A container is described by a spec, one JSON object per line, as printed by
+`coverage.sh -J`, `profuzzbench_exec_common.sh -J` or `containers.py spec`:
+
+- name, image, cmd: as for `docker create`
+- cpuset, cpus, env, cap_add: --cpuset-cpus, --cpus, -e and --cap-add
+- put: host files or directories copied into the container (as docker cp)
+- inputs: directories of a trial streamed into the container with
+  trial_inputs.py (source, mappings, unique, shards, shard); missing ones
+  fail the container unless `optional`
+- get: files copied out of the container once it exited; missing ones fail
+  the container unless `optional`
+
+A ContainerManager runs batches of specs with a single client, which keeps
+one connection to the daemon per thread: all the containers are created and
+filled, then started, and their results are copied out as they exit. The
+containers are always removed, also on an interrupt; those of a manager that
+was killed are removed by `containers.py cleanup`, since every container is
+labelled with the host and PID of its manager.
+
+    coverage.sh -c 3 -i 0 -t exim -d /out -J | containers.py run
+    containers.py cleanup
+
+The socket must be accessible without sudo (e.g. be in the docker group).
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import posixpath
+import signal
+import socket
+import sys
+import tarfile
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Dict, Iterable, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).absolute().parent.joinpath("nyx-eval")))
+import trial_inputs  # noqa: E402
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+# Label of the containers with the host:pid of their manager
+LABEL = "pfb.manager"
+# Connections used at once for creating, filling and starting a batch
+WORKERS = 8
+# Seconds to wait for the daemon (not for containers to exit)
+TIMEOUT = 300
+
+
+class DockerError(Exception):
+    """ An error returned by the daemon (or no daemon at all). """
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def default_socket() -> str:
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    if host:
+        raise DockerError(f"Unsupported DOCKER_HOST '{host}' (only unix://)")
+    return DEFAULT_SOCKET
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerClient:
+    """
+    The few endpoints of the Docker Engine API used here. Requests of a
+    thread reuse its connection (keep-alive); waiting for a container and
+    streaming archives in use their own.
+    """
+    def __init__(self, socket_path: Optional[str] = None):
+        self.socket_path = socket_path or default_socket()
+        self._local = threading.local()
+
+    def _conn(self) -> UnixConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = UnixConnection(self.socket_path)
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @staticmethod
+    def _url(path: str, params: Optional[Dict] = None) -> str:
+        if not params:
+            return path
+        return f"{path}?{urllib.parse.urlencode(params)}"
+
+    @staticmethod
+    def _check(resp: http.client.HTTPResponse, ok: Iterable[int]) -> bytes:
+        data = resp.read()
+        if resp.status in ok:
+            return data
+        try:
+            message = json.loads(data)["message"]
+        except (ValueError, KeyError, TypeError):
+            message = data.decode(errors="replace").strip() or resp.reason
+        raise DockerError(message, resp.status)
+
+    def request(self,
+                method: str,
+                path: str,
+                params: Optional[Dict] = None,
+                body: Optional[object] = None,
+                ok: Iterable[int] = (200, 201, 204)) -> bytes:
+        """
+        A request on the connection of the thread; JSON-encodes `body`. A
+        connection closed by the daemon while idle is opened again.
+        """
+        url = self._url(path, params)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                conn.request(method, url, body=data, headers=headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                self._drop()
+                if attempt:
+                    raise DockerError("Connection to the daemon lost")
+            except OSError as e:
+                self._drop()
+                raise DockerError(f"{self.socket_path}: {e}")
+        return self._check(resp, ok)
+
+    def call(self, method: str, path: str, **kwargs) -> Optional[object]:
+        data = self.request(method, path, **kwargs)
+        return json.loads(data) if data else None
+
+    def ping(self):
+        self.request("GET", "/_ping")
+
+    def create(self, spec: "Spec", labels: Dict[str, str]) -> str:
+        host: Dict[str, object] = {}
+        if spec.cpuset is not None:
+            host["CpusetCpus"] = spec.cpuset
+        if spec.cpus is not None:
+            host["NanoCpus"] = int(spec.cpus * 1e9)
+        if spec.cap_add:
+            host["CapAdd"] = list(spec.cap_add)
+        # Like `docker create -it`
+        body = {
+            "Image": spec.image,
+            "Cmd": list(spec.cmd),
+            "Env": [f"{k}={v}" for k, v in spec.env.items()],
+            "Tty": True,
+            "OpenStdin": True,
+            "Labels": labels,
+            "HostConfig": host
+        }
+        r = self.call("POST",
+                      "/containers/create",
+                      params={"name": spec.name},
+                      body=body)
+        return r["Id"]
+
+    def start(self, cid: str):
+        self.request("POST", f"/containers/{cid}/start", ok=(204, 304))
+
+    def wait(self, cid: str) -> int:
+        """ Waits until the container exits, returns its exit status. """
+        conn = UnixConnection(self.socket_path, timeout=None)
+        try:
+            conn.request("POST", f"/containers/{cid}/wait")
+            r = json.loads(self._check(conn.getresponse(), (200, )))
+        except OSError as e:
+            raise DockerError(f"{self.socket_path}: {e}")
+        finally:
+            conn.close()
+        return r["StatusCode"]
+
+    def remove(self, cid: str):
+        """ Kills and removes the container (if still there). """
+        self.request("DELETE",
+                     f"/containers/{cid}",
+                     params={
+                         "force": 1,
+                         "v": 1
+                     },
+                     ok=(204, 404))
+
+    def logs(self, cid: str) -> bytes:
+        # A TTY: the output is not multiplexed
+        return self.request("GET",
+                            f"/containers/{cid}/logs",
+                            params={
+                                "stdout": 1,
+                                "stderr": 1
+                            })
+
+    def containers(self, label: str) -> List[Dict]:
+        """ All the containers with this label (running or not). """
+        return self.call("GET",
+                         "/containers/json",
+                         params={
+                             "all": 1,
+                             "filters": json.dumps({"label": [label]})
+                         })
+
+    def put_archive(self, cid: str, path: str, tar: IO[bytes]):
+        """ Extracts a tar (streamed in chunks) at `path` in the container. """
+        conn = UnixConnection(self.socket_path)
+        try:
+            conn.request("PUT",
+                         self._url(f"/containers/{cid}/archive",
+                                   {"path": path}),
+                         body=tar,
+                         headers={"Content-Type": "application/x-tar"},
+                         encode_chunked=True)
+            self._check(conn.getresponse(), (200, ))
+        except OSError as e:
+            raise DockerError(f"{self.socket_path}: {e}")
+        finally:
+            conn.close()
+
+    def get_file(self, cid: str, path: str, dest: Path):
+        """ Copies a file out of the container (as `docker cp`). """
+        conn = self._conn()
+        tmp = dest.with_name(f".{dest.name}.part")
+        try:
+            conn.request("GET",
+                         self._url(f"/containers/{cid}/archive",
+                                   {"path": path}))
+            resp = conn.getresponse()
+            if resp.status != 200:
+                self._check(resp, (200, ))
+            with tarfile.open(fileobj=resp, mode="r|") as tar:
+                m = tar.next()
+                if m is None or not m.isfile():
+                    raise DockerError(f"{path} is not a file")
+                with tmp.open("wb") as f:
+                    src = tar.extractfile(m)
+                    while True:
+                        chunk = src.read(1 << 20)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+            tmp.replace(dest)
+            # The rest of the archive (padding)
+            resp.read()
+        except (OSError, tarfile.TarError, http.client.HTTPException) as e:
+            self._drop()
+            if tmp.exists():
+                tmp.unlink()
+            raise DockerError(f"{cid[:12]}:{path}: {e}")
+
+
+class Inputs:
+    """ Directories of a trial streamed in with trial_inputs.py. """
+    def __init__(self,
+                 source: str,
+                 mappings: Iterable[Tuple[str, str]],
+                 unique: bool = False,
+                 shards: int = 1,
+                 shard: int = 0,
+                 optional: bool = False):
+        self.source = source
+        self.mappings = [tuple(m) for m in mappings]
+        self.unique = unique
+        self.shards = shards
+        self.shard = shard
+        self.optional = optional
+
+    def to_dict(self) -> Dict:
+        return dict(vars(self), mappings=[list(m) for m in self.mappings])
+
+
+class Spec:
+    """ A container to run (see the module docstring). """
+    def __init__(self,
+                 name: str,
+                 image: str,
+                 cmd: Iterable[str],
+                 cpuset: Optional[str] = None,
+                 cpus: Optional[float] = None,
+                 env: Optional[Dict[str, str]] = None,
+                 cap_add: Iterable[str] = (),
+                 put: Iterable[Tuple[str, str]] = (),
+                 inputs: Iterable[Inputs] = (),
+                 get: Iterable[Tuple[str, str, bool]] = ()):
+        self.name = name
+        self.image = image
+        self.cmd = list(cmd)
+        self.cpuset = cpuset
+        self.cpus = cpus
+        self.env = dict(env or {})
+        self.cap_add = list(cap_add)
+        self.put = [tuple(p) for p in put]
+        self.inputs = list(inputs)
+        self.get = [tuple(g) for g in get]
+
+    def __str__(self):
+        return self.name
+
+    def to_dict(self) -> Dict:
+        d = dict(vars(self))
+        d["put"] = [list(p) for p in self.put]
+        d["inputs"] = [i.to_dict() for i in self.inputs]
+        d["get"] = [list(g) for g in self.get]
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "Spec":
+        try:
+            d = dict(d)
+            d["inputs"] = [Inputs(**i) for i in d.get("inputs", [])]
+            return cls(**d)
+        except TypeError as e:
+            raise ValueError(f"Invalid container spec: {e}") from None
+
+
+def read_specs(f: Iterable[str]) -> List[Spec]:
+    specs = []
+    for line in f:
+        if line.strip():
+            specs.append(Spec.from_dict(json.loads(line)))
+    return specs
+
+
+def tar_paths(paths: Iterable[Tuple[str, str]]) -> bytes:
+    """
+    A tar of host files or directories renamed to their (absolute) paths in
+    the container, owned by root as with `docker cp`.
+    """
+    def root(info: tarfile.TarInfo) -> tarfile.TarInfo:
+        info.uid = info.gid = 0
+        info.uname = info.gname = "root"
+        return info
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for src, dest in paths:
+            tar.add(src, arcname=dest.lstrip("/"), filter=root)
+    return buf.getvalue()
+
+
+class ContainerManager:
+    """
+    Runs batches of containers with a single client; kill() removes those
+    still running, e.g. on an interrupt.
+    """
+    def __init__(self,
+                 client: Optional[DockerClient] = None,
+                 workers: int = WORKERS):
+        self.client = client or DockerClient()
+        self.workers = workers
+        self.label = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        # Containers not removed yet and who runs them
+        self._owners: Dict[str, object] = {}
+        # Owners whose containers were killed; they can't run new ones
+        self._killed: List[object] = []
+
+    def _track(self, cid: str, owner: object):
+        with self._lock:
+            self._owners[cid] = owner
+            killed = any(o is owner for o in self._killed)
+        if killed:
+            self._remove(cid)
+            raise DockerError(f"{cid[:12]}: killed")
+
+    def _remove(self, cid: str):
+        try:
+            self.client.remove(cid)
+        except DockerError as e:
+            print(f"[!] Could not remove {cid[:12]}: {e}", file=sys.stderr)
+            return
+        with self._lock:
+            self._owners.pop(cid, None)
+
+    def _stream_inputs(self, cid: str, inp: Inputs):
+        """ Streams the inputs of a trial through a pipe into put_archive. """
+        r, w = os.pipe()
+        result: List[object] = []
+
+        def produce():
+            try:
+                with os.fdopen(w, "wb") as out:
+                    found, _, _ = trial_inputs.stream(inp.source,
+                                                      dict(inp.mappings),
+                                                      out, inp.unique,
+                                                      inp.shards, inp.shard)
+                result.append(found)
+            except (OSError, tarfile.TarError) as e:
+                result.append(e)
+
+        t = threading.Thread(target=produce, daemon=True)
+        t.start()
+        try:
+            with os.fdopen(r, "rb") as tar:
+                self.client.put_archive(cid, "/", tar)
+        finally:
+            t.join()
+        if isinstance(result[0], Exception):
+            raise DockerError(f"{inp.source}: {result[0]}")
+        missing = sorted(set(m[0] for m in inp.mappings) - result[0])
+        if missing:
+            raise DockerError(f"{inp.source}: missing {', '.join(missing)}")
+
+    def _prepare(self, spec: Spec, owner: object) -> str:
+        """ Creates the container and copies its files and inputs in. """
+        cid = self.client.create(spec, {LABEL: self.label})
+        self._track(cid, owner)
+        try:
+            if spec.put:
+                self.client.put_archive(cid, "/",
+                                        io.BytesIO(tar_paths(spec.put)))
+            for inp in spec.inputs:
+                try:
+                    self._stream_inputs(cid, inp)
+                except DockerError as e:
+                    if not inp.optional:
+                        raise
+                    print(f"[!] {spec}: {e}", file=sys.stderr)
+        except BaseException:
+            self._remove(cid)
+            raise
+        return cid
+
+    def _finish(self, spec: Spec, cid: str,
+                log: Optional[IO[str]]) -> Optional[int]:
+        """
+        Waits for the container, copies its results out and removes it.
+        Returns its exit status, None if a result is missing.
+        """
+        out = log or sys.stdout
+        try:
+            status = self.client.wait(cid)
+            if log is not None:
+                log.write(self.client.logs(cid).decode(errors="replace"))
+            print(f"{spec}: exited with status {status}", file=out)
+            for src, dest, optional in spec.get:
+                try:
+                    self.client.get_file(cid, src, Path(dest))
+                except DockerError as e:
+                    print(f"[!] {spec}: {e}", file=out)
+                    if not optional:
+                        return None
+            return status
+        except DockerError as e:
+            print(f"[!] {spec}: {e}", file=out)
+            return None
+        finally:
+            out.flush()
+            self._remove(cid)
+
+    def run(self,
+            specs: List[Spec],
+            log: Optional[IO[str]] = None,
+            owner: object = None) -> List[Optional[int]]:
+        """
+        Runs a batch of containers: creates and fills all of them, then
+        starts them and collects their results as they exit (the output of
+        the containers goes to `log`). Returns the exit status of each
+        container, None for those whose results are missing; raises
+        DockerError if a container can't be created, filled or started.
+        """
+        if not specs:
+            return []
+        batch = ThreadPoolExecutor(max_workers=min(len(specs), self.workers))
+        # One thread per container waiting for it
+        waits = ThreadPoolExecutor(max_workers=len(specs))
+        cids: List[str] = []
+        try:
+            futures = [batch.submit(self._prepare, s, owner) for s in specs]
+            errors = []
+            for f in futures:
+                try:
+                    cids.append(f.result())
+                except DockerError as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+            list(batch.map(self.client.start, cids))
+            return list(
+                waits.map(lambda sc: self._finish(sc[0], sc[1], log),
+                          zip(specs, cids)))
+        except BaseException:
+            # Also unblocks the threads waiting for the containers
+            self.kill(cids)
+            raise
+        finally:
+            batch.shutdown(wait=True)
+            waits.shutdown(wait=True)
+
+    def kill(self, cids: Optional[Iterable[str]] = None, owner: object = None):
+        """
+        Kills and removes containers of this manager: the given ones, those
+        of `owner` (also those it creates later) or all of them.
+        """
+        with self._lock:
+            if cids is None and owner is not None:
+                self._killed.append(owner)
+            if cids is None:
+                cids = [
+                    c for c, o in self._owners.items()
+                    if owner is None or o is owner
+                ]
+            cids = [c for c in cids if c in self._owners]
+        for cid in cids:
+            self._remove(cid)
+
+    def cleanup(self) -> int:
+        """
+        Removes the containers left by managers on this host that are not
+        running anymore; returns how many.
+        """
+        host = socket.gethostname()
+        removed = 0
+        for c in self.client.containers(LABEL):
+            h, _, pid = c.get("Labels", {}).get(LABEL, "").rpartition(":")
+            if h != host or not pid.isdigit() or pid_alive(int(pid)):
+                continue
+            self.client.remove(c["Id"])
+            removed += 1
+        return removed
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def parse_pair(s: str) -> Tuple[str, str]:
+    src, sep, dest = s.partition("=")
+    if not sep or not src or not dest:
+        raise argparse.ArgumentTypeError(f"expected src=dest, got '{s}'")
+    return src, dest
+
+
+class InputsAction(argparse.Action):
+    """ -t/-T start the inputs of a trial, -m adds mappings to the last. """
+    def __call__(self, parser, namespace, values, option_string=None):
+        entries = getattr(namespace, "inputs") or []
+        if self.dest == "mapping":
+            if not entries:
+                parser.error("-m must follow -t or -T")
+            entries[-1].mappings.append(
+                trial_inputs.parse_mapping(f"{values[0]}={values[1]}"))
+        else:
+            entries.append(
+                Inputs(os.path.abspath(values), [],
+                       optional=option_string in ("-T", "--optional-inputs")))
+        namespace.inputs = entries
+
+
+def spec_from_args(args: argparse.Namespace) -> Spec:
+    for inp in args.inputs or []:
+        if not inp.mappings:
+            raise ValueError(f"No mappings (-m) for the inputs {inp.source}")
+        inp.unique = args.unique
+        inp.shards = args.shards
+        inp.shard = args.shard
+    get = [(src, os.path.abspath(dest), False) for src, dest in args.get]
+    get += [(src, os.path.abspath(dest), True) for src, dest in args.get_opt]
+    return Spec(args.name,
+                args.image,
+                args.command,
+                cpuset=args.cpuset,
+                cpus=args.cpus,
+                env=dict(args.env),
+                cap_add=args.cap_add,
+                put=[(os.path.abspath(s), posixpath.normpath(d))
+                     for s, d in args.put],
+                inputs=args.inputs or [],
+                get=get)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run containers through the Docker API")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("spec", help="Print the spec of a container")
+    p.add_argument("-n", "--name", required=True, help="Container name")
+    p.add_argument("-i", "--image", required=True, help="Image")
+    p.add_argument("-c", "--cpuset", help="Cores it may run on")
+    p.add_argument("--cpus", type=float, help="CPU quota")
+    p.add_argument("-e",
+                   "--env",
+                   type=parse_pair,
+                   action="append",
+                   default=[],
+                   metavar="KEY=VALUE",
+                   help="Environment variable")
+    p.add_argument("--cap-add",
+                   action="append",
+                   default=[],
+                   help="Linux capability")
+    p.add_argument("-p",
+                   "--put",
+                   type=parse_pair,
+                   action="append",
+                   default=[],
+                   metavar="SRC=DEST",
+                   help="Copy a host file or directory into the container")
+    p.add_argument("-t",
+                   "--inputs",
+                   action=InputsAction,
+                   metavar="TRIAL",
+                   help="Stream inputs of a trial (archive or directory)")
+    p.add_argument("-T",
+                   "--optional-inputs",
+                   action=InputsAction,
+                   dest="inputs",
+                   metavar="TRIAL",
+                   help="Same, but missing directories are not an error")
+    p.add_argument("-m",
+                   "--mapping",
+                   action=InputsAction,
+                   type=parse_pair,
+                   metavar="SRC=DEST",
+                   help="Directory of the last trial and its container path")
+    p.add_argument("-u",
+                   "--unique",
+                   action="store_true",
+                   help="Keep only one input with the same payload")
+    p.add_argument("-k",
+                   "--shards",
+                   type=int,
+                   default=1,
+                   help="Split the inputs in this many shards")
+    p.add_argument("-x",
+                   "--shard",
+                   type=int,
+                   default=0,
+                   help="Only keep the inputs of this shard")
+    p.add_argument("-g",
+                   "--get",
+                   type=parse_pair,
+                   action="append",
+                   default=[],
+                   metavar="SRC=DEST",
+                   help="Copy a file out of the container once it exited")
+    p.add_argument("-G",
+                   "--get-opt",
+                   type=parse_pair,
+                   action="append",
+                   default=[],
+                   metavar="SRC=DEST",
+                   help="Same, but a missing file is not an error")
+    p.add_argument("command",
+                   nargs="+",
+                   metavar="cmd",
+                   help="Command of the container")
+    p = sub.add_parser("run", help="Run the containers of specs")
+    p.add_argument("specs",
+                   nargs="?",
+                   type=argparse.FileType("r"),
+                   default=sys.stdin,
+                   help="Specs, one per line [default: stdin]")
+    p.add_argument("-l",
+                   "--log",
+                   type=argparse.FileType("a"),
+                   help="Append the output of the containers to this file")
+    sub.add_parser("cleanup",
+                   help="Remove the containers of managers that are gone")
+    args = parser.parse_args()
+
+    if args.cmd == "spec":
+        if args.shards < 1 or not 0 <= args.shard < args.shards:
+            parser.error("the shard must be in [0, shards)")
+        try:
+            print(json.dumps(spec_from_args(args).to_dict()))
+        except ValueError as e:
+            parser.error(str(e))
+        return
+
+    try:
+        manager = ContainerManager()
+        if args.cmd == "cleanup":
+            print(f"Removed {manager.cleanup()} containers")
+            return
+        specs = read_specs(args.specs)
+    except (DockerError, ValueError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # Also clean up when killed by runqueue.py or timeout
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        codes = manager.run(specs, args.log)
+    except DockerError as e:
+        print(f"[!] {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("Killed by user", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0 if all(c is not None for c in codes) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,10 +20,12 @@ TIMEOUT=$((60 * 60))
 SKIPCOUNT=1
 SINGLE_INDEX=0
 NO_SEEDS=0
+# Print the container specs instead of running the containers (see -J)
+JSON=0
 
 function usage {
     echo -n "usage: $0 [-h] (-c core -i index | -r trials) -t target -d outdir -f fuzzer "
-    echo "-O fuzz-opts [-T time] [-S gcov-skip]"
+    echo "-O fuzz-opts [-T time] [-S gcov-skip] [-J]"
     echo "  -c do a single run on the given core"
     echo "  -i index of the single run to do (i.e. determines the name of the output archive)"
     echo "  -r number of trials / runs"
@@ -33,6 +35,8 @@ function usage {
     echo "  -O additional options to pass to the fuzzer (quote as a single string)"
     echo "  -T time to run each trial"
     echo "  -S skip count to \"sample\" while computing coverage"
+    echo "  -J print the specs of the containers for scripts/containers.py as JSON lines"
+    echo "     instead of running them (everything else goes to stderr)"
     exit 1
 }
 
@@ -50,7 +54,7 @@ function assert_posnum {
     fi
 }
 
-while getopts ":hc:i:r:t:d:f:O:T:S:" opt; do
+while getopts ":hc:i:r:t:d:f:O:T:S:J" opt; do
     case ${opt} in
         h)
             usage
@@ -87,6 +91,9 @@ while getopts ":hc:i:r:t:d:f:O:T:S:" opt; do
             assert_posnum "$OPTARG" "$opt"
             SKIPCOUNT=${OPTARG}
             ;;
+        J)
+            JSON=1
+            ;;
         *)
             >&2 usage
             ;;
@@ -106,7 +113,16 @@ elif [ -n "$CORE" ] && [ -n "$RUNS" ]; then
     usage
 fi
 
+if [ $JSON = 1 ]; then
+    # Only the specs on stdout, as fd 3
+    exec 3>&1 >&2
+fi
+
 DOCIMAGE="pfb-$TARGET"
+# Decides after which inputs the coverage scripts dump coverage, which run.sh
+# computes once fuzzing is done (see nyx-eval/cov_sample.sh)
+COV_SAMPLE=${COV_SAMPLE:-"$ROOTDIR/scripts/nyx-eval/cov_sample.sh"}
+CONT_COV_SAMPLE=/home/ubuntu/experiments/cov_sample.sh
 OUTDIR="out-$TARGET-$FUZZER"
 FUZZER_TAG=$FUZZER
 if [[ "$FUZZER" =~ "no-seeds" ]]; then
@@ -164,12 +180,35 @@ for i in $(seq 0 $((RUNS - 1))); do
         i=$SINGLE_INDEX
     fi
     cmd="cd ${WORKDIR} && run ${FUZZER} ${OUTDIR} '${OPTIONS}' ${TIMEOUT} ${SKIPCOUNT} ${NO_SEEDS}"
-    id=$($DSUDO docker run --cpus=1 --cpuset-cpus="$core" -d -it \
+    if [ $JSON = 1 ]; then
+        # The same container, run and collected by the caller
+        if ! python3 "$ROOTDIR/scripts/containers.py" spec \
+            -n "$(date '+%Y%m%d%H%M')-$TARGET-$FUZZER_TAG-$i" -i "$DOCIMAGE" \
+            -c "$core" --cpus 1 -p "$COV_SAMPLE=$CONT_COV_SAMPLE" \
+            -g "/home/ubuntu/experiments/${OUTDIR}.tar.gz=${SAVETO}/${OUTDIR}-$(printf "%03d" "$i").tar.gz" \
+            -- /bin/bash -c "$cmd" >&3
+        then
+            >&2 echo "FATAL: invalid container spec"
+            exit 1
+        fi
+        continue
+    fi
+    id=$($DSUDO docker create --cpus=1 --cpuset-cpus="$core" -it \
         --name="$(date '+%Y%m%d%H%M')-$TARGET-$FUZZER_TAG-$i" \
         "$DOCIMAGE" /bin/bash -c "$cmd")
     cids+=("${id::12}") #store only the first 12 characters of a container ID
+    if ! $DSUDO docker cp "$COV_SAMPLE" "${id::12}:$CONT_COV_SAMPLE" || \
+       ! $DSUDO docker start "${id::12}" > /dev/null; then
+        >&2 echo "FATAL: could not start container ${id::12}"
+        $DSUDO docker kill "${cids[@]}" > /dev/null 2>&1
+        exit 1
+    fi
 done
 
+if [ $JSON = 1 ]; then
+    exit 0
+fi
+
 #wait until all these dockers are stopped
 echo "${FUZZER^^}: Fuzzing in progress ..."
 echo "${FUZZER^^}: Waiting for the following containers to stop:" "${cids[@]}"
@@ -28,24 +28,17 @@ NYX_NET_FUZZER_DIR=${NYX_NET_FUZZER_DIR:-"$HOME/nyx-net/fuzzer/rust_fuzzer"}
 NYX_NET_FUZZER_DEBUG_DIR=${NYX_NET_FUZZER_DEBUG_DIR:-"$HOME/nyx-net/fuzzer/rust_fuzzer_debug"}
 NYX_NET_TARGETS_DIR=${NYX_NET_TARGETS_DIR:-"$HOME/nyx-net/targets/packed_targets"}
 
-declare -A ports
-ports['forked-daapd']=3689
-ports['dcmtk']=5158
-ports['dnsmasq']=5353
-ports['tinydtls']=20220
-ports['bftpd']=21
-ports['lightftp']=2200
-ports['proftpd']=21
-ports['pure-ftpd']=21
-ports['live555']=8554
-ports['kamailio']=5060
-ports['exim']=25
-ports['openssh']=22
-ports['openssl']=4433
-
 ROOTDIR=$(readlink -f "$HEREDIR/../../")
 FREECORESBIN="$ROOTDIR/freecores/target/release/freecores"
 
+# ports, protocols, subject_dirs and cov_gcda (coverage scripts supporting
+# gcda_cov.py) of the subjects, from their subject.json (see
+# scripts/subjects.py)
+if ! subjects_decl=$(python3 "$ROOTDIR/scripts/subjects.py" bash); then
+    exit 1
+fi
+eval "$subjects_decl"
+
 # Handler for SIGINT; also terminates all processes in $pids
 function shut_down {
     if [ "${#pids[@]}" -gt 0 ]; then
@@ -12,6 +12,7 @@ function usage {
     echo "  -h print this help"
     echo "  -a append to existing output"
     echo "  -e extract afl* trial data archives first; overwrites previous separate coverage.sh run"
+    echo "  -R seconds downsample to one row per bin of this many seconds (covreduce.py)"
     exit 1
 }
 
@@ -19,7 +20,8 @@ fuzzer_name=nyx
 outcsv=
 append=0
 extract=0
-while getopts ":haer:o:t:d:f:p:" opt; do
+resolution=
+while getopts ":haer:o:t:d:f:p:R:" opt; do
     case ${opt} in
         h)
             usage
@@ -49,6 +51,10 @@ while getopts ":haer:o:t:d:f:p:" opt; do
         p)
             validate_snap_placement
             ;;
+        R)
+            validate_posnum "$OPTARG" "$opt"
+            resolution=${OPTARG}
+            ;;
         :)
             no_arg_error
             ;;
@@ -101,6 +107,14 @@ convert() {
     if [ "$snap_placement" != "none" ]; then
         fuzzer_tag="$fuzzer_name-$snap_placement"
     fi
+    if [ -n "$resolution" ]; then
+        if ! python3 "$HEREDIR/../analysis/covreduce.py" -R "$resolution" -a -o "$outcsv" \
+            raw -t "$target" -f "$fuzzer_tag" -r "$run_index" "$ifile"; then
+            >&2 error "Failed to downsample $ifile"
+            exit 1
+        fi
+        return
+    fi
     tail -n +2 "$ifile" | while read -r line; do
         time=$(strim "$(echo "$line" | cut -d',' -f1)")
         l_per=$(strim "$(echo "$line" | cut -d',' -f2)")
@@ -0,0 +1,62 @@
+# Decides after which test cases the cov_script*.sh scripts dump coverage;
+# sourced by them, coverage.sh and profuzzbench_exec_common.sh copy it into
+# the containers:
+#
+#   cov_sample TIME       after replaying a test case found at TIME (mtime)
+#   cov_sample_end TIME   after the last one, dumps it unless already done
+#
+# By default coverage is dumped every $step test cases. With COV_RESOLUTION
+# (seconds, see coverage.sh -a) the dumps follow the fuzzing time instead:
+# coverage is dumped once the test cases are COV_RESOLUTION seconds past
+# the last dump. While coverage doesn't grow the gap doubles, up to
+# COV_MAX_GAP (default 8 times the resolution), and it is back to the
+# resolution as soon as coverage grows again. Early in a run, when the fuzzer
+# finds many test cases per second, this dumps far less often than a fixed
+# step; later, when test cases are minutes apart, every one still gets a
+# point on the curve.
+
+# Test cases replayed since the last dump
+cs_count=0
+# Time and coverage (=== line of dump_coverage) of the last dump
+cs_time=
+cs_cov=
+cs_res=${COV_RESOLUTION:-0}
+cs_gap=$cs_res
+cs_max_gap=${COV_MAX_GAP:-$((cs_res * 8))}
+
+function cs_dump {
+    local time=$1 out cov
+    out=$(dump_coverage "$time")
+    echo "$out"
+    cov=${out##*=== }
+    cov=${cov%%$'\n'*}
+    if [ -n "$cs_cov" ] && [ "$cov" = "$cs_cov" ]; then
+        cs_gap=$((cs_gap * 2))
+        [ "$cs_gap" -gt "$cs_max_gap" ] && cs_gap=$cs_max_gap
+    else
+        cs_gap=$cs_res
+    fi
+    cs_cov=$cov
+    cs_time=$time
+    cs_count=0
+}
+
+function cov_sample {
+    local time=$1
+    cs_count=$((cs_count + 1))
+    if [ "$cs_res" -gt 0 ]; then
+        if [ -z "$cs_time" ] || [ $((time - cs_time)) -ge "$cs_gap" ]; then
+            cs_dump "$time"
+        fi
+    elif [ $((cs_count % step)) = 0 ]; then
+        cs_dump "$time"
+    fi
+    return 0
+}
+
+function cov_sample_end {
+    if [ "$cs_count" -gt 0 ]; then
+        cs_dump "$1"
+    fi
+    return 0
+}
@@ -2,9 +2,24 @@
 
 # Skip count for dumping coverage (i.e. invoking gcovr).
 step=5
+# Resolution of adaptive sampling in seconds of fuzzing time (see -a)
+resolution=
+# Read coverage with gcda_cov.py where the coverage script supports it (see -g)
+gcda=0
 
 fuzzer=nyx
 
+# Number of shards the inputs of a trial are split into (see -k)
+shards=1
+shard=
+merge=0
+# Only extract the archive of an AFL-based trial (see -X)
+extract_only=0
+# Replay inputs with the same payload only once (see -U)
+dedup=1
+# Print the container specs instead of running the containers (see -J)
+json=0
+
 # Don't use the default trap in common.bash
 NOTRAP=1
 # Run docker commands with sudo
@@ -15,22 +30,31 @@ HEREDIR=$(readlink -f "$(dirname "$0")")
 source "$HEREDIR/common.bash"
 
 function usage {
-    echo -n "usage: $0 [-hnD] (-r trials | -c core [-i index]) [-s step] "
-    echo "-d outdir -t target [-f fuzzer] [-p snap-placement]"
+    echo -n "usage: $0 [-hnD] (-r trials | -c core [-i index]) [-s step | -a seconds] [-g] "
+    echo "-d outdir -t target [-f fuzzer] [-p snap-placement] [-k shards (-x shard | -m)] [-X] [-U] [-J]"
     usage_flag r
     usage_flag c
     usage_flag i
     echo "  -s invoke dumping coverage (e.g. gcovr) every this many inputs"
+    echo "  -a dump coverage adaptively, once inputs are this many seconds of fuzzing time"
+    echo "     past the last dump (more while coverage doesn't grow, see cov_sample.sh)"
     usage_flag t
     usage_flag d
     echo "  -f fuzzer that ran; one of nyx, aflnet or aflnwe"
     echo "  -p snapshot placement strategy; only used for path here"
+    echo "  -k split the inputs of the trial in this many shards (requires -c)"
+    echo "  -x only replay the inputs of this shard (in [0, shards))"
+    echo "  -m merge the coverage of the shards of the trial"
+    echo "  -X only extract the archive of the trial (requires -c; not for nyx)"
+    echo "  -U replay all inputs, also those with the same payload as an earlier one"
+    echo "  -J print the specs of the containers for containers.py as JSON lines instead"
+    echo "     of running them (everything else goes to stderr)"
     exit 1
 }
 
 [ "$#" = 0 ] && usage
 
-while getopts ":hr:c:i:t:nDs:d:f:p:" opt; do
+while getopts ":hr:c:i:t:nDs:a:gd:f:p:k:x:mXUJ" opt; do
     case ${opt} in
         h)
             usage
@@ -60,6 +84,13 @@ while getopts ":hr:c:i:t:nDs:d:f:p:" opt; do
             validate_posnum "$OPTARG" "$opt"
             step=${OPTARG}
             ;;
+        a)
+            validate_posnum "$OPTARG" "$opt"
+            resolution=${OPTARG}
+            ;;
+        g)
+            gcda=1
+            ;;
         d)
             validate_outdir
             ;;
@@ -73,6 +104,26 @@ while getopts ":hr:c:i:t:nDs:d:f:p:" opt; do
         p)
             validate_snap_placement
             ;;
+        k)
+            validate_posnum "$OPTARG" "$opt"
+            shards=${OPTARG}
+            ;;
+        x)
+            validate_posnum_z "$OPTARG" "$opt"
+            shard=${OPTARG}
+            ;;
+        m)
+            merge=1
+            ;;
+        X)
+            extract_only=1
+            ;;
+        U)
+            dedup=0
+            ;;
+        J)
+            json=1
+            ;;
         :)
             no_arg_error
             ;;
@@ -89,6 +140,31 @@ fi
 
 validate_core_or_runs
 
+if [ $json = 1 ]; then
+    # Only the specs on stdout, as fd 3
+    exec 3>&1 >&2
+fi
+
+if [ $extract_only = 1 ]; then
+    if [ -z "$single_core" ] || [[ "$fuzzer" =~ "nyx" ]]; then
+        >&2 error "Extracting only (-X) requires a single run (-c) of an AFL-based fuzzer"
+        >&2 usage
+    fi
+fi
+
+if [ "$shards" -gt 1 ]; then
+    if [ -z "$single_core" ]; then
+        >&2 error "Shards (-k) require a single run (-c)"
+        >&2 usage
+    fi
+    if [ $merge = 0 ] && { [ -z "$shard" ] || [ "$shard" -ge "$shards" ]; }; then
+        >&2 error "Invalid value: -x expects a shard index in [0, $shards)"
+        >&2 usage
+    fi
+    # Merging the shards needs the trace of gcda_cov.py
+    gcda=1
+fi
+
 if [ -z "$single_core" ]; then
     get_free_cores
 else
@@ -119,6 +195,14 @@ if [ -z "${ports[$target]}" ]; then
     exit 1
 fi
 
+if [ $gcda = 1 ] && [ -z "${cov_gcda[$target]}" ]; then
+    if [ "$shards" -gt 1 ]; then
+        >&2 error "Shards (-k) need coverage scripts supporting gcda_cov.py, $target's don't"
+        exit 1
+    fi
+    >&2 warn "The coverage scripts of $target don't support gcda_cov.py, -g has no effect"
+fi
+
 # Working directory in container
 cont_workdir="/home/ubuntu/experiments"
 
@@ -162,9 +246,128 @@ cont_inputs_old="$cont_workdir/$inputs_dirname_old"
 cont_output="$cont_workdir/coverage-out"
 # Docker image name
 image="pfb-$target"
+# Image for coverage containers, with the coverage build done (see cov_image)
+cov_image="pfb-$target-cov"
 # Nyx reproducer source
 NYX_NET_REPLAY=${NYX_NET_REPLAY:-"$HOME/nyx-net/packer/packer/nyx_net_payload_executor.py"}
 cont_replay="$cont_workdir/nyx_replay.py"
+# Incremental coverage collector (used by cov_script*.sh if present)
+GCDA_COV=${GCDA_COV:-"$HEREDIR/gcda_cov.py"}
+cont_gcda_cov="$cont_workdir/gcda_cov.py"
+# Decides after which inputs coverage is dumped (used by cov_script*.sh)
+COV_SAMPLE=${COV_SAMPLE:-"$HEREDIR/cov_sample.sh"}
+cont_cov_sample="$cont_workdir/cov_sample.sh"
+# Fork server for replaying (built into the coverage image, see build_cov_image)
+FORKSRV="$HEREDIR/forksrv.c"
+
+# Merges the coverage archives of the shards of a trial into coverage.tar.gz
+# and their gcda counters (with gcov-tool, in a container) into gcda.tar.gz
+function merge_shards {
+    local trial_outdir=$1 archives=() gcdas=() merge_cmd j
+    for j in $(seq 0 $((shards - 1))); do
+        archives+=("$trial_outdir/coverage-shard$j.tar.gz")
+        gcdas+=("gcda-shard$j")
+    done
+    if [ $dryrun = 1 ]; then
+        echo python3 "$HEREDIR/merge_cov_shards.py" -o "$trial_outdir/coverage.tar.gz" "${archives[@]}"
+        return 0
+    fi
+    info "Merging coverage of $shards shards in $trial_outdir"
+    if ! python3 "$HEREDIR/merge_cov_shards.py" -o "$trial_outdir/coverage.tar.gz" "${archives[@]}"; then
+        >&2 error "Failed to merge coverage timelines"
+        return 1
+    fi
+
+    info "Merging gcda counters"
+    read -r -d '' merge_cmd <<- EOF
+set -e
+cd /tmp
+merged=
+for s in ${gcdas[*]}; do
+    mkdir "\$s" && tar -xzf "/shards/\$s.tar.gz" -C "\$s"
+    if [ -z "\$merged" ]; then
+        merged=\$s
+    else
+        gcov-tool merge -o "\$merged-m" "\$merged" "\$s"
+        merged=\$merged-m
+    fi
+done
+tar -czf /shards/gcda.tar.gz -C "\$merged" .
+EOF
+    if ! $DSUDO docker run --rm -u "$(id -u):$(id -g)" \
+        -v "$(readlink -f "$trial_outdir"):/shards" "$image" bash -c "$merge_cmd"
+    then
+        >&2 warn "Failed to merge gcda counters"
+    fi
+    return 0
+}
+
+if [ $merge = 1 ]; then
+    merge_shards "$(get_outdir "$single_index" "$fuzzer")"
+    exit $?
+fi
+
+# Extracts the archive of an AFL-based trial
+function extract_trial {
+    local trial_outdir=$1 tmpdir
+    info "Removing old dirs"
+    [ -d "$trial_outdir" ] && rm -rf "$trial_outdir"
+    info "Extracting archive for $trial_outdir"
+    if ! tmpdir=$(mktemp -d); then
+        >&2 error "Failed to create temporary directory"
+        return 1
+    fi
+    if ! tar -xf "$trial_outdir.tar.gz" -C "$tmpdir"; then
+        >&2 error "Failed to extract archive"
+        return 1
+    fi
+    mv "$tmpdir/out-$target-$fuzzer" "$trial_outdir" && rm -r "$tmpdir" \
+        && touch "$trial_outdir/.extracted"
+}
+
+# Extracts the archive of an AFL-based trial unless the extracted directory
+# is up to date; concurrent runs for the same trial (e.g. shards) extract it
+# only once.
+function extract_trial_once {
+    local trial_outdir=$1
+    (
+        flock 9
+        if [ ! -f "$trial_outdir/.extracted" ] \
+            || [ "$trial_outdir.tar.gz" -nt "$trial_outdir/.extracted" ]
+        then
+            extract_trial "$trial_outdir"
+        else
+            info "$trial_outdir is up to date"
+        fi
+    ) 9< "$trial_outdir.tar.gz"
+}
+
+if [ $extract_only = 1 ]; then
+    trial_outdir=$(get_outdir "$single_index" "$fuzzer")
+    if [ $dryrun = 1 ]; then
+        echo extract_trial_once "$trial_outdir"
+        exit 0
+    fi
+    extract_trial_once "$trial_outdir"
+    exit $?
+fi
+
+# Options of trial_inputs.py (and containers.py): only inputs with a new
+# payload (unless -U) and, with shards, those of the shard
+input_opts=()
+[ $dedup = 1 ] && input_opts+=(-u)
+[ "$shards" -gt 1 ] && input_opts+=(-k "$shards" -x "$shard")
+
+# Copies directories of a trial into container $1 with trial_inputs.py, from
+# $2 (the archive or directory of the trial) as src=dest mappings
+function copy_inputs {
+    local cid=$1 src=$2 status
+    shift 2
+    python3 "$HEREDIR/trial_inputs.py" "${input_opts[@]}" "$src" "$@" \
+        | $DSUDO docker cp - "$cid:/"
+    status=("${PIPESTATUS[@]}")
+    [ "${status[0]}" = 0 ] && [ "${status[1]}" = 0 ]
+}
 
 # Entry command for containers
 if [[ "$fuzzer" =~ "nyx" ]]; then
@@ -185,6 +388,110 @@ cov_script $cont_workdir ${ports[$target]} $step $cont_output/cov_over_time.csv
 EOF
 fi
 
+create_opts=()
+if [ -n "$resolution" ]; then
+    create_opts+=(-e "COV_RESOLUTION=$resolution")
+fi
+if [ $gcda = 1 ]; then
+    create_opts+=(-e "COV_GCDA=1")
+fi
+if [ "$shards" -gt 1 ]; then
+    # Keep the trace of gcda_cov.py and the counters to merge the shards
+    create_opts+=(-e "GCDA_COV_TRACE=$cont_output/trace.csv")
+    cmd="$cmd && cd $cont_workdir && find . -name '*.gcda' | tar -czf $cont_workdir/gcda.tar.gz -T -"
+fi
+
+# Builds $cov_image unless it's up to date: a container of the subject image
+# runs its $cont_workdir/cov_prepare script, if any (e.g. the gcov build of
+# Exim), builds forksrv.so, deletes the gcov counters and is committed,
+# labelled with the ID of the subject image and the hash of forksrv.c.
+# Concurrent runs for the same subject build it only once.
+function build_cov_image {
+    local base_id lock prepare_cmd cid label
+    if ! base_id=$($DSUDO docker image inspect -f '{{.Id}}' "$image"); then
+        >&2 error "Image $image not found"
+        return 1
+    fi
+    base_id="$base_id/$(sha1sum < "$FORKSRV" | cut -d' ' -f1)"
+    lock="${TMPDIR:-/tmp}/$cov_image.lock"
+    (
+        flock 9
+        label=$($DSUDO docker image inspect -f '{{index .Config.Labels "pfb.base"}}' \
+            "$cov_image" 2>/dev/null)
+        if [ "$label" = "$base_id" ]; then
+            info "$cov_image is up to date"
+            exit 0
+        fi
+        info "Building $cov_image from $image"
+        read -r -d '' prepare_cmd <<- EOF
+set -e
+if [ -x $cont_workdir/cov_prepare ]; then $cont_workdir/cov_prepare; fi
+gcc -shared -fPIC -O2 -o $cont_workdir/forksrv.so $cont_workdir/forksrv.c -ldl || true
+find $cont_workdir -name '*.gcda' -delete
+touch $cont_workdir/.cov_prepared
+EOF
+        if ! cid=$($DSUDO docker create "$image" bash -c "$prepare_cmd"); then
+            >&2 error "Could not create container"
+            exit 1
+        fi
+        if ! $DSUDO docker cp "$FORKSRV" "$cid:$cont_workdir/forksrv.c"; then
+            >&2 error "Failed to copy fork server"
+            $DSUDO docker rm "$cid" > /dev/null
+            exit 1
+        fi
+        if ! $DSUDO docker start -a "$cid" > "${TMPDIR:-/tmp}/$cov_image.log" 2>&1; then
+            >&2 error "Coverage build failed, see ${TMPDIR:-/tmp}/$cov_image.log"
+            $DSUDO docker rm "$cid" > /dev/null
+            exit 1
+        fi
+        if ! $DSUDO docker commit -c "LABEL pfb.base=$base_id" -c 'CMD ["/bin/bash"]' \
+            "$cid" "$cov_image" > /dev/null
+        then
+            >&2 error "Could not commit $cov_image"
+            $DSUDO docker rm "$cid" > /dev/null
+            exit 1
+        fi
+        $DSUDO docker rm "$cid" > /dev/null
+    ) 9> "$lock"
+}
+
+if [ $dryrun = 1 ]; then
+    echo build_cov_image "$cov_image"
+elif ! build_cov_image; then
+    exit 1
+fi
+
+# Prints the spec of the coverage container $1 of trial $3 on core $2 (-J):
+# the container below, but created, filled, started and collected by the
+# caller through the Docker API (see containers.py)
+function print_spec {
+    local name=$1 core=$2 trial_outdir=$3 args mapping
+    args=(-n "$name" -i "$cov_image" -c "$core" --cpus 1 --cap-add SYS_PTRACE
+          "${create_opts[@]}")
+    if [ -n "$GCDA_COV" ] && [ -f "$GCDA_COV" ]; then
+        args+=(-p "$GCDA_COV=$cont_gcda_cov")
+    fi
+    args+=(-p "$COV_SAMPLE=$cont_cov_sample")
+    if [[ "$fuzzer" =~ "nyx" ]]; then
+        args+=(-p "$NYX_NET_REPLAY=$cont_replay")
+        args+=(-t "$trial_outdir" -m "$inputs_dirname=$cont_inputs")
+        args+=(-T "$trial_outdir" -m "$inputs_dirname_old=$cont_inputs_old")
+    else
+        args+=(-t "$trial_src")
+        for mapping in "${mappings[@]}"; do
+            args+=(-m "$mapping")
+        done
+    fi
+    args+=("${input_opts[@]}")
+    if [ "$shards" -gt 1 ]; then
+        args+=(-g "$cont_workdir/coverage.tar.gz=$trial_outdir/coverage-shard$shard.tar.gz")
+        args+=(-G "$cont_workdir/gcda.tar.gz=$trial_outdir/gcda-shard$shard.tar.gz")
+    else
+        args+=(-g "$cont_workdir/coverage.tar.gz=$trial_outdir/coverage.tar.gz")
+    fi
+    python3 "$ROOTDIR/scripts/containers.py" spec "${args[@]}" -- bash -c "$cmd"
+}
+
 # Container IDs
 cids=()
 
@@ -217,8 +524,42 @@ for i in $(seq 0 $((runs - 1))); do
         else
             cont_name="$(date '+%Y%m%d%H%M')-cov-$target-$fuzzer-$snap_placement-$i"
         fi
+        if [ "$shards" -gt 1 ]; then
+            cont_name="$cont_name-shard$shard"
+        fi
+
+        if [[ ! "$fuzzer" =~ "nyx" ]]; then
+            if [ "$shards" = 1 ]; then
+                # Straight from the archive, only the coverage results are
+                # written next to it
+                mkdir -p "$trial_outdir"
+                trial_src="$trial_outdir.tar.gz"
+                prefix="out-$target-$fuzzer/"
+            else
+                # Shards select their inputs from the extracted trial
+                if ! extract_trial_once "$trial_outdir"; then
+                    exit 1
+                fi
+                trial_src=$trial_outdir
+                prefix=
+            fi
+            mappings=()
+            for dirname in "$inputs_dirname" "$crashes_dirname" "$hangs_dirname"; do
+                [ -n "$dirname" ] && mappings+=("$prefix$dirname=$cont_workdir/$dirname")
+            done
+        fi
+
+        if [ $json = 1 ]; then
+            if ! print_spec "$cont_name" "$core" "$trial_outdir" >&3; then
+                >&2 error "Invalid container spec for $trial_outdir"
+                exit 1
+            fi
+            continue
+        fi
+
         if ! cid=$($DSUDO docker create -it --cpus=1 --cpuset-cpus="$core" \
-            --name="$cont_name" --cap-add=SYS_PTRACE "$image" bash -c "$cmd")
+            --name="$cont_name" --cap-add=SYS_PTRACE "${create_opts[@]}" \
+            "$cov_image" bash -c "$cmd")
         then
             >&2 error "Could not create container"
             exit 1
@@ -227,53 +568,36 @@ for i in $(seq 0 $((runs - 1))); do
 
         info "Created container $cid"
 
-        if [[ "$fuzzer" =~ "nyx" ]]; then
-            if ! $DSUDO docker cp "$NYX_NET_REPLAY" "$cid:$cont_replay"; then
-                >&2 error "Failed to copy reproducer script"
+        if [ -n "$GCDA_COV" ] && [ -f "$GCDA_COV" ]; then
+            if ! $DSUDO docker cp "$GCDA_COV" "$cid:$cont_gcda_cov"; then
+                >&2 error "Failed to copy coverage collector"
                 exit 1
             fi
-        else
-            info "Removing old dirs"
-            [ -d "$trial_outdir" ] && rm -rf "$trial_outdir"
-            info "Extracting archive for $trial_outdir"
-            if ! tmpdir=$(mktemp -d); then
-                >&2 error "Failed to create temporary directory"
-                exit 1
-            fi
-            if ! tar -xf "$trial_outdir.tar.gz" -C "$tmpdir"; then
-                >&2 error "Failed to extract archive"
-                exit 1
-            fi
-            set -e
-            mv "$tmpdir/out-$target-$fuzzer" "$trial_outdir"
-            rm -r "$tmpdir"
-            set +e
         fi
 
-        if ! $DSUDO docker cp "$trial_outdir/$inputs_dirname" "$cid:$cont_inputs"; then
-            >&2 error "Failed to copy reproducible inputs"
+        if ! $DSUDO docker cp "$COV_SAMPLE" "$cid:$cont_cov_sample"; then
+            >&2 error "Failed to copy coverage sampler"
             exit 1
         fi
 
-	if ! $DSUDO docker cp "$trial_outdir/$inputs_dirname_old" "$cid:$cont_inputs_old"; then
-            >&2 error "Failed to copy reproducible inputs"
-            #exit 1
-        fi
+        if [[ "$fuzzer" =~ "nyx" ]]; then
+            if ! $DSUDO docker cp "$NYX_NET_REPLAY" "$cid:$cont_replay"; then
+                >&2 error "Failed to copy reproducer script"
+                exit 1
+            fi
 
-        if [ -n "$crashes_dirname" ]; then
-            if ! $DSUDO docker cp "$trial_outdir/$crashes_dirname" \
-                "$cid:$cont_workdir/$crashes_dirname"
-            then
-                >&2 error "Failed to copy reproducible crashes"
+            if ! copy_inputs "$cid" "$trial_outdir" "$inputs_dirname=$cont_inputs"; then
+                >&2 error "Failed to copy reproducible inputs"
                 exit 1
             fi
-        fi
 
-        if [ -n "$hangs_dirname" ]; then
-            if ! $DSUDO docker cp "$trial_outdir/$hangs_dirname" \
-                "$cid:$cont_workdir/$hangs_dirname"
-            then
-                >&2 error "Failed to copy reproducible hangs"
+            if ! copy_inputs "$cid" "$trial_outdir" "$inputs_dirname_old=$cont_inputs_old"; then
+                >&2 error "Failed to copy reproducible inputs"
+                #exit 1
+            fi
+        else
+            if ! copy_inputs "$cid" "$trial_src" "${mappings[@]}"; then
+                >&2 error "Failed to copy reproducible inputs from $trial_src"
                 exit 1
             fi
         fi
@@ -287,13 +611,19 @@ for i in $(seq 0 $((runs - 1))); do
         cids+=("$cid")
     else
         >&2 warn "Be careful of quotes in the 'docker create' command when copying!"
-        echo docker create -it --cpus=1 --cpuset-cpus="$core" "$image" bash -c "$cmd"
+        echo docker create -it --cpus=1 --cpuset-cpus="$core" "${create_opts[@]}" "$cov_image" bash -c "$cmd"
+        echo docker cp "$COV_SAMPLE" "container:$cont_cov_sample"
+        echo docker cp "$GCDA_COV" "container:$cont_gcda_cov"
         echo docker cp "$NYX_NET_REPLAY" "container:$cont_replay"
         echo docker cp "$trial_outdir/reproducible" "container:$cont_inputs"
         echo docker start container
     fi
 done
 
+if [ $json = 1 ]; then
+    exit 0
+fi
+
 info "Waiting for containers to exit"
 if [ $dryrun = 0 ]; then
     info "${cids[*]}"
@@ -310,7 +640,16 @@ if [ $dryrun = 0 ]; then
         else
             dest_prefix=$(get_outdir "$single_index" "$fuzzer")
         fi
-        dest="$dest_prefix/coverage.tar.gz"
+        if [ "$shards" -gt 1 ]; then
+            dest="$dest_prefix/coverage-shard$shard.tar.gz"
+            if ! $DSUDO docker cp "$cid:$cont_workdir/gcda.tar.gz" \
+                "$dest_prefix/gcda-shard$shard.tar.gz"
+            then
+                >&2 warn "Could not copy gcda counters of shard $shard"
+            fi
+        else
+            dest="$dest_prefix/coverage.tar.gz"
+        fi
         if ! $DSUDO docker cp "$from" "$dest"; then
             >&2 warn "Could not copy from $from to $dest"
             continue
@@ -0,0 +1,195 @@
+/*
+ * Fork server for replaying inputs to a gcov-instrumented network server.
+ *
+ * Preloaded into the server (LD_PRELOAD=forksrv.so), it wraps accept(): the
+ * server initializes once and, for every connection accepted on the socket
+ * of its first accept(), a child is forked to handle it, starting from the
+ * state of the server right before accept(). The child exits, writing its
+ * gcov counters (with the exit handlers of libgcov), as soon as it closes
+ * the connection or calls accept() on that socket again, once its other
+ * threads are done (e.g. one handling the connection while another one is
+ * back in accept()); meanwhile the parent waits for it and then accepts the
+ * next connection. Accepts on any other socket (e.g. FTP data connections)
+ * are left to the server. A child still running after FORKSRV_TIMEOUT ms
+ * (default 3000) gets SIGTERM, which also makes it exit through the exit
+ * handlers.
+ *
+ * With FORKSRV_STATUS set to a file (e.g. a FIFO), the parent writes the
+ * wait status of every child to it on its own line, after the counters of
+ * the child have been written: a replay script can read coverage then, and
+ * replay the next input.
+ *
+ * Built in the coverage image by coverage.sh:
+ *
+ *     gcc -shared -fPIC -O2 -o forksrv.so forksrv.c -ldl
+ */
+
+#define _GNU_SOURCE
+#include <dirent.h>
+#include <dlfcn.h>
+#include <errno.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+static int (*real_accept)(int, struct sockaddr *, socklen_t *);
+static int (*real_accept4)(int, struct sockaddr *, socklen_t *, int);
+static int (*real_close)(int);
+
+static long timeout_ms = 3000;
+static const char *status_path;
+static FILE *status;
+
+/* The socket connections are forked for, set by the first accept() */
+static int listen_fd = -1;
+
+/* In a child: the connection it handles */
+static int in_child;
+static int conn_fd = -1;
+
+static void sleep_ms(long ms)
+{
+    struct timespec ts = { ms / 1000, (ms % 1000) * 1000000L };
+    while (nanosleep(&ts, &ts) < 0 && errno == EINTR)
+        ;
+}
+
+static int threads(void)
+{
+    DIR *d = opendir("/proc/self/task");
+    struct dirent *e;
+    int n = 0;
+    if (d == NULL)
+        return 1;
+    while ((e = readdir(d)) != NULL)
+        if (e->d_name[0] != '.')
+            n++;
+    closedir(d);
+    return n;
+}
+
+/* Exits a child, libgcov writes the counters in its exit handler */
+static void child_exit(int wait_threads)
+{
+    long waited = 0;
+    /* Other threads may still be handling the connection */
+    while (wait_threads && threads() > 1 && waited < timeout_ms) {
+        sleep_ms(1);
+        waited++;
+    }
+    exit(0);
+}
+
+static void on_term(int sig)
+{
+    (void)sig;
+    exit(0);
+}
+
+static void report(int wstatus)
+{
+    if (status_path == NULL)
+        return;
+    if (status == NULL) {
+        status = fopen(status_path, "w");
+        if (status == NULL) {
+            status_path = NULL;
+            return;
+        }
+        setvbuf(status, NULL, _IOLBF, 0);
+    }
+    fprintf(status, "%d\n", wstatus);
+}
+
+/* Waits for a child, killing it after the timeout */
+static int wait_child(pid_t pid)
+{
+    int wstatus = 0, sig = SIGTERM;
+    long waited = 0;
+    for (;;) {
+        pid_t r = waitpid(pid, &wstatus, WNOHANG);
+        if (r == pid || (r < 0 && errno != EINTR))
+            return wstatus;
+        if (waited >= timeout_ms) {
+            kill(pid, sig);
+            /* Give it another timeout to write its counters */
+            sig = SIGKILL;
+            waited = 0;
+        }
+        sleep_ms(1);
+        waited++;
+    }
+}
+
+static int forked_accept(int fd, struct sockaddr *addr, socklen_t *len,
+                         int flags, int four)
+{
+    if (listen_fd < 0 && !in_child)
+        listen_fd = fd;
+    if (fd != listen_fd)
+        return four ? real_accept4(fd, addr, len, flags)
+                    : real_accept(fd, addr, len);
+    if (in_child)
+        child_exit(1);
+    for (;;) {
+        int c = four ? real_accept4(fd, addr, len, flags)
+                     : real_accept(fd, addr, len);
+        pid_t pid;
+        if (c < 0)
+            return c;
+        pid = fork();
+        if (pid < 0)
+            /* Handle it without forking */
+            return c;
+        if (pid == 0) {
+            in_child = 1;
+            conn_fd = c;
+            signal(SIGTERM, on_term);
+            return c;
+        }
+        real_close(c);
+        report(wait_child(pid));
+    }
+}
+
+int accept(int fd, struct sockaddr *addr, socklen_t *len)
+{
+    return forked_accept(fd, addr, len, 0, 0);
+}
+
+int accept4(int fd, struct sockaddr *addr, socklen_t *len, int flags)
+{
+    return forked_accept(fd, addr, len, flags, 1);
+}
+
+int close(int fd)
+{
+    if (in_child && fd == conn_fd) {
+        int r = real_close(fd);
+        conn_fd = -1;
+        /* Otherwise the thread in accept() exits once this one is done */
+        if (threads() == 1)
+            child_exit(0);
+        return r;
+    }
+    return real_close(fd);
+}
+
+__attribute__((constructor)) static void init(void)
+{
+    const char *s;
+    real_accept = dlsym(RTLD_NEXT, "accept");
+    real_accept4 = dlsym(RTLD_NEXT, "accept4");
+    real_close = dlsym(RTLD_NEXT, "close");
+    s = getenv("FORKSRV_TIMEOUT");
+    if (s != NULL && atol(s) > 0)
+        timeout_ms = atol(s);
+    status_path = getenv("FORKSRV_STATUS");
+    /* Not for the programs the server runs */
+    unsetenv("LD_PRELOAD");
+}
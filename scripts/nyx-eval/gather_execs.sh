@@ -5,19 +5,21 @@ HEREDIR=$(readlink -f "$(dirname "$0")")
 source "$HEREDIR/common.bash"
 
 function usage {
-    echo "usage: $0 [-hea] [-r trials] -f fuzzer [-p snap-placement] -d outdir -t target -o csvfile"
-    echo "    -e : extract archives (for aflnet, aflnwe)"
+    echo "usage: $0 [-hea] [-r trials] -f fuzzer [-p snap-placement] -d outdir -t target -o csvfile [-S series]"
+    echo "    -e : read stats from the archives even if extracted (for aflnet, aflnwe)"
     echo "    -a : append to existing CSV"
+    echo "    -S : also write execs over time of nyx trials to this CSV"
     echo ""
     echo "  Stats are searched in:"
-    echo "    - aflnet: \$outdir/\$target/out-\$target-\$fuzzer-x"
+    echo "    - aflnet: \$outdir/\$target/out-\$target-\$fuzzer-x (or its .tar.gz)"
     echo "    - nyx   : \$outdir/out-\$target-\$snap_placement-xxx"
     exit 1
 }
 
 extract=0
 append=0
-while getopts ":hr:t:f:d:o:eap:" opt; do
+series=
+while getopts ":hr:t:f:d:o:eap:S:" opt; do
     case ${opt} in
         h)
             usage
@@ -47,6 +49,9 @@ while getopts ":hr:t:f:d:o:eap:" opt; do
         p)
             validate_snap_placement
             ;;
+        S)
+            series=${OPTARG}
+            ;;
         :)
             no_arg_error
             ;;
@@ -87,39 +92,28 @@ if [ "$snap_placement" != "none" ]; then
     fuzzer_tag="$fuzzer_name-$snap_placement"
 fi
 
+# Nyx-Net trials are read all at once by nyx_stats.py
+nyx_trials=()
+
 for run_i in $(seq 0 $((runs - 1))); do
     trial_outdir=$(get_outdir "$run_i" "$fuzzer")
     info "Trial $trial_outdir"
+    if [ "$fuzzer" = "nyx" ]; then
+        nyx_trials+=("$trial_outdir")
+        continue
+    fi
     if [[ "$fuzzer" =~ ^afl ]]; then
-        if [ $extract = 1 ] || [ ! -d "$trial_outdir" ]; then
-            if [ -d "$trial_outdir" ]; then
-                info "Removing old dir $trial_outdir"
-                rm -rf "$trial_outdir"
-            fi
+        stats="fuzzer_stats"
+        [[ "$fuzzer" =~ ^aflpp ]] && stats="default/fuzzer_stats"
+        if [ $extract = 1 ] || [ ! -f "$trial_outdir/$stats" ]; then
+            # Only the stats are read, without extracting the archive
             trial_archive="$trial_outdir.tar.gz"
-            info "Extracting $trial_archive"
-            if ! tmpdir=$(mktemp -d); then
-                >&2 warn "Failed to create temporary directory"
-                continue
-            fi
-            if tar -xf "$trial_archive" -C "$tmpdir"; then
-                if ! (mv "$tmpdir/out-$target-$fuzzer" "$trial_outdir" && rm -r "$tmpdir"); then
-                    >&2 warn "Failed to move from $tmpdir to $trial_outdir"
-                    continue
-                fi
-            else
-                >&2 warn "Could not extract archive, skipping"
-                continue
-            fi
-        fi
-        if [[ "$fuzzer" =~ ^aflpp ]]; then
-            execs=$(awk '/execs_per_sec/ {print $3}' "$trial_outdir/default/fuzzer_stats")
+            info "Reading $stats from $trial_archive"
+            execs=$(tar -xzOf "$trial_archive" --occurrence=1 "out-$target-$fuzzer/$stats" \
+                        | awk '/execs_per_sec/ {print $3}')
         else
-            execs=$(awk '/execs_per_sec/ {print $3}' "$trial_outdir/fuzzer_stats")
+            execs=$(awk '/execs_per_sec/ {print $3}' "$trial_outdir/$stats")
         fi
-    else
-        execs=$(python /home/kafl/nyx_show_performance.py "$trial_outdir/thread_stats_0.msgp" \
-            | awk '/overall_execs_per_sec:/ {print $2}')
     fi
     if [ -z "$execs" ]; then
         >&2 warn "Could not find execs in $trial_outdir"
@@ -128,3 +122,13 @@ for run_i in $(seq 0 $((runs - 1))); do
     info "execs_per_sec : $execs"
     echo "$target,$fuzzer_tag,$run_i,$execs" >> "$outcsv"
 done
+
+if [ "${#nyx_trials[@]}" -gt 0 ]; then
+    series_opts=()
+    [ -n "$series" ] && series_opts=(-S "$series")
+    if ! python3 "$HEREDIR/nyx_stats.py" -t "$target" -f "$fuzzer_tag" -a -o "$outcsv" \
+        "${series_opts[@]}" "${nyx_trials[@]}"
+    then
+        >&2 warn "Could not find execs in some trials"
+    fi
+fi
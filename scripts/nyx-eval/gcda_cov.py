@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+"""
+Incremental line and branch coverage read directly from gcov counters.
+
+The .gcno files under the given directories are parsed once; then, every
+time a timestamp is read from stdin, the .gcda files that changed are read
+again, the execution counts of the functions whose counters changed are
+recomputed from the arc counters (as gcov does) and the newly covered lines
+and branches are set in a running bitmap. For each timestamp a row in the
+same format as the dump_coverage function of the cov_script*.sh scripts
+(time,l_per,l_abs,b_per,b_abs) is appended to the output CSV and echoed on
+stdout, so a shell script can wait for it before replaying the next input.
+
+With --trace (or the GCDA_COV_TRACE environment variable) the lines and
+branches newly covered at each timestamp are also appended to a trace file,
+which is what coverage.sh uses to merge the timelines of coverage shards
+(see merge_cov_shards.py).
+
+Only files under the root directory are counted (like `gcovr -r`). Lines and
+branches are counted following gcov's rules, so the values can be slightly
+different from the summary of gcovr; gcovr is still used for HTML reports.
+
+This runs inside the coverage containers, hence it is compatible with both
+Python 2 and Python 3. Supports the formats of GCC 4.7 up to GCC 12.
+
+Example (as in cov_script_nyx.sh):
+
+    coproc COV { python gcda_cov.py -r . -o coverage.csv; }
+    echo "$time" >&"${COV[1]}"; read -r row <&"${COV[0]}"
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import struct
+import sys
+
+GCNO_MAGIC = 0x67636e6f
+GCDA_MAGIC = 0x67636461
+
+TAG_FUNCTION = 0x01000000
+TAG_BLOCKS = 0x01410000
+TAG_ARCS = 0x01430000
+TAG_LINES = 0x01450000
+TAG_COUNTER_ARCS = 0x01a10000
+
+ARC_ON_TREE = 1
+ARC_FAKE = 2
+
+
+class GcovFormatError(Exception):
+    pass
+
+
+class Reader(object):
+    """ Reads records of a .gcno or .gcda file. """
+    def __init__(self, path, magic):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self.path = path
+        self.pos = 0
+        self.endian = "<"
+        if len(self.data) < 12:
+            raise GcovFormatError("%s: file too short" % path)
+        m = self.u32()
+        if m != magic:
+            self.endian = ">"
+            self.pos = 0
+            if self.u32() != magic:
+                raise GcovFormatError("%s: bad magic" % path)
+        version = struct.pack(">I", self.u32()).decode("ascii", "replace")
+        if version[0] >= "A":
+            self.major = (ord(version[0]) - ord("A")) * 10 + int(version[1])
+        else:
+            self.major = int(version[0])
+        self.stamp = self.u32()
+        # Since GCC 12 record lengths are in bytes, strings are not padded and
+        # there's a checksum in the header.
+        self.bytes_len = self.major >= 12
+        if self.bytes_len:
+            self.u32()
+
+    def u32(self):
+        v, = struct.unpack_from(self.endian + "I", self.data, self.pos)
+        self.pos += 4
+        return v
+
+    def u64(self):
+        lo, hi = struct.unpack_from(self.endian + "II", self.data, self.pos)
+        self.pos += 8
+        return lo | (hi << 32)
+
+    def string(self):
+        n = self.u32()
+        if not self.bytes_len:
+            n *= 4
+        s = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return s.rstrip(b"\0").decode("utf-8", "replace")
+
+    def records(self):
+        """ Yields (tag, length, end) where length is in bytes. """
+        while self.pos + 8 <= len(self.data):
+            tag = self.u32()
+            length = self.u32()
+            if tag == 0:
+                break
+            if not self.bytes_len:
+                length *= 4
+            elif length >= 1 << 31:
+                # Negative length: counters that are all zero (GCC 12)
+                length -= 1 << 32
+            end = self.pos + max(length, 0)
+            yield tag, length, end
+            self.pos = end
+
+
+class Function(object):
+    def __init__(self, ident, checksums, name, source):
+        self.ident = ident
+        self.checksums = checksums
+        self.name = name
+        self.source = source
+        self.n_blocks = 0
+        # (src, dst, flags) ordered by source block
+        self.arcs = []
+        # For each block its (file, line) locations
+        self.block_locs = {}
+        # Triples (line index in the bitmap, arcs entering the blocks of the
+        # line from other lines, blocks of the line without predecessors)
+        self.line_entries = []
+        # Pairs (arc index, branch index in the bitmap)
+        self.branches = []
+        self.n_counters = 0
+        self.counters = None
+
+
+class Collector(object):
+    def __init__(self, root, dirs):
+        self.root = os.path.realpath(root)
+        self.lines = {}
+        self.branches = {}
+        # gcda path -> functions by ident
+        self.objects = {}
+        self._gcda_keys = {}
+        for d in dirs:
+            for dirpath, _, files in os.walk(d):
+                for name in files:
+                    if name.endswith(".gcno"):
+                        self._load_gcno(os.path.join(dirpath, name))
+        self.line_bits = bytearray(len(self.lines))
+        self.branch_bits = bytearray(len(self.branches))
+        self.lines_covered = 0
+        self.branches_covered = 0
+        # Bits set since the last call to take_new(), as (kind, index)
+        self._new = []
+        self._keys = None
+
+    def _under_root(self, path):
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    @staticmethod
+    def _index(table, key):
+        idx = table.get(key)
+        if idx is None:
+            idx = table[key] = len(table)
+        return idx
+
+    def _load_gcno(self, path):
+        rd = Reader(path, GCNO_MAGIC)
+        cwd = os.path.dirname(os.path.abspath(path))
+        if rd.major >= 8:
+            cwd = rd.string() or cwd
+            rd.u32()  # has_unexecuted_blocks
+
+        def resolve(p):
+            return os.path.realpath(os.path.join(cwd, p))
+
+        functions = {}
+        fn = None
+        # Branches on each line, to number them as gcov does
+        line_branches = {}
+        for tag, length, end in rd.records():
+            if tag == TAG_FUNCTION:
+                if fn is not None:
+                    self._finish(fn, line_branches)
+                ident = rd.u32()
+                checksums = (rd.u32(), rd.u32())
+                name = rd.string()
+                if rd.major >= 8:
+                    rd.u32()  # artificial
+                fn = Function(ident, checksums, name, resolve(rd.string()))
+                functions[ident] = fn
+            elif fn is None:
+                continue
+            elif tag == TAG_BLOCKS:
+                fn.n_blocks = rd.u32() if rd.major >= 8 else length // 4
+            elif tag == TAG_ARCS:
+                src = rd.u32()
+                while rd.pos < end:
+                    dst = rd.u32()
+                    flags = rd.u32()
+                    fn.arcs.append((src, dst, flags))
+            elif tag == TAG_LINES:
+                block = rd.u32()
+                cur = fn.source
+                locs = fn.block_locs.setdefault(block, [])
+                while rd.pos < end:
+                    line = rd.u32()
+                    if line == 0:
+                        name = rd.string()
+                        if not name:
+                            break
+                        cur = resolve(name)
+                        continue
+                    locs.append((cur, line))
+        if fn is not None:
+            self._finish(fn, line_branches)
+
+        gcda = path[:-len(".gcno")] + ".gcda"
+        self.objects[gcda] = functions
+
+    def _finish(self, fn, line_branches):
+        # Counters follow the order of blocks and of arcs inside a block
+        fn.arcs.sort(key=lambda a: a[0])
+        fn.n_counters = sum(1 for a in fn.arcs if not a[2] & ARC_ON_TREE)
+
+        # gcov counts a line as executed if its blocks are entered from
+        # blocks of other lines (or if it is on the entry block).
+        line_blocks = {}
+        for block, locs in fn.block_locs.items():
+            for loc in locs:
+                if self._under_root(loc[0]):
+                    line_blocks.setdefault(loc, set()).add(block)
+        has_pred = set(dst for _, dst, _ in fn.arcs)
+        for loc, blocks in sorted(line_blocks.items()):
+            arcs = [
+                i for i, (src, dst, _) in enumerate(fn.arcs)
+                if dst in blocks and src not in blocks
+            ]
+            entry = [b for b in blocks if b not in has_pred]
+            fn.line_entries.append((self._index(self.lines, loc), arcs, entry))
+
+        # Blocks with more than one non-fake exit are branches, which belong
+        # to the last line of the block. Branches are identified by their
+        # line and number on the line (i.e. the same inline function
+        # included in different objects has the same branches, like in
+        # gcovr).
+        exits = {}
+        for i, (src, _, flags) in enumerate(fn.arcs):
+            if not flags & ARC_FAKE:
+                exits.setdefault(src, []).append(i)
+        for src in sorted(exits):
+            arcs = exits[src]
+            locs = fn.block_locs.get(src)
+            if len(arcs) < 2 or not locs or not self._under_root(locs[-1][0]):
+                continue
+            loc = locs[-1]
+            for i in arcs:
+                n = line_branches.get(loc, 0)
+                line_branches[loc] = n + 1
+                key = loc + (n, )
+                fn.branches.append((i, self._index(self.branches, key)))
+
+    def _read_gcda(self, path, functions):
+        rd = Reader(path, GCDA_MAGIC)
+        fn = None
+        for tag, length, end in rd.records():
+            if tag == TAG_FUNCTION:
+                fn = None
+                if length >= 12:
+                    ident = rd.u32()
+                    checksums = (rd.u32(), rd.u32())
+                    fn = functions.get(ident)
+                    if fn is not None and fn.checksums != checksums:
+                        raise GcovFormatError(
+                            "%s: %s does not match its .gcno" %
+                            (path, fn.name))
+            elif tag == TAG_COUNTER_ARCS and fn is not None:
+                if length < 0:
+                    counters = (0, ) * (-length // 8)
+                else:
+                    counters = tuple(rd.u64() for _ in range(length // 8))
+                if len(counters) != fn.n_counters:
+                    raise GcovFormatError("%s: wrong number of counters for %s"
+                                          % (path, fn.name))
+                if counters != fn.counters:
+                    fn.counters = counters
+                    self._mark(fn)
+
+    def _mark(self, fn):
+        counts = solve(fn)
+        arc_counts = counts[fn.n_blocks:]
+        for idx, arcs, entry in fn.line_entries:
+            if self.line_bits[idx]:
+                continue
+            if any(arc_counts[a] for a in arcs) or any(counts[b]
+                                                       for b in entry):
+                self.line_bits[idx] = 1
+                self.lines_covered += 1
+                self._new.append(("l", idx))
+        for arc, idx in fn.branches:
+            if arc_counts[arc] and not self.branch_bits[idx]:
+                self.branch_bits[idx] = 1
+                self.branches_covered += 1
+                self._new.append(("b", idx))
+
+    def update(self):
+        """ Reads the counters that changed since the last update. """
+        for path, functions in self.objects.items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_mtime, st.st_size, st.st_ino)
+            if self._gcda_keys.get(path) == key:
+                continue
+            self._gcda_keys[path] = key
+            self._read_gcda(path, functions)
+
+    def take_new(self):
+        """
+        Keys of the lines ("l", file, line) and branches ("b", file, line,
+        n) covered since the last call.
+        """
+        if not self._new:
+            return []
+        if self._keys is None:
+            self._keys = {"l": [None] * len(self.lines),
+                          "b": [None] * len(self.branches)}
+            for kind, table in (("l", self.lines), ("b", self.branches)):
+                for key, idx in table.items():
+                    self._keys[kind][idx] = key
+        new = [(kind, ) + self._keys[kind][idx] for kind, idx in self._new]
+        self._new = []
+        return new
+
+    def row(self, time):
+        """ A CSV row in the format of the cov_script*.sh scripts. """
+        def per(n, total):
+            return 100.0 * n / total if total else 0.0
+
+        return "%s,%.1f,%d,%.1f,%d" % (
+            time, per(self.lines_covered, len(self.lines)),
+            self.lines_covered, per(self.branches_covered,
+                                    len(self.branches)),
+            self.branches_covered)
+
+
+def solve(fn):
+    """
+    Execution count of every block and arc of a function from its counters,
+    propagating counts on the flow graph as gcov does. Returns a list with
+    the counts of blocks followed by the counts of arcs.
+    """
+    nb = fn.n_blocks
+    counts = [None] * (nb + len(fn.arcs))
+    succ = [[] for _ in range(nb)]
+    pred = [[] for _ in range(nb)]
+    it = iter(fn.counters)
+    for i, (src, dst, flags) in enumerate(fn.arcs):
+        succ[src].append(nb + i)
+        pred[dst].append(nb + i)
+        if not flags & ARC_ON_TREE:
+            counts[nb + i] = next(it)
+
+    changed = True
+    while changed:
+        changed = False
+        for b in range(nb):
+            for arcs in (succ[b], pred[b]):
+                unknown = [a for a in arcs if counts[a] is None]
+                if counts[b] is None:
+                    if arcs and not unknown:
+                        counts[b] = sum(counts[a] for a in arcs)
+                        changed = True
+                elif len(unknown) == 1:
+                    known = sum(counts[a] for a in arcs if a != unknown[0])
+                    counts[unknown[0]] = max(counts[b] - known, 0)
+                    changed = True
+    return [c or 0 for c in counts]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incremental coverage from gcov counters")
+    parser.add_argument("-r",
+                        "--root",
+                        default=".",
+                        help="Root of the sources to count (like gcovr -r)")
+    parser.add_argument("-o", "--output", help="CSV file to append rows to")
+    parser.add_argument("--header",
+                        action="store_true",
+                        help="Write the CSV header first")
+    parser.add_argument("--trace",
+                        default=os.environ.get("GCDA_COV_TRACE"),
+                        help="File to append newly covered lines/branches to")
+    parser.add_argument("--once",
+                        metavar="TIME",
+                        help="Print a single row for TIME and exit")
+    parser.add_argument("dirs",
+                        nargs="*",
+                        help="Where to look for .gcno files (default: root)")
+    args = parser.parse_args()
+
+    collector = Collector(args.root, args.dirs or [args.root])
+    out = open(args.output, "a") if args.output else None
+    if out is not None and args.header:
+        out.write("Time,l_per,l_abs,b_per,b_abs\n")
+    trace = None
+    if args.trace:
+        trace = open(args.trace, "a")
+        # Totals, to compute percentages when merging traces
+        trace.write("#lines=%d,branches=%d\n" %
+                    (len(collector.lines), len(collector.branches)))
+
+    def emit(time):
+        collector.update()
+        row = collector.row(time)
+        if trace is not None:
+            for key in collector.take_new():
+                trace.write("%s,%s\n" % (time, ",".join(str(k)
+                                                         for k in key)))
+            trace.flush()
+        if out is not None:
+            out.write(row + "\n")
+            out.flush()
+        print(row)
+        sys.stdout.flush()
+
+    if args.once is not None:
+        emit(args.once)
+    else:
+        for line in iter(sys.stdin.readline, ""):
+            line = line.strip()
+            if line:
+                emit(line)
+    if out is not None:
+        out.close()
+    if trace is not None:
+        trace.close()
+
+
+if __name__ == "__main__":
+    main()
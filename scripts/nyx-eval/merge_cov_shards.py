@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Merges the coverage archives of the shards of a trial (see coverage.sh -k)
+into a single coverage archive.
+
+Each shard replays a subset of the inputs of the trial and its archive
+contains, besides the usual coverage CSV and HTML report, the trace written
+by gcda_cov.py (lines and branches newly covered at each timestamp). The
+merged CSV has a row for every timestamp found in the CSVs of the shards,
+with the coverage of the union of the lines and branches covered by all the
+shards up to that time. The HTML reports of the shards are kept as
+cov_html-shard<N>.
+"""
+
+import argparse
+import io
+import re
+import sys
+import tarfile
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+TRACE = "trace.csv"
+CSV_NAMES = ("coverage.csv", "cov_over_time.csv")
+HEADER = "Time,l_per,l_abs,b_per,b_abs"
+TOTALS_RE = re.compile(r"^#lines=(\d+),branches=(\d+)$")
+
+
+def member_name(m: tarfile.TarInfo) -> str:
+    return m.name[2:] if m.name.startswith("./") else m.name
+
+
+class Shard:
+    def __init__(self, path: Path):
+        self.path = path
+        self.csv_name = None
+        self.times: List[int] = []
+        # (time, kind, key) in file order
+        self.events: List[Tuple[int, str, str]] = []
+        self.totals = None
+        with tarfile.open(path) as tar:
+            members = {member_name(m): m for m in tar.getmembers()}
+            for name in CSV_NAMES:
+                if name in members:
+                    self.csv_name = name
+                    self._read_csv(tar.extractfile(members[name]))
+                    break
+            else:
+                raise ValueError(f"{path}: no coverage CSV")
+            if TRACE not in members:
+                raise ValueError(f"{path}: no {TRACE} (was gcda_cov.py used?)")
+            self._read_trace(tar.extractfile(members[TRACE]))
+
+    def _read_csv(self, f):
+        for line in io.TextIOWrapper(f):
+            time = line.split(",", 1)[0]
+            if time.isdigit():
+                self.times.append(int(time))
+
+    def _read_trace(self, f):
+        for line in io.TextIOWrapper(f):
+            line = line.rstrip("\n")
+            m = TOTALS_RE.match(line)
+            if m:
+                self.totals = (int(m[1]), int(m[2]))
+                continue
+            time, kind, key = line.split(",", 2)
+            self.events.append((int(time), kind, key))
+        if self.totals is None:
+            raise ValueError(f"{self.path}: no totals in {TRACE}")
+
+
+def merge(shards: List[Shard]) -> List[str]:
+    """ Rows of the merged CSV (without header). """
+    totals = {s.totals for s in shards}
+    if len(totals) != 1:
+        raise ValueError(f"Shards have different totals: {totals}")
+    lines_total, branches_total = totals.pop()
+
+    events = sorted((e for s in shards for e in s.events), key=lambda e: e[0])
+    times = sorted(set(t for s in shards for t in s.times))
+    covered: Dict[str, Set[str]] = {"l": set(), "b": set()}
+
+    def per(n: int, total: int) -> float:
+        return 100.0 * n / total if total else 0.0
+
+    rows = []
+    i = 0
+    for t in times:
+        while i < len(events) and events[i][0] <= t:
+            covered[events[i][1]].add(events[i][2])
+            i += 1
+        l_abs, b_abs = len(covered["l"]), len(covered["b"])
+        rows.append(f"{t},{per(l_abs, lines_total):.1f},{l_abs},"
+                    f"{per(b_abs, branches_total):.1f},{b_abs}")
+    return rows
+
+
+def add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge coverage archives of shards of a trial")
+    parser.add_argument("-o",
+                        "--output",
+                        type=Path,
+                        required=True,
+                        help="Merged coverage archive (e.g. coverage.tar.gz)")
+    parser.add_argument("shards", type=Path, nargs="+", metavar="archive")
+    args = parser.parse_args()
+
+    try:
+        shards = [Shard(p) for p in args.shards]
+        rows = merge(shards)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    csv = "\n".join([HEADER] + rows) + "\n"
+    lines_total, branches_total = shards[0].totals
+    trace = f"#lines={lines_total},branches={branches_total}\n" + "".join(
+        f"{t},{k},{key}\n" for s in shards for t, k, key in s.events)
+    tmp = args.output.with_name(f".{args.output.name}.tmp")
+    with tarfile.open(tmp, "w:gz") as out:
+        add_bytes(out, f"./{shards[0].csv_name}", csv.encode())
+        add_bytes(out, f"./{TRACE}", trace.encode())
+        for i, s in enumerate(shards):
+            with tarfile.open(s.path) as tar:
+                for m in tar.getmembers():
+                    name = member_name(m)
+                    if not name.startswith("cov_html"):
+                        continue
+                    m.name = f"./cov_html-shard{i}" + name[len("cov_html"):]
+                    out.addfile(m, tar.extractfile(m) if m.isfile() else None)
+    tmp.replace(args.output)
+    print(f"Merged {len(shards)} shards, {len(rows)} rows into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Reads the thread stats of Nyx-Net trials (thread_stats_<N>.msgp) without
+external tools or packages.
+
+A stats file is a stream of MessagePack objects, each holding samples of the
+fuzzing thread; a sample is a map (or an array, for structs serialized
+without field names) with a cumulative execution counter and a time. All
+samples of all threads of all the given trials are read in one process, and
+written as one execs/sec value per trial (the CSV of gather_execs.sh, i.e.
+the execs dataset in data/execs) and, optionally, as execs-over-time series:
+
+    nyx_stats.py -t exim -f nyx -o data/execs/exim.csv -a \\
+        -S exim-execs-series.csv out-exim-000 out-exim-001 ...
+
+Field names (or array indices) are guessed from common names; use -E and -T
+if the fuzzer writes them differently.
+"""
+
+import argparse
+import csv
+import re
+import struct
+import sys
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
+
+EXECS_KEYS = ("total_execs", "execs", "num_execs", "exec_count", "executions",
+              "total_executions")
+TIME_KEYS = ("time", "timestamp", "elapsed", "runtime", "run_time",
+             "duration", "time_s")
+TIME_UNITS = {"s": 1, "ms": 1e-3, "us": 1e-6, "ns": 1e-9}
+THREAD_RE = re.compile(r"^thread_stats_(\d+)\.msgp$")
+RUN_RE = re.compile(r"-(\d+)$")
+# Sample times above this (in seconds) are timestamps, not elapsed times
+ABSOLUTE_TIME = 1e9
+
+Key = Union[str, int]
+
+
+class Truncated(Exception):
+    """ The file ends in the middle of an object (e.g. still written). """
+
+
+class Unpacker:
+    """ Streaming MessagePack decoder for a binary file. """
+    def __init__(self, f: IO[bytes], chunk: int = 1 << 16):
+        self._f = f
+        self._chunk = chunk
+        self._buf = b""
+        self._pos = 0
+        # Decoders of the types with a fixed marker byte
+        # yapf: disable
+        self._simple = {
+            0xc0: lambda: None,
+            0xc2: lambda: False,
+            0xc3: lambda: True,
+            0xc4: lambda: self._read(self._unpack(">B", 1)),
+            0xc5: lambda: self._read(self._unpack(">H", 2)),
+            0xc6: lambda: self._read(self._unpack(">I", 4)),
+            0xca: lambda: self._unpack(">f", 4),
+            0xcb: lambda: self._unpack(">d", 8),
+            0xcc: lambda: self._unpack(">B", 1),
+            0xcd: lambda: self._unpack(">H", 2),
+            0xce: lambda: self._unpack(">I", 4),
+            0xcf: lambda: self._unpack(">Q", 8),
+            0xd0: lambda: self._unpack(">b", 1),
+            0xd1: lambda: self._unpack(">h", 2),
+            0xd2: lambda: self._unpack(">i", 4),
+            0xd3: lambda: self._unpack(">q", 8),
+            0xd9: lambda: self._str(self._unpack(">B", 1)),
+            0xda: lambda: self._str(self._unpack(">H", 2)),
+            0xdb: lambda: self._str(self._unpack(">I", 4)),
+            0xdc: lambda: self._array(self._unpack(">H", 2)),
+            0xdd: lambda: self._array(self._unpack(">I", 4)),
+            0xde: lambda: self._map(self._unpack(">H", 2)),
+            0xdf: lambda: self._map(self._unpack(">I", 4)),
+        }
+        # yapf: enable
+
+    def _read(self, n: int) -> bytes:
+        if self._pos + n > len(self._buf):
+            rest = self._buf[self._pos:]
+            data = self._f.read(max(n - len(rest), self._chunk))
+            self._buf = rest + data
+            self._pos = 0
+            if len(self._buf) < n:
+                raise Truncated()
+        b = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return b
+
+    def _at_end(self) -> bool:
+        if self._pos < len(self._buf):
+            return False
+        self._buf = self._f.read(self._chunk)
+        self._pos = 0
+        return not self._buf
+
+    def _unpack(self, fmt: str, n: int):
+        return struct.unpack(fmt, self._read(n))[0]
+
+    def _ext(self, typ: int, data: bytes) -> Any:
+        if typ == -1:
+            # Timestamp extension, as seconds
+            if len(data) == 4:
+                return float(struct.unpack(">I", data)[0])
+            if len(data) == 8:
+                v = struct.unpack(">Q", data)[0]
+                return (v & 0x3ffffffff) + (v >> 34) * 1e-9
+            if len(data) == 12:
+                ns, s = struct.unpack(">Iq", data)
+                return s + ns * 1e-9
+        return data
+
+    def _str(self, n: int) -> str:
+        return self._read(n).decode("utf-8", "replace")
+
+    def _array(self, n: int) -> List:
+        return [self.decode() for _ in range(n)]
+
+    def _map(self, n: int) -> Dict:
+        d = {}
+        for _ in range(n):
+            k = self.decode()
+            d[k if not isinstance(k, list) else tuple(k)] = self.decode()
+        return d
+
+    def decode(self) -> Any:
+        b = self._read(1)[0]
+        if b <= 0x7f:
+            return b
+        if b >= 0xe0:
+            return b - 0x100
+        if 0x80 <= b <= 0x8f:
+            return self._map(b & 0x0f)
+        if 0x90 <= b <= 0x9f:
+            return self._array(b & 0x0f)
+        if 0xa0 <= b <= 0xbf:
+            return self._str(b & 0x1f)
+        if b in self._simple:
+            return self._simple[b]()
+        if 0xd4 <= b <= 0xd8:
+            n = 1 << (b - 0xd4)
+        elif 0xc7 <= b <= 0xc9:
+            n = self._unpack(">" + "BHI"[b - 0xc7], 1 << (b - 0xc7))
+        else:
+            raise ValueError(f"Invalid MessagePack byte 0x{b:02x}")
+        typ = self._unpack(">b", 1)
+        return self._ext(typ, self._read(n))
+
+    def __iter__(self) -> Iterator[Any]:
+        """ Top-level objects; a truncated last object is ignored. """
+        while not self._at_end():
+            try:
+                yield self.decode()
+            except Truncated:
+                return
+
+
+def field(obj: Any, keys: Tuple[Key, ...]) -> Optional[float]:
+    for k in keys:
+        try:
+            v = obj[k]
+        except (KeyError, IndexError, TypeError):
+            continue
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return float(v)
+    return None
+
+
+def samples(obj: Any, execs_keys: Tuple[Key, ...],
+            time_keys: Tuple[Key, ...]) -> Iterator[Tuple[float, float]]:
+    """ (time, execs) of the samples in a decoded object (searched deeply). """
+    if isinstance(obj, (dict, list)):
+        execs = field(obj, execs_keys)
+        t = field(obj, time_keys)
+        if execs is not None and t is not None:
+            yield t, execs
+            return
+        for v in obj.values() if isinstance(obj, dict) else obj:
+            yield from samples(v, execs_keys, time_keys)
+
+
+def read_thread(path: Path, execs_keys: Tuple[Key, ...],
+                time_keys: Tuple[Key, ...],
+                time_scale: float) -> List[Tuple[float, float]]:
+    """ Samples of a thread stats file sorted by time (in seconds). """
+    with path.open("rb") as f:
+        series = [(t * time_scale, e) for obj in Unpacker(f)
+                  for t, e in samples(obj, execs_keys, time_keys)]
+    series.sort()
+    return series
+
+
+class Trial:
+    """ Execs of all the threads of a trial. """
+    def __init__(self, outdir: Path, **kwargs):
+        self.outdir = outdir
+        m = RUN_RE.search(outdir.name)
+        self.run = int(m[1]) if m else None
+        self.threads: Dict[int, List[Tuple[float, float]]] = {}
+        for p in sorted(outdir.glob("thread_stats_*.msgp")):
+            m = THREAD_RE.match(p.name)
+            if m:
+                self.threads[int(m[1])] = read_thread(p, **kwargs)
+        self.threads = {i: s for i, s in self.threads.items() if s}
+
+    @property
+    def start(self) -> float:
+        """ Start of the trial: times are either since then or timestamps. """
+        first = min(s[0][0] for s in self.threads.values())
+        return first if first > ABSOLUTE_TIME else 0.0
+
+    def execs_per_sec(self) -> Optional[float]:
+        """ Total execs of all threads over the duration of the trial. """
+        if not self.threads:
+            return None
+        end = max(s[-1][0] for s in self.threads.values())
+        execs = sum(s[-1][1] for s in self.threads.values())
+        if end <= self.start:
+            return None
+        return execs / (end - self.start)
+
+    def last_execs_per_sec(self) -> Optional[float]:
+        """ Execs/sec of all threads between their last two samples. """
+        rates = [(s[-1][1] - s[-2][1]) / (s[-1][0] - s[-2][0])
+                 for s in self.threads.values()
+                 if len(s) > 1 and s[-1][0] > s[-2][0]]
+        return sum(rates) if rates else None
+
+    def series(self) -> Iterator[Tuple[int, float, float, float]]:
+        """ (thread, time since start, execs, execs/sec since last sample) """
+        start = self.start
+        for i, s in sorted(self.threads.items()):
+            prev_t, prev_e = start, 0.0
+            for t, e in s:
+                rate = (e - prev_e) / (t - prev_t) if t > prev_t else 0.0
+                yield i, t - start, e, rate
+                prev_t, prev_e = t, e
+
+
+def parse_key(s: str) -> Key:
+    return int(s) if s.isdigit() else s
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Execs of Nyx-Net trials from their thread stats")
+    parser.add_argument("-t", "--target", required=True, help="Subject")
+    parser.add_argument("-f",
+                        "--fuzzer",
+                        required=True,
+                        help="Fuzzer column (e.g. nyx or nyx-balanced)")
+    parser.add_argument("-o",
+                        "--output",
+                        type=Path,
+                        help="Execs CSV (subject,fuzzer,run,execs)")
+    parser.add_argument("-a",
+                        "--append",
+                        action="store_true",
+                        help="Append to the execs CSV")
+    parser.add_argument("-S",
+                        "--series",
+                        type=Path,
+                        help=("Execs over time CSV (subject,fuzzer,run,"
+                              "thread,time,execs,execs_per_sec)"))
+    parser.add_argument("-E",
+                        "--execs-key",
+                        type=parse_key,
+                        action="append",
+                        help="Field (or array index) of the execs counter")
+    parser.add_argument("-T",
+                        "--time-key",
+                        type=parse_key,
+                        action="append",
+                        help="Field (or array index) of the sample time")
+    parser.add_argument("-u",
+                        "--time-unit",
+                        choices=TIME_UNITS,
+                        default="s",
+                        help="Unit of the sample time [default: s]")
+    parser.add_argument("trials", type=Path, nargs="+", metavar="trial_dir")
+    args = parser.parse_args()
+
+    kwargs = {
+        "execs_keys": tuple(args.execs_key or EXECS_KEYS),
+        "time_keys": tuple(args.time_key or TIME_KEYS),
+        "time_scale": TIME_UNITS[args.time_unit]
+    }
+
+    out = series = None
+    files = []
+    if args.output is not None:
+        new = not args.append or not args.output.exists()
+        files.append(args.output.open("a" if args.append else "w",
+                                      newline=""))
+        out = csv.writer(files[-1])
+        if new:
+            out.writerow(["subject", "fuzzer", "run", "execs"])
+    if args.series is not None:
+        files.append(args.series.open("w", newline=""))
+        series = csv.writer(files[-1])
+        series.writerow([
+            "subject", "fuzzer", "run", "thread", "time", "execs",
+            "execs_per_sec"
+        ])
+
+    status = 0
+    for i, d in enumerate(args.trials):
+        try:
+            trial = Trial(d, **kwargs)
+        except (OSError, ValueError) as e:
+            print(f"{d}: {e}", file=sys.stderr)
+            status = 1
+            continue
+        run = trial.run if trial.run is not None else i
+        execs = trial.execs_per_sec()
+        if execs is None:
+            print(f"{d}: no execs found", file=sys.stderr)
+            status = 1
+            continue
+        print(f"{d}: {execs:.2f} execs/sec, {len(trial.threads)} threads")
+        if out is not None:
+            out.writerow([args.target, args.fuzzer, run, f"{execs:.2f}"])
+        if series is not None:
+            for thread, t, e, rate in trial.series():
+                series.writerow([
+                    args.target, args.fuzzer, run, thread, f"{t:.3f}",
+                    int(e), f"{rate:.2f}"
+                ])
+    for f in files:
+        f.close()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,714 @@
+#!/usr/bin/env python3
+"""
+Triage of the crashes and hangs found by fuzzers: the inputs are replayed
+against the ASan build of the subject and bucketed by the stack of the
+sanitizer report, so that a trial with thousands of crashing inputs boils
+down to a handful of unique bugs.
+
+    triage.py run -t exim -f aflnet -d out-afl -r 10 -j 8
+    triage.py run -t exim -f nyx -p balanced -d out-nyx -c 3 -i 0
+    triage.py table -o data/exim-bugs.csv out-*/out-exim-*-triage.csv
+
+`run` reads the crashing and hanging inputs of the trials (from the archive
+of AFL-based trials, without extracting it), keeps one input per payload
+(specs are compared by their packets) and replays the ones without a
+verdict yet in batches, each in its own container of the ASan image of the
+subject, with up to `-j` containers at once. Verdicts are cached by subject and
+input in an SQLite database (triage.sqlite in the output directory), so
+duplicates across trials and fuzzers, and reruns, are never replayed again.
+Each trial gets a CSV next to its output (out-...-NNN-triage.csv) with the
+verdict of every input; `table` aggregates them into one row per subject,
+bug and fuzzer.
+
+The ASan image (pfb-<target>-asan) is built once from the subject image by
+its $WORKDIR/triage_prepare script; $WORKDIR/triage replays a directory of
+inputs (AFLNet format for *.raw, payloads for *.bin, Nyx-Net specs are
+converted on the host) and writes, for each input, the exit code of the
+server, whether the processes handling the input hung and the stderr of the
+server, i.e. the sanitizer reports (currently Exim).
+
+Exim forks a child per connection and the daemon never exits on its own, so
+the script stops it (SIGTERM) once the children are done: an input crashes
+when the log has a sanitizer report and hangs when children were still
+running after the timeout. Those get SIGABRT, their report shows where they
+were stuck and is not a crash.
+"""
+
+import argparse
+import csv
+import fcntl
+import hashlib
+import io
+import os
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import trial_inputs
+
+sys.path.append(str(Path(__file__).absolute().parents[1]))
+sys.path.append(
+    str(Path(__file__).absolute().parents[2].joinpath("subjects", "SMTP",
+                                                      "Exim")))
+import nyx2aflnet  # noqa: E402
+import subjects  # noqa: E402
+
+DOCKER = ["sudo", "docker"]
+CONT_WORKDIR = "/home/ubuntu/experiments"
+CONT_INPUTS = f"{CONT_WORKDIR}/triage-in"
+CONT_OUTPUT = f"{CONT_WORKDIR}/triage-out"
+# Memory limit of the containers (in bytes)
+CONT_MEM_LIMIT = 1 << 30
+# Exit code of the server on a sanitizer report (ASAN_OPTIONS of triage)
+ASAN_CODE = 42
+# Exit code of the server stopped after the replay (SIGTERM)
+STOP_CODE = 128 + signal.SIGTERM
+# Verdicts cached by older versions are replayed again
+CACHE_VERSION = 2
+# Frames of the report hashed into a bucket
+FRAMES = 5
+BATCH = 200
+
+# Directories of a trial with crashing and hanging inputs, by fuzzer prefix
+# (as crashes.sh); the last one is for the other AFL-based fuzzers
+INPUT_DIRS = [
+    ("nyx", {
+        "corpus/crash": "crash",
+        "corpus/timeout": "hang"
+    }),
+    ("aflnet", {
+        "replayable-crashes": "crash",
+        "replayable-hangs": "hang"
+    }),
+    ("aflpp", {
+        "default/crashes": "crash",
+        "default/hangs": "hang"
+    }),
+    ("", {
+        "crashes": "crash",
+        "hangs": "hang"
+    }),
+]
+
+COLUMNS = [
+    "subject", "fuzzer", "run", "input", "found", "mtime", "id", "verdict",
+    "code", "kind", "bucket", "frames"
+]
+TABLE_COLUMNS = [
+    "subject", "bucket", "verdict", "kind", "frames", "fuzzer", "runs",
+    "inputs", "example"
+]
+
+REPORT_RE = re.compile(r"==(\d+)==\s*ERROR: (\w+Sanitizer): (.+?)"
+                       r"(?: on | \(|$)")
+FRAME_RE = re.compile(r"^\s*#(\d+) 0x[0-9a-fA-F]+\s+(.*)$")
+MODULE_RE = re.compile(r"\(([^()\s]+)\+(0x[0-9a-fA-F]+)\)")
+# Frames of the sanitizer runtime, not of the subject
+RUNTIME_PREFIXES = ("__asan", "__interceptor", "__sanitizer", "__lsan",
+                    "__ubsan", "___interceptor")
+RUNTIME_MODULES = ("libasan", "libclang_rt", "libubsan")
+
+
+class Input(NamedTuple):
+    """ A crashing or hanging input of a trial. """
+    path: str
+    # crash or hang, by the directory the fuzzer put it in
+    found: str
+    mtime: int
+    id: str
+    # raw (AFLNet replay format) or bin (payloads only)
+    fmt: str
+    data: bytes
+
+
+class Verdict(NamedTuple):
+    """ Outcome of replaying an input against the ASan build. """
+    # crash, hang or normal (does not reproduce)
+    verdict: str
+    code: int
+    # Bug type of the report (e.g. heap-buffer-overflow), signal or timeout
+    kind: str
+    bucket: str
+    frames: str
+
+
+class Cache:
+    """ Verdicts of inputs already replayed (an SQLite database). """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS verdicts (
+        subject TEXT NOT NULL,
+        id TEXT NOT NULL,
+        verdict TEXT NOT NULL,
+        code INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        frames TEXT NOT NULL,
+        PRIMARY KEY (subject, id))"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path),
+                                   timeout=60,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version < CACHE_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS verdicts")
+                self._db.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+            self._db.execute(self.SCHEMA)
+
+    def get(self, subject: str, ids: Iterable[str]) -> Dict[str, Verdict]:
+        out = {}
+        with self._lock:
+            for i in ids:
+                row = self._db.execute(
+                    """SELECT verdict, code, kind, bucket, frames
+                       FROM verdicts WHERE subject = ? AND id = ?""",
+                    (subject, i)).fetchone()
+                if row is not None:
+                    out[i] = Verdict(*row)
+        return out
+
+    def put(self, subject: str, verdicts: Dict[str, Verdict]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(subject, i) + tuple(v) for i, v in verdicts.items()])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def input_dirs(fuzzer: str) -> Dict[str, str]:
+    return next(d for prefix, d in INPUT_DIRS if fuzzer.startswith(prefix))
+
+
+def trial_source(outdir: Path, target: str, fuzzer: str, snaps: str,
+                 idx: int) -> Tuple[Path, Path, str]:
+    """
+    Output of a trial (as get_outdir in common.bash), where its inputs are
+    read from (its archive, if any) and the prefix of its directories there.
+    """
+    if fuzzer == "nyx":
+        name = f"out-{target}" + ("" if snaps == "none" else f"-{snaps}")
+    else:
+        name = f"out-{target}-{fuzzer}"
+    trial = outdir.joinpath(f"{name}-{idx:03d}")
+    archive = trial.with_name(f"{trial.name}.tar.gz")
+    if fuzzer != "nyx" and archive.exists():
+        return trial, archive, f"out-{target}-{fuzzer}/"
+    return trial, trial, ""
+
+
+def read_inputs(source: Path, prefix: str, fuzzer: str) -> List[Input]:
+    """ Crashing and hanging inputs of a trial, converted for the replay. """
+    mapping = {prefix + d: found for d, found in input_dirs(fuzzer).items()}
+    if source.is_dir():
+        members = trial_inputs.read_dir(source, mapping)
+    else:
+        members = trial_inputs.read_archive(str(source), mapping)
+    out = []
+    for src, m, data in members:
+        if data is None:
+            continue
+        found, _, path = m.name.partition("/")
+        base = os.path.basename(path)
+        if fuzzer == "nyx":
+            if not base.endswith(".py"):
+                continue
+            try:
+                data = bytes(nyx2aflnet.encode(nyx2aflnet.parse(data, path)))
+            except ValueError as e:
+                print(f"[!] Skipping {e}", file=sys.stderr)
+                continue
+            fmt = "raw"
+        elif base.startswith("id"):
+            fmt = "raw" if fuzzer.startswith("aflnet") else "bin"
+        else:
+            # e.g. README.txt
+            continue
+        # Specs are compared by their packets, as converted
+        h = hashlib.sha1(fmt.encode() + b"\0" + data).hexdigest()
+        out.append(
+            Input(f"{src[len(prefix):]}/{path}", found, int(m.mtime), h, fmt,
+                  data))
+    return out
+
+
+def frame_id(line: str) -> Optional[str]:
+    """ Function (or module and offset, if not symbolized) of a frame. """
+    m = FRAME_RE.match(line)
+    if m is None:
+        return None
+    rest = m.group(2)
+    if rest.startswith("in "):
+        return rest[3:].split()[0]
+    mod = MODULE_RE.search(rest)
+    if mod is None:
+        return "??"
+    return f"{os.path.basename(mod.group(1))}+{mod.group(2)}"
+
+
+class Report(NamedTuple):
+    """ A sanitizer report in the stderr of the server. """
+    pid: int
+    # Bug type, e.g. heap-buffer-overflow
+    kind: str
+    # Top frames of the subject
+    frames: List[str]
+
+
+def parse_reports(log: str) -> List[Report]:
+    """ Sanitizer reports in the stderr of the server, in order. """
+    reports = []
+    lines = log.splitlines()
+    for i, line in enumerate(lines):
+        m = REPORT_RE.search(line)
+        if m is None:
+            continue
+        kind = m.group(3).strip().replace(" ", "-")
+        frames: List[str] = []
+        started = False
+        for frame in lines[i + 1:]:
+            f = frame_id(frame)
+            if f is None:
+                if started:
+                    break
+                continue
+            # Next stack (e.g. where the memory was freed)
+            if started and FRAME_RE.match(frame).group(1) == "0":
+                break
+            started = True
+            if f.startswith(RUNTIME_PREFIXES) or \
+               any(r in f for r in RUNTIME_MODULES):
+                continue
+            if len(frames) < FRAMES:
+                frames.append(f)
+        reports.append(Report(int(m.group(1)), kind, frames))
+    return reports
+
+
+def bucket(kind: str, frames: List[str]) -> str:
+    return hashlib.sha1("\n".join([kind] +
+                                  frames).encode()).hexdigest()[:16]
+
+
+def classify(code: int, log: str, hung: bool = False) -> Verdict:
+    """
+    Verdict of an input from the exit code of the server, whether it hung and
+    its stderr (see the module docstring). Hung processes are killed with
+    SIGABRT, their report shows where they were stuck.
+    """
+    crashes = []
+    stuck: List[str] = []
+    for r in parse_reports(log):
+        if hung and r.kind == "ABRT":
+            stuck = stuck or r.frames
+        else:
+            crashes.append(r)
+    if crashes:
+        verdict, kind, frames = "crash", crashes[0].kind, crashes[0].frames
+    elif hung:
+        verdict, kind, frames = "hang", "timeout", stuck
+    elif code == ASAN_CODE:
+        verdict, kind, frames = "crash", "sanitizer", []
+    elif code > 128 and code != STOP_CODE:
+        try:
+            kind = signal.Signals(code - 128).name
+        except ValueError:
+            kind = f"signal{code - 128}"
+        verdict, frames = "crash", []
+    else:
+        return Verdict("normal", code, "", "", "")
+    return Verdict(verdict, code, kind, bucket(kind, frames),
+                   ";".join(frames))
+
+
+def docker(*args: str, **kwargs) -> subprocess.CompletedProcess:
+    kwargs.setdefault("stdout", subprocess.PIPE)
+    kwargs.setdefault("stderr", subprocess.PIPE)
+    return subprocess.run(DOCKER + list(args), **kwargs)
+
+
+def build_image(target: str) -> str:
+    """
+    Builds the ASan image of the subject unless it's up to date: a
+    container of the subject image runs its triage_prepare script and is
+    committed, labelled with the ID of the subject image (as the coverage
+    image in coverage.sh). Concurrent runs build it only once.
+    """
+    image = f"pfb-{target}"
+    asan_image = f"{image}-asan"
+    p = docker("image", "inspect", "-f", "{{.Id}}", image)
+    if p.returncode != 0:
+        raise RuntimeError(f"Image {image} not found")
+    base_id = p.stdout.decode().strip()
+    lock = Path(tempfile.gettempdir()).joinpath(f"{asan_image}.lock")
+    with lock.open("w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        p = docker("image", "inspect", "-f",
+                   '{{index .Config.Labels "pfb.base"}}', asan_image)
+        if p.returncode == 0 and p.stdout.decode().strip() == base_id:
+            print(f"[+] {asan_image} is up to date")
+            return asan_image
+        print(f"[+] Building {asan_image} from {image}")
+        cmd = (f"test -x {CONT_WORKDIR}/triage || exit 3; set -e; "
+               f"{CONT_WORKDIR}/triage_prepare")
+        p = docker("create", image, "bash", "-c", cmd)
+        if p.returncode != 0:
+            raise RuntimeError("Could not create container")
+        cid = p.stdout.decode().strip()
+        try:
+            log = Path(tempfile.gettempdir()).joinpath(f"{asan_image}.log")
+            with log.open("wb") as out:
+                p = docker("start", "-a", cid, stdout=out, stderr=out)
+            if p.returncode == 3:
+                raise RuntimeError(f"{image} has no triage script")
+            if p.returncode != 0:
+                raise RuntimeError(f"ASan build failed, see {log}")
+            p = docker("commit", "-c", f"LABEL pfb.base={base_id}", "-c",
+                       'CMD ["/bin/bash"]', cid, asan_image)
+            if p.returncode != 0:
+                raise RuntimeError(f"Could not commit {asan_image}")
+        finally:
+            docker("rm", cid)
+    return asan_image
+
+
+class Replayer:
+    """
+    Replays batches of inputs, each in a new container of the ASan image;
+    kill() removes the containers still running.
+    """
+    def __init__(self,
+                 image: str,
+                 port: int,
+                 core: Optional[int] = None,
+                 name: str = "triage"):
+        self.image = image
+        self.port = port
+        self.core = core
+        self.name = name
+        self._cids: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._killed = False
+
+    def _create(self) -> str:
+        with self._lock:
+            self._batches += 1
+            name = f"{self.name}-{self._batches}"
+        cmd = (f"echo -e '#!/bin/bash\\necho ubuntu' > pass.sh && "
+               f"chmod +x pass.sh && "
+               f"SUDO_ASKPASS=./pass.sh sudo --askpass -- "
+               f"chown -R ubuntu:ubuntu {CONT_INPUTS} && "
+               f"{CONT_WORKDIR}/triage {CONT_INPUTS} {CONT_OUTPUT} "
+               f"{self.port}")
+        opts = ["--name", name, "--cap-add=SYS_PTRACE",
+                f"--memory={CONT_MEM_LIMIT}"]
+        if self.core is not None:
+            opts += ["--cpus=1", f"--cpuset-cpus={self.core}"]
+        with self._lock:
+            if self._killed:
+                raise RuntimeError("Interrupted")
+            p = docker("create", *opts, self.image, "bash", "-c", cmd)
+            if p.returncode != 0:
+                raise RuntimeError("Could not create container: " +
+                                   p.stderr.decode().strip())
+            cid = p.stdout.decode().strip()
+            self._cids[cid] = None
+        return cid
+
+    def _remove(self, cid: str):
+        docker("rm", "-f", cid)
+        with self._lock:
+            self._cids.pop(cid, None)
+
+    def replay(self, inputs: List[Input]) -> Dict[str, Verdict]:
+        """ Verdicts of the inputs (all with a different id). """
+        cid = self._create()
+        try:
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w") as tar:
+                for inp in inputs:
+                    info = tarfile.TarInfo(
+                        f"{CONT_INPUTS}/{inp.id}.{inp.fmt}".lstrip("/"))
+                    info.size = len(inp.data)
+                    info.mtime = inp.mtime
+                    tar.addfile(info, io.BytesIO(inp.data))
+            p = docker("cp", "-", f"{cid}:/", input=buf.getvalue())
+            if p.returncode != 0:
+                raise RuntimeError("Could not copy the inputs: " +
+                                   p.stderr.decode().strip())
+            p = docker("start", "-a", cid, stderr=subprocess.STDOUT)
+            if p.returncode != 0:
+                tail = p.stdout.decode(errors="replace")[-2000:]
+                raise RuntimeError(f"Replay failed ({p.returncode}):\n{tail}")
+            p = docker("cp", f"{cid}:{CONT_OUTPUT}", "-")
+            if p.returncode != 0:
+                raise RuntimeError("Could not copy the output: " +
+                                   p.stderr.decode().strip())
+            return self._read_output(p.stdout)
+        finally:
+            self._remove(cid)
+
+    @staticmethod
+    def _read_output(data: bytes) -> Dict[str, Verdict]:
+        codes: Dict[str, int] = {}
+        hung: Dict[str, bool] = {}
+        logs: Dict[str, str] = {}
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for m in tar:
+                if not m.isfile():
+                    continue
+                f = tar.extractfile(m)
+                name = os.path.basename(m.name)
+                if name == "codes.csv":
+                    for row in csv.reader(
+                            io.TextIOWrapper(f, errors="replace")):
+                        # name,code,hung
+                        if len(row) == 3:
+                            codes[row[0]] = int(row[1])
+                            hung[row[0]] = row[2] == "1"
+                elif name.endswith(".log"):
+                    logs[name[:-len(".log")]] = f.read().decode(
+                        errors="replace")
+        return {
+            i: classify(c, logs.get(i, ""), hung.get(i, False))
+            for i, c in codes.items()
+        }
+
+    def kill(self):
+        with self._lock:
+            self._killed = True
+            cids = list(self._cids)
+        if cids:
+            docker("rm", "-f", *cids)
+
+
+def triage(replayer: Replayer,
+           cache: Cache,
+           subject: str,
+           inputs: Iterable[Input],
+           jobs: int = 1,
+           batch: int = BATCH) -> Dict[str, Verdict]:
+    """
+    Verdicts of the inputs: from the cache or by replaying every distinct
+    input once, in batches across `jobs` containers.
+    """
+    unique = {i.id: i for i in inputs}
+    verdicts = cache.get(subject, unique)
+    todo = [inp for i, inp in unique.items() if i not in verdicts]
+    print(f"[+] {subject}: {len(unique)} distinct inputs, "
+          f"{len(unique) - len(todo)} cached")
+    if not todo:
+        return verdicts
+    # Time order, so that the first batches cover what the fuzzer found first
+    todo.sort(key=lambda i: (i.mtime, i.path))
+    batches = [todo[i:i + batch] for i in range(0, len(todo), batch)]
+    done = 0
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(replayer.replay, b) for b in batches]
+        try:
+            for fut in as_completed(futures):
+                out = fut.result()
+                cache.put(subject, out)
+                verdicts.update(out)
+                done += len(out)
+                print(f"[+] {subject}: replayed {done}/{len(todo)}")
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            replayer.kill()
+            raise
+    missing = len(todo) - done
+    if missing:
+        print(f"[!] {subject}: no verdict for {missing} inputs",
+              file=sys.stderr)
+    return verdicts
+
+
+def write_trial(path: Path, subject: str, fuzzer: str, run: int,
+                inputs: List[Input], verdicts: Dict[str, Verdict]):
+    with path.open("w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(COLUMNS)
+        for inp in sorted(inputs, key=lambda i: (i.mtime, i.path)):
+            v = verdicts.get(inp.id)
+            if v is None:
+                continue
+            w.writerow([
+                subject, fuzzer, run, inp.path, inp.found, inp.mtime, inp.id,
+                v.verdict, v.code, v.kind, v.bucket, v.frames
+            ])
+
+
+def table(paths: Iterable[Path]) -> List[Dict]:
+    """
+    Unique bugs: one row per subject, bucket and fuzzer with the number of
+    runs and inputs hitting it and the earliest input found.
+    """
+    bugs: Dict[Tuple[str, str], Dict] = {}
+    found: Dict[Tuple[str, str, str], Dict] = defaultdict(
+        lambda: {"runs": set(), "inputs": 0, "first": None})
+    for p in paths:
+        with p.open(newline="") as f:
+            for row in csv.DictReader(f):
+                if row["verdict"] == "normal":
+                    continue
+                key = (row["subject"], row["bucket"])
+                bugs.setdefault(key, row)
+                s = found[key + (row["fuzzer"], )]
+                s["runs"].add(row["run"])
+                s["inputs"] += 1
+                first = (int(row["mtime"]), row["input"])
+                if s["first"] is None or first < s["first"]:
+                    s["first"] = first
+    out = []
+    for (subject, b, fuzzer), s in sorted(found.items()):
+        bug = bugs[(subject, b)]
+        out.append({
+            "subject": subject,
+            "bucket": b,
+            "verdict": bug["verdict"],
+            "kind": bug["kind"],
+            "frames": bug["frames"],
+            "fuzzer": fuzzer,
+            "runs": len(s["runs"]),
+            "inputs": s["inputs"],
+            "example": s["first"][1]
+        })
+    out.sort(key=lambda r: (r["subject"], r["verdict"], r["kind"],
+                            r["bucket"], r["fuzzer"]))
+    return out
+
+
+def run(args):
+    fuzzer = "nyx" if args.fuzzer.startswith("nyx") else args.fuzzer
+    fuzzer_tag = args.fuzzer
+    if args.snaps != "none":
+        fuzzer_tag += f"-{args.snaps}"
+    try:
+        port = subjects.get(args.target).port
+    except ValueError as e:
+        raise RuntimeError(str(e))
+    indices = [args.index] if args.runs is None else range(args.runs)
+
+    trials = []
+    for idx in indices:
+        trial, source, prefix = trial_source(args.outdir, args.target, fuzzer,
+                                             args.snaps, idx)
+        if not source.exists():
+            raise RuntimeError(f"{source} not found")
+        inputs = read_inputs(source, prefix, fuzzer)
+        print(f"[+] {source}: {len(inputs)} inputs")
+        trials.append((idx, trial, inputs))
+
+    cache = Cache(args.cache or args.outdir.joinpath("triage.sqlite"))
+    try:
+        image = build_image(args.target) if any(i for _, _, i in trials) \
+                else None
+        name = f"triage-{args.target}-{fuzzer_tag}-{os.getpid()}"
+        replayer = Replayer(image, port, args.core, name)
+        verdicts = triage(replayer,
+                          cache,
+                          args.target,
+                          (i for _, _, inputs in trials for i in inputs),
+                          jobs=args.jobs,
+                          batch=args.batch)
+    finally:
+        cache.close()
+
+    for idx, trial, inputs in trials:
+        out = trial.with_name(f"{trial.name}-triage.csv")
+        write_trial(out, args.target, fuzzer_tag, idx + 1, inputs, verdicts)
+        buckets = {
+            verdicts[i.id].bucket
+            for i in inputs if i.id in verdicts
+            and verdicts[i.id].verdict != "normal"
+        }
+        print(f"[+] {out}: {len(inputs)} inputs, {len(buckets)} buckets")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Deduplicate crashes and hangs by sanitizer stack")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="Replay the inputs of trials")
+    trials = r.add_mutually_exclusive_group(required=True)
+    trials.add_argument("-r",
+                        "--runs",
+                        type=int,
+                        help="Trials 0..runs-1")
+    trials.add_argument("-i", "--index", type=int, help="Only this trial")
+    r.add_argument("-t", "--target", required=True, help="Subject")
+    r.add_argument("-d",
+                   "--outdir",
+                   type=Path,
+                   required=True,
+                   help="Output directory of the trials")
+    r.add_argument("-f",
+                   "--fuzzer",
+                   default="nyx",
+                   help="Fuzzer that ran, as for coverage.sh [default: nyx]")
+    r.add_argument("-p",
+                   "--snaps",
+                   default="none",
+                   help="Snapshot placement (Nyx-Net only) [default: none]")
+    r.add_argument("-c",
+                   "--core",
+                   type=int,
+                   help="Pin the containers to this core")
+    r.add_argument("-j",
+                   "--jobs",
+                   type=int,
+                   default=1,
+                   help="Containers replaying at once [default: 1]")
+    r.add_argument("-b",
+                   "--batch",
+                   type=int,
+                   default=BATCH,
+                   help=f"Inputs per container [default: {BATCH}]")
+    r.add_argument("-C",
+                   "--cache",
+                   type=Path,
+                   help="Verdict cache (default: triage.sqlite in outdir)")
+    t = sub.add_parser("table", help="Unique bugs of triaged trials")
+    t.add_argument("-o", "--output", type=Path, help="CSV (default stdout)")
+    t.add_argument("csvs", nargs="+", type=Path, help="CSVs of trials")
+    args = parser.parse_args()
+
+    if args.cmd == "table":
+        rows = table(args.csvs)
+        f = sys.stdout if args.output is None else \
+            args.output.open("w", newline="")
+        with f:
+            w = csv.DictWriter(f, TABLE_COLUMNS)
+            w.writeheader()
+            w.writerows(rows)
+        return
+
+    if args.jobs < 1 or args.batch < 1:
+        parser.error("jobs and batch must be positive")
+    try:
+        run(args)
+    except (OSError, RuntimeError, tarfile.TarError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("[!] Killed by user", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
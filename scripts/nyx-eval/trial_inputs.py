@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Streams directories of a trial (its archive, for AFL-based fuzzers, or its
+directory) as a tar on stdout, renamed to their paths in the coverage
+container, e.g.
+
+    trial_inputs.py -u out-lightftp-aflnet-000.tar.gz \\
+        out-lightftp-aflnet/replayable-queue=$WORKDIR/replayable-queue \\
+        | docker cp - "$cid:/"
+
+(with WORKDIR=/home/ubuntu/experiments, the working directory of the
+container).
+
+An archive is decompressed once, in a single pass, and nothing is written on
+the host; links and members outside the given directories are skipped.
+
+With -u, inputs with the same payload are replayed only once: Nyx-Net specs
+(*.py) are compared by their packets (as converted by nyx2aflnet.py), other
+inputs by their contents. The copy that is kept gets the earliest
+modification time of its duplicates, so coverage is still attributed to the
+first time the fuzzer found the input (cov_script*.sh replay in `ls -tr`
+order and use `stat -c %Y`). Modification times keep their sub-second part
+(in PAX headers), so inputs found within the same second are replayed in
+the order they were found. With -k and -x, only every k-th input, in
+(modification time, name) order, starting from the x-th one is kept, to
+split the replay in shards.
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import posixpath
+import struct
+import sys
+import tarfile
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
+
+# nyx2aflnet.py runs in the containers, its spec conversion is shared
+sys.path.append(
+    str(Path(__file__).absolute().parents[2].joinpath("subjects", "SMTP",
+                                                      "Exim")))
+import nyx2aflnet  # noqa: E402
+
+# Source directory, member (renamed) and its contents (None for directories)
+Input = Tuple[str, tarfile.TarInfo, Optional[bytes]]
+
+
+def parse_mapping(s: str):
+    src, sep, dest = s.partition("=")
+    if not sep or not src or not dest:
+        raise argparse.ArgumentTypeError(f"expected src=dest, got '{s}'")
+    return posixpath.normpath(src), posixpath.normpath(dest).lstrip("/")
+
+
+def rename(name: str, mapping: Dict[str, str]) -> Optional[Tuple[str, str]]:
+    """
+    Selected directory and path in the container of the member `name`, None
+    if it's not selected.
+    """
+    name = posixpath.normpath(name)
+    for src, dest in mapping.items():
+        if name == src:
+            return src, dest
+        if name.startswith(src + "/"):
+            rest = name[len(src) + 1:]
+            if ".." in rest.split("/"):
+                return None
+            return src, f"{dest}/{rest}"
+    return None
+
+
+def read_archive(archive: str,
+                 mapping: Dict[str, str],
+                 contents: bool = True) -> Iterator[Input]:
+    """
+    Selected members of the archive; without `contents` the data of files
+    is a file object, only valid until the next member.
+    """
+    with tarfile.open(archive, "r|*") as tar:
+        for m in tar:
+            if not (m.isfile() or m.isdir()):
+                continue
+            renamed = rename(m.name, mapping)
+            if renamed is None:
+                continue
+            m.name = renamed[1]
+            data = None
+            if m.isfile():
+                data = tar.extractfile(m)
+                if contents:
+                    data = data.read()
+            yield renamed[0], m, data
+
+
+def read_dir(root: Path, mapping: Dict[str, str]) -> Iterator[Input]:
+    """ Selected directories of a trial directory. """
+    for src, dest in mapping.items():
+        for dirpath, dirnames, files in os.walk(root.joinpath(src)):
+            dirnames.sort()
+            d = Path(dirpath)
+            rel = d.relative_to(root.joinpath(src)).as_posix()
+            name = dest if rel == "." else f"{dest}/{rel}"
+            yield src, tarinfo(d, name), None
+            for f in sorted(files):
+                p = d.joinpath(f)
+                if p.is_symlink() or not p.is_file():
+                    continue
+                yield src, tarinfo(p, f"{name}/{f}"), p.read_bytes()
+
+
+def tarinfo(path: Path, name: str) -> tarfile.TarInfo:
+    st = path.stat()
+    info = tarfile.TarInfo(name)
+    # Sub-second, for the replay order
+    info.mtime = st.st_mtime_ns / 1e9
+    info.mode = st.st_mode & 0o7777
+    if path.is_dir():
+        info.type = tarfile.DIRTYPE
+    else:
+        info.size = st.st_size
+    return info
+
+
+def payload_hash(name: str, data: bytes) -> bytes:
+    """ Hash of what is sent to the target when replaying an input. """
+    h = hashlib.sha1()
+    if name.endswith(".py"):
+        try:
+            for p in nyx2aflnet.parse(data, name):
+                h.update(struct.pack("<I", len(p)))
+                h.update(p)
+            return b"spec:" + h.digest()
+        except Exception:
+            # Not a valid spec, compare the file itself
+            h = hashlib.sha1()
+    h.update(data)
+    return h.digest()
+
+
+def select(inputs: Iterator[Input],
+           unique: bool = False,
+           shards: int = 1,
+           shard: int = 0) -> Tuple[List[Input], int, int]:
+    """
+    Directories and the files to replay (after deduplication and sharding),
+    the number of files and of duplicates.
+    """
+    dirs: List[Input] = []
+    files: Dict[object, Input] = {}
+    total = dups = 0
+    for inp in inputs:
+        _, m, data = inp
+        if data is None:
+            dirs.append(inp)
+            continue
+        total += 1
+        key = payload_hash(m.name, data) if unique else total
+        if key in files:
+            kept = files[key][1]
+            kept.mtime = min(kept.mtime, m.mtime)
+            dups += 1
+            continue
+        files[key] = inp
+    # Replay order of cov_script*.sh
+    order = sorted(files.values(), key=lambda i: (i[1].mtime, i[1].name))
+    return dirs + order[shard::shards], total, dups
+
+
+def write(inputs: Iterator[Input], out: IO[bytes]) -> Set[str]:
+    """ Writes the inputs to `out` as a tar; returns the sources found. """
+    found = set()
+    # PAX headers keep sub-second modification times
+    with tarfile.open(fileobj=out, mode="w|",
+                      format=tarfile.PAX_FORMAT) as tar:
+        for src, m, data in inputs:
+            found.add(src)
+            if isinstance(data, bytes):
+                m.size = len(data)
+                data = io.BytesIO(data)
+            tar.addfile(m, data)
+    return found
+
+
+def stream(source: str,
+           mapping: Dict[str, str],
+           out: IO[bytes],
+           unique: bool = False,
+           shards: int = 1,
+           shard: int = 0) -> Tuple[Set[str], int, int]:
+    """
+    Writes the selected inputs of a trial (archive or directory) to `out` as
+    a tar. Returns the sources found, the number of files and of duplicates
+    (only counted with `unique` or shards, 0 otherwise).
+    """
+    buffered = unique or shards > 1
+    if os.path.isdir(source):
+        inputs = read_dir(Path(source), mapping)
+    else:
+        inputs = read_archive(source, mapping, contents=buffered)
+    total = dups = 0
+    if buffered:
+        selected, total, dups = select(inputs, unique, shards, shard)
+        inputs = iter(selected)
+    return write(inputs, out), total, dups
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream directories of a trial into a tar")
+    parser.add_argument("-u",
+                        "--unique",
+                        action="store_true",
+                        help="Keep only one input with the same payload")
+    parser.add_argument("-k",
+                        "--shards",
+                        type=int,
+                        default=1,
+                        help="Split the inputs in this many shards")
+    parser.add_argument("-x",
+                        "--shard",
+                        type=int,
+                        default=0,
+                        help="Only keep the inputs of this shard")
+    parser.add_argument("source",
+                        help="Archive (.tar.gz) or directory of the trial")
+    parser.add_argument("mappings",
+                        type=parse_mapping,
+                        nargs="+",
+                        metavar="src=dest",
+                        help="Directory in the trial and its container path")
+    args = parser.parse_args()
+    if args.shards < 1 or not 0 <= args.shard < args.shards:
+        parser.error("the shard must be in [0, shards)")
+
+    mapping = dict(args.mappings)
+    try:
+        found, total, dups = stream(args.source, mapping, sys.stdout.buffer,
+                                    args.unique, args.shards, args.shard)
+        if total:
+            print(f"{args.source}: {total - dups} unique inputs out of "
+                  f"{total}",
+                  file=sys.stderr)
+    except (OSError, tarfile.TarError) as e:
+        print(f"{args.source}: {e}", file=sys.stderr)
+        sys.exit(1)
+    missing = sorted(set(mapping) - found)
+    if missing:
+        print(f"{args.source}: missing {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
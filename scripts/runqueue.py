@@ -1,24 +1,37 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
+import itertools
 import json
 import os
+import re
 import signal
+import sqlite3
 import subprocess
 import sys
 import threading
+from collections import defaultdict
 from datetime import timedelta
 from enum import Enum, auto
 from pathlib import Path
-from queue import Queue
+from queue import Empty, PriorityQueue
 from time import time
-from typing import Dict, Iterable, List, Sequence, Union
+from typing import (IO, Callable, Dict, Iterable, List, Optional, Sequence,
+                    Set, Tuple, Union)
+
+import containers
+import subjects
+from telemetry import ContainerProbe, HostProbe, Metrics
 
 SCRIPTS_PATH = None
 
+# Seconds between checks for configs added to a running queue
+POLL_INTERVAL = 5
+
 
 def die(s: str, code: int = 1):
-    print(s, file=os.stderr)
+    print(s, file=sys.stderr)
     sys.exit(code)
 
 
@@ -50,11 +63,53 @@ class Target:
     """ A target server to fuzz (a subject in PFB lingo). """
     def __init__(self, name: str):
         self.name = name
+        # Raises ValueError for targets without a subject.json
+        self.subject = subjects.get(name)
 
     def __str__(self):
         return self.name
 
 
+class Resource(StrEnum):
+    """ What a job mostly uses; each has its own concurrency limit. """
+    CPU = auto()
+    DISK = auto()
+
+
+class Phase(StrEnum):
+    """ Steps of a trial, each scheduled as a separate job. """
+    FUZZ = auto()
+    REPRODUCIBLE = auto()
+    # Extracting archives of AFL-based trials before coverage
+    EXTRACT = auto()
+    COVERAGE = auto()
+    # Merging coverage shards
+    MERGE = auto()
+    # Deduplicating crashes and hangs (see nyx-eval/triage.py)
+    TRIAGE = auto()
+
+    @property
+    def resource(self) -> Resource:
+        if self in (Phase.EXTRACT, Phase.MERGE):
+            return Resource.DISK
+        return Resource.CPU
+
+    @property
+    def priority(self) -> int:
+        """
+        Lower runs first: post-processing of finished trials goes before
+        starting new fuzzing runs.
+        """
+        return {
+            Phase.MERGE: 0,
+            Phase.COVERAGE: 0,
+            Phase.TRIAGE: 0,
+            Phase.EXTRACT: 0,
+            Phase.REPRODUCIBLE: 1,
+            Phase.FUZZ: 2
+        }[self]
+
+
 class Fuzzer:
     def __init__(self,
                  typ: Union[FuzzerType, str],
@@ -68,80 +123,6 @@ class Fuzzer:
         # Incremental snapshots strategy for Nyx
         self.snap_placement = snap_placement
 
-        if self.type == FuzzerType.AFLNET:
-            if self.no_state:
-                # yapf: disable
-                self.__opts = {  # noqa: E122
-                "forked-daapd": "-P HTTP -D 2000000 -m 1000 -t 50000+ -K",
-                "dcmtk":        "-P DICOM -D 10000 -K",
-                "dnsmasq":      "-P DNS -D 10000 -K",
-                "tinydtls":     "-P DTLS12 -D 10000 -K -W 30",
-                "bftpd":        "-t 1000+ -m none -P FTP -D 10000 -K -c clean",
-                "lightftp":     "-P FTP -D 10000 -K -c ./ftpclean.sh",
-                "proftpd":      "-t 1000+ -m none -P FTP -D 10000 -K -c clean",
-                "pure-ftpd":    "-t 1000+ -m none -P FTP -D 10000 -K -c clean",
-                "live555":      "-P RTSP -D 10000 -K -R",
-                "kamailio":     "-m 200 -t 3000+ -P SIP -l 5061 -D 50000 -K -c run_pjsip",  # noqa: E501
-                "exim":         "-P SMTP -D 10000 -K -W 100",
-                "openssh":      "-P SSH -D 10000 -K -W 10",
-                "openssl":      "-P TLS -D 10000 -K -R -W 100"}
-                # yapf: enable
-            else:
-                SA = "-q 3 -s 3 -E"  # default state-awareness parameters
-                # yapf: disable
-                self.__opts = {  # noqa: E122
-                "forked-daapd": f"-P HTTP -D 2000000 -m 1000 -t 50000+ {SA} -K",  # noqa: E501
-                "dcmtk":         "-P DICOM -D 10000 -E -K",
-                # dnsmasq does not run with -E by default?
-                "dnsmasq":       "-P DNS -D 10000 -K",
-                "tinydtls":     f"-P DTLS12 -D 10000 {SA} -K -W 30",
-                "bftpd":        f"-t 1000+ -m none -P FTP -D 10000 {SA} -K -c clean",  # noqa: E501
-                "lightftp":     f"-P FTP -D 10000 {SA} -K -c ./ftpclean.sh",  # noqa: E501
-                "proftpd":      f"-t 1000+ -m none -P FTP -D 10000 {SA} -K -c clean",  # noqa: E501
-                "pure-ftpd":    f"-t 1000+ -m none -P FTP -D 10000 {SA} -K -c clean",  # noqa: E501
-                "live555":      f"-P RTSP -D 10000 {SA} -K -R",
-                "kamailio":     f"-m 200 -t 3000+ -P SIP -l 5061 -D 50000 {SA} -K -c run_pjsip",  # noqa: E501
-                "exim":         f"-P SMTP -D 10000 {SA} -K -W 100",
-                "openssh":      f"-P SSH -D 10000 {SA} -K -W 10",
-                "openssl":      f"-P TLS -D 10000 {SA} -K -R -W 100"}
-                # yapf: enable
-        elif self.type == FuzzerType.AFLNWE:
-            # yapf: disable
-            self.__opts = {  # noqa: E122
-            "forked-daapd": "-D 2000000 -m 1000 -t 50000+ -K",
-            "dcmtk":        "-D 10000 -K",
-            "dnsmasq":      "-D 10000 -K",
-            "tinydtls":     "-D 10000 -K -W 30",
-            "bftpd":        "-t 1000+ -m none -D 10000 -K -c clean",
-            "lightftp":     "-D 10000 -K -c ./ftpclean.sh",
-            "proftpd":      "-t 1000+ -m none -D 10000 -K -c clean",
-            "pure-ftpd":    "-t 1000+ -m none -D 10000 -K -c clean",
-            "live555":      "-D 10000 -K",
-            "kamailio":     "-m 200 -t 3000+ -D 50000 -K -c run_pjsip",
-            "exim":         "-D 10000 -K -W 100",
-            "openssh":      "-D 10000 -K -W 10",
-            "openssl":      "-D 10000 -K -W 100"}
-            # yapf: enable
-        elif self.type == FuzzerType.AFLPP:
-            # yapf: disable
-            self.__opts = {  # noqa: E122
-            "forked-daapd": "-m 1000 -t 50000+",
-            "dcmtk":        "",
-            "dnsmasq":      "",
-            "tinydtls":     "",
-            "bftpd":        "-t 1000+ -m none",
-            "lightftp":     "",
-            "proftpd":      "-t 1000+ -m none",
-            "pure-ftpd":    "-t 1000+ -m none",
-            "live555":      "",
-            "kamailio":     "-m 200 -t 3000+",
-            "exim":         "",
-            "openssh":      "",
-            "openssl":      ""}
-            # yapf: enable
-        else:
-            self.__opts = {}
-
     def __str__(self):
         s = str(self.type)
         if self.no_state:
@@ -162,10 +143,37 @@ class Fuzzer:
         return s
 
     def getopts(self, target: Target) -> str:
-        return self.__opts[target.name]
+        """ Options of this AFL-based fuzzer on the target (see subjects). """
+        return target.subject.fuzzer_opts(str(self.type),
+                                          state=not self.no_state)
+
+    @classmethod
+    def from_config(cls, f: Union[str, Dict]) -> "Fuzzer":
+        """ Fuzzer from its name or object in the config (see README). """
+        if type(f) == str:
+            return cls(f)
+        if type(f) == dict:
+            return cls(f["type"],
+                       no_state=f.get("no_state", False),
+                       no_seeds=f.get("no_seeds", False),
+                       snap_placement=SnapshotPlacement.fromstr(
+                           f.get("snaps", "none")))
+        raise ValueError(f"Unrecognized value type for fuzzer: {f}")
+
+    def to_config(self) -> Dict:
+        return {
+            "type": str(self.type),
+            "no_state": self.no_state,
+            "no_seeds": self.no_seeds,
+            "snaps": str(self.snap_placement)
+        }
 
 
 class Task:
+    # Runs the containers of AFL-based fuzzing and of coverage through the
+    # Docker API instead of the docker CLI, shared by all tasks (--docker-api)
+    docker: Optional[containers.ContainerManager] = None
+
     def __init__(self,
                  fuzzer: Fuzzer,
                  target: Target,
@@ -173,94 +181,293 @@ class Task:
                  timeout: int,
                  trial_idx: int = 0,
                  covskip: int = 5,
-                 only_cov: bool = False):
+                 cov_resolution: Optional[int] = None,
+                 cov_gcda: bool = False,
+                 only_cov: bool = False,
+                 shard: int = 0,
+                 shards: int = 1,
+                 triage: bool = False):
         self.fuzzer = fuzzer
         self.target = target
         self.outdir = outdir
         self.timeout = timeout
         self.trial_idx = trial_idx
         self.covskip = covskip
+        # Adaptive coverage sampling (seconds of fuzzing time) instead of
+        # dumping coverage every covskip inputs (see nyx-eval/cov_sample.sh)
+        self.cov_resolution = cov_resolution
+        # Read coverage with gcda_cov.py instead of gcovr (coverage.sh -g)
+        self.cov_gcda = cov_gcda
         self.only_cov = only_cov
+        # Coverage shard of the trial (only with only_cov)
+        self.shard = shard
+        self.shards = shards
+        # Triage the crashes and hangs of the trial after coverage
+        self.triage = triage
 
         # Running subprocesses
         self.__procs: Sequence[subprocess.Popen] = []
         self._terminating = False
+        self._log_started = False
+        # Exit status of the last phase run (None if it could not start)
+        self.returncode: Optional[int] = None
 
-    def __str__(self):
+    @property
+    def trial(self) -> str:
         return f"{self.fuzzer}:{self.target}:{self.trial_idx}"
 
-    def _cmds(self, core: int) -> List[List[str]]:
+    def __str__(self):
+        if self.shards > 1:
+            return f"{self.trial}:shard{self.shard}"
+        return self.trial
+
+    @property
+    def trial_outdir(self) -> Path:
+        """ Output of the trial, as get_outdir in nyx-eval/common.bash. """
+        if self.fuzzer.type == FuzzerType.NYX:
+            name = f"out-{self.target}"
+            if self.fuzzer.snap_placement != SnapshotPlacement.NONE:
+                name += f"-{self.fuzzer.snap_placement}"
+        else:
+            name = f"out-{self.target}-{self.fuzzer.as_str_scripts()}"
+        return self.outdir.absolute().joinpath(f"{name}-{self.trial_idx:03d}")
+
+    @property
+    def log_path(self) -> Path:
+        log_name = f"out-{self.target}-{self.fuzzer}-{self.trial_idx:03d}"
+        if self.shards > 1:
+            log_name += f"-shard{self.shard}"
+        return self.outdir.absolute().joinpath(f"{log_name}-task.log")
+
+    def artifacts(self, phase: Phase) -> List[Path]:
+        """ Files or directories a phase produces (if it succeeds). """
+        d = self.trial_outdir
+        if phase == Phase.FUZZ:
+            if self.fuzzer.type == FuzzerType.NYX:
+                return [d.joinpath("corpus")]
+            return [d.with_name(f"{d.name}.tar.gz")]
+        if phase == Phase.REPRODUCIBLE:
+            return [d.joinpath("reproducible")]
+        if phase == Phase.EXTRACT:
+            return [d.joinpath(".extracted")]
+        if phase == Phase.COVERAGE and self.shards > 1:
+            return [d.joinpath(f"coverage-shard{self.shard}.tar.gz")]
+        if phase == Phase.MERGE:
+            return [d.joinpath("coverage.tar.gz"), d.joinpath("gcda.tar.gz")]
+        if phase == Phase.TRIAGE:
+            return [d.with_name(f"{d.name}-triage.csv")]
+        return [d.joinpath("coverage.tar.gz")]
+
+    def _cov_cmd(self,
+                 core: int,
+                 merge: bool = False,
+                 extract: bool = False) -> List[str]:
+        """
+        coverage.sh for this trial (or shard), to merge its shards or to
+        only extract the archive of the trial.
+        """
+        fuzzer = "nyx" if self.fuzzer.type == FuzzerType.NYX else \
+                 self.fuzzer.as_str_scripts()
+        # yapf: disable
+        cmd = [f"{SCRIPTS_PATH}/nyx-eval/coverage.sh",
+               "-c", str(core), "-i", str(self.trial_idx),
+               "-p", str(self.fuzzer.snap_placement),
+               "-t", self.target.name, "-d", self.outdir,
+               "-s", str(self.covskip), "-f", fuzzer]
+        # yapf: enable
+        if extract:
+            return cmd + ["-X"]
+        if self.cov_resolution is not None:
+            cmd += ["-a", str(self.cov_resolution)]
+        if self.cov_gcda:
+            cmd += ["-g"]
+        if self.shards > 1:
+            cmd += ["-k", str(self.shards)]
+            cmd += ["-m"] if merge else ["-x", str(self.shard)]
+        return cmd
+
+    def _triage_cmd(self, core: int) -> List[str]:
+        fuzzer = "nyx" if self.fuzzer.type == FuzzerType.NYX else \
+                 self.fuzzer.as_str_scripts()
+        # yapf: disable
+        return [f"{SCRIPTS_PATH}/nyx-eval/triage.py", "run",
+                "-c", str(core), "-i", str(self.trial_idx),
+                "-p", str(self.fuzzer.snap_placement),
+                "-t", self.target.name, "-d", str(self.outdir),
+                "-f", fuzzer]
+        # yapf: enable
+
+    def _cmds(self, core: int) -> List[Tuple[Phase, List[str]]]:
         cmds = []
         if self.fuzzer.type in (FuzzerType.AFLNET, FuzzerType.AFLNWE,
                                 FuzzerType.AFLPP):
             opts = self.fuzzer.getopts(self.target)
             # yapf: disable
             if self.only_cov:
-                cmds.append([
-                    f"{SCRIPTS_PATH}/nyx-eval/coverage.sh",
-                    "-c", str(core), "-i", str(self.trial_idx),
-                    "-t", self.target.name, "-d", self.outdir,
-                    "-s", str(self.covskip),
-                    "-f", self.fuzzer.as_str_scripts()])
+                # Unsharded coverage streams the inputs from the archive
+                if self.shards > 1:
+                    cmds.append((Phase.EXTRACT,
+                                 self._cov_cmd(core, extract=True)))
+                cmds.append((Phase.COVERAGE, self._cov_cmd(core)))
             else:
-                cmds.append([
+                # Also computes coverage in the same container
+                cmds.append((Phase.FUZZ, [
                     f"{SCRIPTS_PATH}/execution/profuzzbench_exec_common.sh",
                     "-c", str(core), "-i", str(self.trial_idx),
                     "-t", self.target.name, "-d", self.outdir,
                     "-f", self.fuzzer.as_str_scripts(), "-O", opts,
-                    "-T", str(self.timeout * 60), "-S", str(self.covskip)])
+                    "-T", str(self.timeout * 60), "-S", str(self.covskip)]))
             # yapf: enable
         elif self.fuzzer.type == FuzzerType.NYX:
             # yapf: disable
             if not self.only_cov:
                 add_noseeds = ["-S"] if self.fuzzer.no_seeds else []
-                cmds.append([
+                cmds.append((Phase.FUZZ, [
                     f"{SCRIPTS_PATH}/nyx-eval/start.sh",
                     "-c", str(core), "-i", str(self.trial_idx),
                     "-p", str(self.fuzzer.snap_placement),
                     "-t", self.target.name, "-d", self.outdir,
-                    "-T", str(self.timeout * 60)] + add_noseeds)
-                cmds.append([
+                    "-T", str(self.timeout * 60)] + add_noseeds))
+                cmds.append((Phase.REPRODUCIBLE, [
                     f"{SCRIPTS_PATH}/nyx-eval/reproducible.sh",
                     "-c", str(core), "-i", str(self.trial_idx),
                     "-p", str(self.fuzzer.snap_placement),
-                    "-t", self.target.name, "-d", self.outdir] + add_noseeds)
-            cmds.append([
-                f"{SCRIPTS_PATH}/nyx-eval/coverage.sh",
-                "-c", str(core), "-i", str(self.trial_idx),
-                "-p", str(self.fuzzer.snap_placement),
-                "-t", self.target.name, "-d", self.outdir,
-                "-s", str(self.covskip), "-f", "nyx"])
+                    "-t", self.target.name, "-d", self.outdir] + add_noseeds))
             # yapf: enable
+            cmds.append((Phase.COVERAGE, self._cov_cmd(core)))
         else:
             assert False, f"Unhandled fuzzer type {self.fuzzer.type}"
+        # Once per trial, not per shard
+        if self.triage and self.shard == 0:
+            cmds.append((Phase.TRIAGE, self._triage_cmd(core)))
         return cmds
 
-    def run(self, core: int):
-        log_path = self.outdir.absolute().joinpath(
-            f"out-{self.target}-{self.fuzzer}-{self.trial_idx:03d}-task.log")
-        print(f"{self}: logging to {log_path}")
-        self.log_file = log_path.open("w")
-        for cmd in self._cmds(core):
+    def phases(self) -> List[Phase]:
+        return [phase for phase, _ in self._cmds(0)]
+
+    def probe(self) -> Union[ContainerProbe, HostProbe, None]:
+        """ Samples the fuzzer of this task while it runs (see telemetry). """
+        if self.fuzzer.type == FuzzerType.NYX:
+            running = [p for p in self.__procs if p.poll() is None]
+            if not running:
+                return None
+            # Runs in its own process group (setsid)
+            return HostProbe(self.trial_outdir, running[-1].pid)
+        # See profuzzbench_exec_common.sh
+        name = f"{self.target}-{self.fuzzer.as_str_scripts()}"
+        return ContainerProbe(f"-{name}-{self.trial_idx}$", f"out-{name}")
+
+    def inputs(self) -> List[Path]:
+        """ What the task needs from earlier runs (only with only_cov). """
+        if not self.only_cov:
+            return []
+        d = self.trial_outdir
+        if self.fuzzer.type == FuzzerType.NYX:
+            return [d]
+        return [d.with_name(f"{d.name}.tar.gz")]
+
+    def to_dict(self) -> Dict:
+        return {
+            "fuzzer": self.fuzzer.to_config(),
+            "target": self.target.name,
+            "outdir": str(self.outdir),
+            "timeout": self.timeout,
+            "trial_idx": self.trial_idx,
+            "covskip": self.covskip,
+            "cov_resolution": self.cov_resolution,
+            "cov_gcda": self.cov_gcda,
+            "only_cov": self.only_cov,
+            "shard": self.shard,
+            "shards": self.shards,
+            "triage": self.triage
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "Task":
+        return cls(Fuzzer.from_config(d["fuzzer"]),
+                   Target(d["target"]),
+                   Path(d["outdir"]),
+                   d["timeout"],
+                   trial_idx=d["trial_idx"],
+                   covskip=d["covskip"],
+                   cov_resolution=d.get("cov_resolution"),
+                   cov_gcda=d.get("cov_gcda", False),
+                   only_cov=d["only_cov"],
+                   shard=d["shard"],
+                   shards=d["shards"],
+                   triage=d.get("triage", False))
+
+    def _via_docker(self, phase: Phase) -> bool:
+        """ Whether the containers of the phase are run by Task.docker. """
+        if self.docker is None:
+            return False
+        return phase == Phase.COVERAGE or \
+            (phase == Phase.FUZZ and self.fuzzer.type != FuzzerType.NYX)
+
+    def _run_containers(self, specs: bytes, log_file: IO[str]) -> int:
+        """ Runs the containers of the specs printed by a script (-J). """
+        try:
+            codes = self.docker.run(
+                containers.read_specs(specs.decode().splitlines()),
+                log_file,
+                owner=self)
+        except (containers.DockerError, ValueError) as e:
+            print(f"[!] {e}", file=log_file)
+            return 1
+        return 0 if all(c is not None for c in codes) else 1
+
+    def run_phase(self, phase: Phase, core: int) -> bool:
+        """ Runs a phase of the task (or merges its shards) on `core`. """
+        if phase == Phase.MERGE:
+            cmd = self._cov_cmd(core, merge=True)
+        else:
+            cmd = dict(self._cmds(core))[phase]
+        # The script only prints the specs of its containers
+        via_docker = self._via_docker(phase)
+        if via_docker:
+            cmd = cmd + ["-J"]
+
+        log_path = self.log_path
+        self.returncode = None
+        if not self._log_started:
+            print(f"{self}: logging to {log_path}")
+        with log_path.open("a" if self._log_started else "w") as log_file:
+            self._log_started = True
             print(f"{self}: running {cmd}")
-            p = subprocess.Popen(cmd,
-                                 stdout=self.log_file,
-                                 stderr=subprocess.STDOUT,
-                                 preexec_fn=os.setsid)
+            p = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE if via_docker else log_file,
+                stderr=log_file if via_docker else subprocess.STDOUT,
+                preexec_fn=os.setsid)
             self.__procs.append(p)
-            p.communicate()
-            if self._terminating:
-                break
-            if p.returncode != 0:
-                print(f"FATAL-{self}: {cmd[0]} returned status {p.returncode}")
-                break
+            specs, _ = p.communicate()
+            self.returncode = p.returncode
+            if via_docker and p.returncode == 0 and not self._terminating:
+                self.returncode = self._run_containers(specs, log_file)
+        if self._terminating:
+            return False
+        if p.returncode != 0:
+            print(f"FATAL-{self}: {cmd[0]} returned status {p.returncode}")
+            return False
+        if self.returncode != 0:
+            print(f"FATAL-{self}: containers of {cmd[0]} failed, see "
+                  f"{log_path}")
+            return False
+        return True
 
     def kill(self):
         self._terminating = True
+        if self.docker is not None:
+            self.docker.kill(owner=self)
         for p in self.__procs:
+            if p.poll() is not None:
+                continue
             try:
                 p.send_signal(signal.SIGINT)
                 gid = os.getpgid(p.pid)
+                # Not in its own group yet (still before setsid)
+                if gid == os.getpgrp():
+                    continue
                 os.killpg(gid, signal.SIGINT)
                 # os.killpg(gid, signal.SIGKILL)
             except ProcessLookupError:
@@ -271,6 +478,21 @@ def parse_config(d: Dict) -> Iterable[Task]:
     trials = d["trials"]
     timeout = d["timeout"]
     only_cov = d.get("only_cov", False)
+    # Split the inputs of each trial across this many coverage containers
+    cov_shards = d.get("cov_shards", 1) if only_cov else 1
+    if type(cov_shards) != int or cov_shards < 1:
+        raise ValueError("cov_shards must be a positive integer")
+    # Adaptive coverage sampling, in seconds of fuzzing time
+    cov_resolution = d.get("cov_resolution")
+    if cov_resolution is not None and \
+       (type(cov_resolution) != int or cov_resolution < 1):
+        raise ValueError("cov_resolution must be a positive integer")
+    cov_gcda = d.get("cov_gcda", False)
+    if type(cov_gcda) != bool:
+        raise ValueError("cov_gcda must be a boolean")
+    triage = d.get("triage", False)
+    if type(triage) != bool:
+        raise ValueError("triage must be a boolean")
 
     def check_dir(p: Path, s: str):
         if not p.exists() or not p.is_dir():
@@ -283,19 +505,16 @@ def parse_config(d: Dict) -> Iterable[Task]:
     check_dir(afl_outdir, "afl_outdir")
 
     targets = [Target(t) for t in d["targets"]]
+    if cov_shards > 1:
+        # Merging the shards needs the trace of gcda_cov.py
+        no_gcda = [t.name for t in targets if not t.subject.cov_gcda]
+        if no_gcda:
+            raise ValueError("cov_shards needs coverage scripts supporting "
+                             "gcda_cov.py, which these targets lack: " +
+                             ", ".join(no_gcda))
     for f in d["fuzzers"]:
-        outdir = None
-        if type(f) == str:
-            fuzzer = Fuzzer(f)
-        elif type(f) == dict:
-            outdir = f.get("path", None)
-            fuzzer = Fuzzer(f["type"],
-                            no_state=f.get("no_state", False),
-                            no_seeds=f.get("no_seeds", False),
-                            snap_placement=SnapshotPlacement.fromstr(
-                                f.get("snaps", "none")))
-        else:
-            raise ValueError(f"Unrecognized value type for fuzzer: {f}")
+        fuzzer = Fuzzer.from_config(f)
+        outdir = f.get("path", None) if type(f) == dict else None
         if outdir is None:
             outdir = nyx_outdir if fuzzer.type == FuzzerType.NYX else \
                      afl_outdir
@@ -303,77 +522,760 @@ def parse_config(d: Dict) -> Iterable[Task]:
             outdir = Path(outdir)
         for t in targets:
             for i in range(trials):
-                yield Task(fuzzer,
-                           t,
-                           outdir,
-                           timeout,
-                           trial_idx=i,
-                           only_cov=only_cov)
+                for j in range(cov_shards):
+                    yield Task(fuzzer,
+                               t,
+                               outdir,
+                               timeout,
+                               trial_idx=i,
+                               cov_resolution=cov_resolution,
+                               cov_gcda=cov_gcda,
+                               only_cov=only_cov,
+                               shard=j,
+                               shards=cov_shards,
+                               triage=triage)
+
+
+def parse_cpulist(s: str) -> List[int]:
+    """ Parses a list of cores like "0-3,8,10-11". """
+    cores = []
+    for part in s.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cores.extend(range(int(lo), int(hi or lo) + 1))
+    return cores
+
+
+def numa_nodes() -> Dict[int, int]:
+    """ Maps each core to its NUMA node (all on node 0 if unknown). """
+    node_of = {}
+    for p in Path("/sys/devices/system/node").glob("node[0-9]*"):
+        try:
+            cpulist = p.joinpath("cpulist").read_text()
+        except OSError:
+            continue
+        for c in parse_cpulist(cpulist):
+            node_of[c] = int(p.name[4:])
+    return defaultdict(int, node_of)
+
+
+CPUS_ALLOWED_RE = re.compile(r"^Cpus_allowed_list:\s+(\d+)$", re.MULTILINE)
+
+
+def taken_cores() -> Set[int]:
+    """
+    Cores to which a process is pinned (same logic as freecores): user
+    processes (i.e. with VmSize) allowed to run on a single core.
+    """
+    taken = set()
+    for st in Path("/proc").glob("[0-9]*/status"):
+        try:
+            text = st.read_text()
+        except OSError:
+            continue
+        if "\nVmSize:" not in text:
+            continue
+        m = CPUS_ALLOWED_RE.search(text)
+        if m:
+            taken.add(int(m[1]))
+    return taken
+
+
+class CorePool:
+    """
+    Cores available to the queue. Cores taken by other processes (see
+    taken_cores) are skipped; jobs are packed on NUMA nodes.
+    """
+    def __init__(self, cores: Iterable[int]):
+        self._node_of = numa_nodes()
+        self._free: Set[int] = set(cores)
+        self._cv = threading.Condition()
+        self._cancelled = False
+
+    def __len__(self):
+        """ Cores not acquired (some may be taken by other processes). """
+        return len(self._free)
+
+    def _pick(self, near: Optional[int]) -> Optional[int]:
+        free = self._free - taken_cores()
+        if not free:
+            return None
+        by_node: Dict[int, List[int]] = defaultdict(list)
+        for c in free:
+            by_node[self._node_of[c]].append(c)
+        if near is not None and self._node_of[near] in by_node:
+            # Same node as the previous phase of the task
+            node = self._node_of[near]
+        else:
+            # Fill up nodes one at a time
+            node = min(by_node, key=lambda n: (len(by_node[n]), n))
+        return min(by_node[node])
+
+    def acquire(self, near: Optional[int] = None) -> Optional[int]:
+        """
+        Waits for a free core, preferring the NUMA node of `near`. Returns
+        None once cancelled.
+        """
+        with self._cv:
+            while not self._cancelled:
+                core = self._pick(near)
+                if core is not None:
+                    self._free.remove(core)
+                    return core
+                # Cores taken by other processes can become free any time
+                self._cv.wait(timeout=10)
+            return None
+
+    def release(self, core: int):
+        with self._cv:
+            self._free.add(core)
+            self._cv.notify_all()
+
+    def cancel(self):
+        """ Makes waiting and later acquire() calls give up. """
+        with self._cv:
+            self._cancelled = True
+            self._cv.notify_all()
+
+
+class JobState(StrEnum):
+    """ State of a job in the journal. """
+    RUNNING = auto()
+    DONE = auto()
+    FAILED = auto()
+    # Killed by an interrupt of the queue, not counted as an attempt
+    INTERRUPTED = auto()
+
+
+class Journal:
+    """
+    Persistent state of the jobs of a queue (an SQLite database), so that a
+    restarted queue skips the jobs that completed and retries the failed
+    ones. It also holds the configs added to a running queue (see --add).
+    """
+    # yapf: disable
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+            key TEXT PRIMARY KEY,
+            phase TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            exit_code INTEGER,
+            core INTEGER,
+            start REAL,
+            end REAL,
+            artifacts TEXT,
+            log TEXT)""",
+        """CREATE TABLE IF NOT EXISTS configs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            config TEXT NOT NULL,
+            added REAL NOT NULL)""",
+    ]
+    # yapf: enable
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path),
+                                   timeout=60,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            for stmt in self.SCHEMA:
+                self._db.execute(stmt)
+
+    def _get(self, key: str) -> Optional[Tuple]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT state, attempts, artifacts FROM jobs WHERE key = ?",
+                (key, )).fetchone()
+
+    def completed(self, key: str) -> bool:
+        """ The job is done and its artifacts are still there. """
+        row = self._get(key)
+        if row is None or row[0] != str(JobState.DONE):
+            return False
+        return all(Path(a).exists() for a in json.loads(row[2] or "[]"))
+
+    def attempts(self, key: str) -> int:
+        row = self._get(key)
+        return 0 if row is None else row[1]
+
+    def started(self, job: "Job"):
+        with self._lock, self._db:
+            self._db.execute(
+                """INSERT OR IGNORE INTO jobs (key, phase, state)
+                   VALUES (?, ?, ?)""",
+                (job.key, str(job.phase), str(JobState.RUNNING)))
+            self._db.execute(
+                """UPDATE jobs SET state = ?, core = ?, start = ?, end = NULL,
+                   exit_code = NULL, log = ? WHERE key = ?""",
+                (str(JobState.RUNNING), job.core, job.start,
+                 str(job.task.log_path), job.key))
+
+    def finished(self, job: "Job", state: JobState):
+        artifacts = [
+            str(a) for a in job.task.artifacts(job.phase) if a.exists()
+        ]
+        counted = 0 if state == JobState.INTERRUPTED else 1
+        with self._lock, self._db:
+            self._db.execute(
+                """UPDATE jobs SET state = ?, attempts = attempts + ?,
+                   exit_code = ?, end = ?, artifacts = ? WHERE key = ?""",
+                (str(state), counted, job.exit_code, job.end,
+                 json.dumps(artifacts), job.key))
+
+    def add_config(self, d: Dict) -> int:
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO configs (config, added) VALUES (?, ?)",
+                (json.dumps(d), time()))
+            return cur.lastrowid
+
+    def last_config(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT MAX(id) FROM configs").fetchone()
+        return row[0] or 0
+
+    def configs_since(self, config_id: int) -> List[Tuple[int, Dict]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, config FROM configs WHERE id > ? ORDER BY id",
+                (config_id, )).fetchall()
+        return [(i, json.loads(c)) for i, c in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Job:
+    """ A phase of a task; runs once all its dependencies succeeded. """
+    def __init__(self, task: Task, phase: Phase, deps: Iterable["Job"] = ()):
+        self.task = task
+        self.phase = phase
+        self.deps = list(deps)
+        self.dependents: List[Job] = []
+        for d in self.deps:
+            d.dependents.append(self)
+        self.core: Optional[int] = None
+        self.start: Optional[float] = None
+        self.end: Optional[float] = None
+        # None until done (or skipped because a dependency failed)
+        self.ok: Optional[bool] = None
+        self.exit_code: Optional[int] = None
+        # Completed in a previous run of the queue (see Journal)
+        self.resumed = False
+        # Runs so far, including previous runs of the queue
+        self.attempts = 0
+
+    def __str__(self):
+        # Jobs shared by all the shards of a trial
+        if self.phase in (Phase.EXTRACT, Phase.MERGE):
+            return f"{self.task.trial}/{self.phase}"
+        return f"{self.task}/{self.phase}"
+
+    @property
+    def key(self) -> str:
+        """ Identifies the job across runs of the queue. """
+        return f"{self.task.outdir.absolute()}/{self}"
+
+    @property
+    def resource(self) -> Resource:
+        return self.phase.resource
+
+    @property
+    def wall_time(self) -> Optional[float]:
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def near(self) -> Optional[int]:
+        """ Core a dependency ran on (to stay on the same NUMA node). """
+        return next((d.core for d in self.deps if d.core is not None), None)
+
+
+def build_graph(tasks: Iterable[Task]) -> List[Job]:
+    """
+    Jobs for all the phases of the tasks: each phase depends on the previous
+    one of its task. Shards of a trial share the extraction of the archive
+    and their coverage jobs are followed by a job merging them; triage then
+    follows the merge, since both run on the task of the first shard.
+    """
+    jobs = []
+    shared: Dict[Tuple[Path, str, Phase], Job] = {}
+    shards: Dict[Tuple[Path, str], List[Job]] = defaultdict(list)
+    # Sharded trials to triage once merged
+    triage: Dict[Tuple[Path, str], Task] = {}
+    for t in tasks:
+        prev = None
+        cov = None
+        for phase in t.phases():
+            deps = [] if prev is None else [prev]
+            key = (t.outdir, t.trial, phase)
+            if phase == Phase.EXTRACT and t.shards > 1 and key in shared:
+                prev = shared[key]
+                continue
+            if phase == Phase.TRIAGE and t.shards > 1:
+                triage[(t.outdir, t.trial)] = t
+                continue
+            prev = Job(t, phase, deps)
+            shared[key] = prev
+            jobs.append(prev)
+            if phase == Phase.COVERAGE:
+                cov = prev
+        if t.shards > 1:
+            shards[(t.outdir, t.trial)].append(cov)
+    for key, last in shards.items():
+        merge = Job(last[0].task, Phase.MERGE, last)
+        jobs.append(merge)
+        if key in triage:
+            jobs.append(Job(triage[key], Phase.TRIAGE, [merge]))
+    return jobs
 
 
 class Worker(threading.Thread):
-    def __init__(self, q: Queue, core: int):
+    """
+    Runs a job (on a core for CPU jobs), then calls `on_done(worker)`. With
+    `metrics`, the fuzzer of fuzzing jobs is sampled every `interval` seconds.
+    """
+    def __init__(self,
+                 job: Job,
+                 core: int,
+                 on_done: Callable[["Worker"], None],
+                 metrics: Optional[Metrics] = None,
+                 interval: float = 60):
         super().__init__()
-        self._q = q
+        self.job = job
         self.core = core
-        self._terminating = False
-        self._current_task = None
+        self._on_done = on_done
+        self._metrics = metrics
+        self._interval = interval
+        self._finished = threading.Event()
+
+    def _sample(self):
+        task, phase = str(self.job.task), str(self.job.phase)
+        probe = None
+        peak = 0.0
+        while not self._finished.wait(timeout=self._interval):
+            if probe is None:
+                probe = self.job.task.probe()
+                if probe is None:
+                    continue
+            sample = probe.sample()
+            self._metrics.add(task, phase, sample)
+            execs = sample.get("execs_per_sec")
+            if execs is None:
+                continue
+            if execs < peak / 10:
+                print(f"Work-{self.core}: {self.job} dropped to "
+                      f"{execs:.0f} execs/sec (peak {peak:.0f})")
+            peak = max(peak, execs)
+        self._metrics.done(task, phase)
 
     def run(self):
-        while not self._terminating:
-            self._current_task = self._q.get()
-            if self._current_task is None:
-                break
+        job = self.job
+        print(f"Work-{self.core}: Starting {job}")
+        job.ok = False
+        sampler = None
+        if self._metrics is not None and job.phase == Phase.FUZZ:
+            sampler = threading.Thread(target=self._sample, daemon=True)
+            sampler.start()
+        try:
+            job.ok = job.task.run_phase(job.phase, self.core)
+        finally:
+            self._finished.set()
+            if sampler is not None:
+                sampler.join()
+            job.end = time()
+            job.exit_code = job.task.returncode
+            delta = timedelta(seconds=job.wall_time)
+            print(f"Work-{self.core}: {job} done in {delta}")
+            self._on_done(self)
 
-            start = time()
-            task_str = str(self._current_task)
-            print(f"Work-{self.core}: Starting task {task_str}")
-            self._current_task.run(self.core)
+    def kill(self):
+        self.job.task.kill()
 
-            end = time()
-            self._current_task = None
 
-            delta = timedelta(seconds=end - start)
-            print(f"Work-{self.core}: {task_str} done in {delta}")
-            self._q.task_done()
+class Scheduler:
+    """
+    Runs a graph of jobs. A job is queued when all its dependencies
+    succeeded (jobs depending on a failed one are skipped); queued jobs run
+    by phase priority (see Phase.priority), then in order. CPU jobs run on a
+    core from the pool, at most `par` at a time; disk jobs are not pinned
+    and at most `disk_par` of them run at a time.
 
-    def kill(self):
-        self._terminating = True
-        if self._current_task is not None:
-            self._current_task.kill()
+    With a journal, jobs completed in a previous run are not run again, and
+    failed jobs are retried up to `retries` times, waiting `backoff` seconds
+    (doubling at every attempt) before each retry. With `metrics`, fuzzing
+    jobs are sampled every `interval` seconds.
+    """
+    def __init__(self,
+                 jobs: Iterable[Job],
+                 pool: CorePool,
+                 par: int,
+                 disk_par: int,
+                 journal: Optional[Journal] = None,
+                 retries: int = 0,
+                 backoff: float = 60,
+                 metrics: Optional[Metrics] = None,
+                 interval: float = 60):
+        self.jobs: List[Job] = []
+        self._journal = journal
+        self._metrics = metrics
+        self._interval = interval
+        self._retries = retries
+        self._backoff = backoff
+        self._stopping = False
+        self._pool = pool
+        self._slots = {
+            Resource.CPU: threading.Semaphore(par),
+            Resource.DISK: threading.Semaphore(disk_par)
+        }
+        self._queues: Dict[Resource, PriorityQueue] = {
+            r: PriorityQueue()
+            for r in Resource
+        }
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._all_done = threading.Event()
+        self._workers: Set[Worker] = set()
+        self._tries: Dict[Job, int] = {}
+        self.add(jobs, start=False)
 
+    def add(self, jobs: Iterable[Job], start: bool = True):
+        """ Adds jobs (not depending on the current ones) to the graph. """
+        jobs = list(jobs)
+        for job in jobs:
+            if self._journal is not None:
+                job.attempts = self._journal.attempts(job.key)
+                if self._journal.completed(job.key):
+                    job.ok = job.resumed = True
+        resumed = sum(j.resumed for j in jobs)
+        if resumed:
+            print(f"Skipping {resumed} jobs completed in a previous run")
+        with self._lock:
+            self.jobs += jobs
+            self._remaining += len(jobs) - resumed
+            if start:
+                self._submit_ready(jobs)
 
-def run_queue(q: Queue, par: int):
-    workers = []
-    for i in range(par):
-        w = Worker(q, i)
-        w.start()
-        workers.append(w)
+    def _submit_ready(self, jobs: Iterable[Job]):
+        for job in jobs:
+            if job.ok is None and all(d.ok for d in job.deps):
+                self._submit(job)
 
-    try:
-        q.join()
-        # Gracefully terminate workers
-        for _ in range(par):
-            q.put(None)
-    except KeyboardInterrupt:
-        print("Received keyboard interrupt, killing workers...")
+    def _submit(self, job: Job):
+        self._queues[job.resource].put(
+            (job.phase.priority, next(self._seq), job))
+
+    def _skip(self, job: Job):
+        for d in job.dependents:
+            if d.ok is None:
+                print(f"Skipping {d}: {job} failed")
+                d.ok = False
+                self._remaining -= 1
+                self._skip(d)
+
+    def _retry(self, job: Job) -> bool:
+        """ Schedules another attempt of a failed job, if any left. """
+        tries = self._tries.get(job, 0)
+        if self._stopping or tries >= self._retries:
+            return False
+        self._tries[job] = tries + 1
+        delay = min(self._backoff * 2**max(job.attempts - 1, 0), 3600)
+        print(f"Retrying {job} in {timedelta(seconds=round(delay))} "
+              f"(attempt {job.attempts + 1})")
+        job.ok = None
+        timer = threading.Timer(delay, self._submit, (job, ))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    def _done(self, worker: Worker):
+        job = worker.job
+        if job.resource == Resource.CPU:
+            self._pool.release(worker.core)
+        self._slots[job.resource].release()
+        if self._journal is not None:
+            if job.ok:
+                state = JobState.DONE
+            elif self._stopping:
+                state = JobState.INTERRUPTED
+            else:
+                state = JobState.FAILED
+            self._journal.finished(job, state)
+        if not self._stopping:
+            job.attempts += 1
+        with self._lock:
+            self._workers.discard(worker)
+            if not job.ok and self._retry(job):
+                return
+            self._remaining -= 1
+            if job.ok:
+                self._submit_ready(job.dependents)
+            else:
+                self._skip(job)
+            if self._remaining == 0:
+                self._all_done.set()
+
+    def _dispatch(self, resource: Resource):
+        q = self._queues[resource]
+        slots = self._slots[resource]
+        while True:
+            _, _, job = q.get()
+            if job is None or self._stopping:
+                break
+            slots.acquire()
+            if resource == Resource.CPU:
+                core = self._pool.acquire(near=job.near())
+            else:
+                # Not pinned, the core only selects a single trial in scripts
+                core = job.near() or 0
+            w = Worker(job,
+                       core,
+                       self._done,
+                       metrics=self._metrics,
+                       interval=self._interval)
+            with self._lock:
+                # Stopped while waiting for the slot or the core
+                if self._stopping:
+                    if resource == Resource.CPU and core is not None:
+                        self._pool.release(core)
+                    slots.release()
+                    break
+                job.core = core
+                job.start = time()
+                if self._journal is not None:
+                    self._journal.started(job)
+                # Started under the lock, so stop() only joins started ones
+                self._workers.add(w)
+                w.start()
+
+    def run(self, poll: Optional[Callable[[], None]] = None):
+        """ Runs until all jobs are done, calling `poll` every few seconds. """
+        with self._lock:
+            if self._remaining == 0:
+                return
+            self._submit_ready(self.jobs)
+        for r in Resource:
+            threading.Thread(target=self._dispatch, args=(r, ),
+                             daemon=True).start()
+        try:
+            while not self._all_done.wait(timeout=POLL_INTERVAL):
+                if poll is not None:
+                    poll()
+        except KeyboardInterrupt:
+            print("Received keyboard interrupt, killing workers...")
+            self.stop()
+        for q in self._queues.values():
+            q.put((-1, 0, None))
+
+    def stop(self):
+        """
+        Kills the running jobs and waits for them; queued jobs are dropped
+        and the dispatchers stop.
+        """
+        with self._lock:
+            self._stopping = True
+            workers = list(self._workers)
+        for q in self._queues.values():
+            while True:
+                try:
+                    q.get_nowait()
+                except Empty:
+                    break
+            q.put((-1, 0, None))
+        self._pool.cancel()
         for w in workers:
             w.kill()
-            q.put(None)
+        for w in workers:
+            w.join()
+
+    def report(self, times: Optional[Path] = None):
+        """ Prints wall-clock times per phase, optionally saves all jobs. """
+        by_phase: Dict[Phase, List[float]] = defaultdict(list)
+        for job in self.jobs:
+            if job.wall_time is not None:
+                by_phase[job.phase].append(job.wall_time)
+        print("Wall-clock times per phase:")
+        for phase in Phase:
+            ts = by_phase.get(phase)
+            if not ts:
+                continue
+            print(f"  {str(phase):13} {len(ts):4} jobs, "
+                  f"total {timedelta(seconds=round(sum(ts)))}, "
+                  f"mean {timedelta(seconds=round(sum(ts) / len(ts)))}, "
+                  f"max {timedelta(seconds=round(max(ts)))}")
+        failed = [j for j in self.jobs if j.ok is False]
+        if failed:
+            print(f"{len(failed)} jobs failed or skipped")
+        resumed = [j for j in self.jobs if j.resumed]
+        if resumed:
+            print(f"{len(resumed)} jobs completed in a previous run")
+        if times is None:
+            return
+        with times.open("w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["job", "phase", "resource", "core", "start", "end",
+                        "seconds", "ok"])
+            for job in self.jobs:
+                if job.resumed:
+                    continue
+                w.writerow([
+                    str(job), job.phase, job.resource, job.core, job.start,
+                    job.end, job.wall_time, job.ok
+                ])
+
+
+def run_queue(tasks: Iterable[Task],
+              par: int,
+              cores: Iterable[int],
+              disk_par: int = 4,
+              times: Optional[Path] = None,
+              journal: Optional[Journal] = None,
+              retries: int = 0,
+              backoff: float = 60,
+              metrics: Optional[Metrics] = None,
+              interval: float = 60):
+    taken = taken_cores()
+    pool = CorePool(c for c in cores if c not in taken)
+    print(f"Using {len(pool)} free cores" +
+          (f" (taken: {sorted(taken)})" if taken else ""))
+    if len(pool) == 0:
+        die("No free cores")
+    tasks = list(tasks)
+    known = {(t.outdir.absolute(), str(t)) for t in tasks}
+    sched = Scheduler(build_graph(tasks),
+                      pool,
+                      par,
+                      disk_par,
+                      journal=journal,
+                      retries=retries,
+                      backoff=backoff,
+                      metrics=metrics,
+                      interval=interval)
+
+    poll: Optional[Callable[[], None]] = None
+    if journal is not None:
+        last_config = journal.last_config()
 
-    for w in workers:
-        w.join()
+        def add_configs():
+            """ Adds the tasks of configs added to the journal meanwhile. """
+            nonlocal last_config
+            for config_id, d in journal.configs_since(last_config):
+                last_config = config_id
+                try:
+                    new = [
+                        t for t in parse_config(d)
+                        if (t.outdir.absolute(), str(t)) not in known
+                    ]
+                except (KeyError, ValueError) as e:
+                    print(f"Ignoring config {config_id}: {e}")
+                    continue
+                known.update((t.outdir.absolute(), str(t)) for t in new)
+                print(f"Adding {len(new)} tasks from config {config_id}")
+                sched.add(build_graph(new))
+
+        poll = add_configs
+
+    sched.run(poll)
+    sched.report(times)
     print("All done!")
 
 
+def default_journal(d: Dict) -> Path:
+    """ The journal of a config is next to its Nyx-Net output directory. """
+    return Path(d["nyx_outdir"]).absolute().joinpath("runqueue.sqlite")
+
+
+def connect_docker() -> containers.ContainerManager:
+    """
+    A container manager on the Docker socket, after removing the containers
+    left by earlier runs that were killed.
+    """
+    try:
+        manager = containers.ContainerManager()
+        manager.client.ping()
+        removed = manager.cleanup()
+    except containers.DockerError as e:
+        die(f"Docker API: {e}")
+    if removed:
+        print(f"Removed {removed} containers of earlier runs")
+    return manager
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run experiments in a queue")
     parser.add_argument("-j",
                         "--par",
-                        help=("How many experiments (fuzzer+target trials) "
+                        help=("How many jobs (phases of fuzzer+target trials) "
                               "to run in parallel"),
                         type=int,
                         default=52)
+    parser.add_argument("-C",
+                        "--cores",
+                        help=("Cores to use, e.g. 0-23,48-71; cores taken by "
+                              "other processes are skipped (default: all)"),
+                        type=parse_cpulist,
+                        default=list(range(os.cpu_count())))
+    parser.add_argument("-D",
+                        "--disk-par",
+                        help=("How many I/O-bound jobs (e.g. extracting "
+                              "archives) to run in parallel"),
+                        type=int,
+                        default=4)
+    parser.add_argument("-t",
+                        "--times",
+                        help="Save the wall-clock times of all jobs as CSV",
+                        type=Path)
+    parser.add_argument("-J",
+                        "--journal",
+                        help=("Journal of the queue, to resume it after an "
+                              "interrupt (default: runqueue.sqlite in "
+                              "nyx_outdir)"),
+                        type=Path)
+    parser.add_argument("-R",
+                        "--retries",
+                        help="How many times to retry a failed job",
+                        type=int,
+                        default=2)
+    parser.add_argument("-B",
+                        "--backoff",
+                        help=("Seconds before the first retry of a failed "
+                              "job; doubles at every attempt"),
+                        type=float,
+                        default=60)
+    parser.add_argument("-M",
+                        "--metrics",
+                        help=("Append samples of running fuzzers (execs/sec, "
+                              "corpus, CPU, RSS) to this CSV file"),
+                        type=Path)
+    parser.add_argument("--metrics-listen",
+                        help=("Serve the latest samples in the Prometheus "
+                              "format on host:port/metrics"),
+                        metavar="HOST:PORT")
+    parser.add_argument("-I",
+                        "--sample-interval",
+                        help="Seconds between samples of running fuzzers",
+                        type=float,
+                        default=60)
+    parser.add_argument("-a",
+                        "--add",
+                        help=("Add the tasks of the config to the queue "
+                              "running with the same journal and exit"),
+                        action="store_true")
+    parser.add_argument("--docker-api",
+                        help=("Run the containers through the Docker socket "
+                              "(DOCKER_HOST or /var/run/docker.sock) instead "
+                              "of sudo docker"),
+                        action="store_true")
+    parser.add_argument("-n",
+                        "--check",
+                        help=("Only check the config and the subjects it "
+                              "uses, without running anything"),
+                        action="store_true")
     parser.add_argument("config",
                         help="Config files",
                         type=Path,
@@ -384,15 +1286,58 @@ def main():
     global SCRIPTS_PATH
     SCRIPTS_PATH = os.path.abspath(os.path.dirname(sys.argv[0]))
 
-    q = Queue()
+    try:
+        subjects.registry()
+    except ValueError as e:
+        die(f"Invalid subjects:\n{e}")
+
     with args.config.open() as f:
         d = json.load(f)
     if type(d) != dict:
         die(f"Expected top level dict, got '{type(d)}'")
-    for t in parse_config(d):
-        q.put(t)
+    try:
+        tasks = list(parse_config(d))
+    except (KeyError, ValueError) as e:
+        die(f"Invalid config {args.config}: {e}")
+    if args.check:
+        print(f"{args.config}: {len(tasks)} tasks, "
+              f"{len(build_graph(tasks))} jobs")
+        return
 
-    run_queue(q, args.par)
+    journal = Journal(args.journal or default_journal(d))
+    if args.add:
+        config_id = journal.add_config(d)
+        print(f"Added {len(tasks)} tasks to {journal.path} "
+              f"(config {config_id})")
+        return
+    print(f"Journal: {journal.path}")
+
+    if args.docker_api:
+        Task.docker = connect_docker()
+
+    metrics = None
+    if args.metrics is not None or args.metrics_listen is not None:
+        metrics = Metrics(args.metrics)
+        if args.metrics_listen is not None:
+            metrics.serve(args.metrics_listen)
+
+    try:
+        run_queue(tasks,
+                  args.par,
+                  args.cores,
+                  disk_par=args.disk_par,
+                  times=args.times,
+                  journal=journal,
+                  retries=args.retries,
+                  backoff=args.backoff,
+                  metrics=metrics,
+                  interval=args.sample_interval)
+    finally:
+        journal.close()
+        if metrics is not None:
+            metrics.close()
+        if Task.docker is not None:
+            Task.docker.kill()
 
 
 if __name__ == "__main__":
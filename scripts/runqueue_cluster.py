@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Runs the queue of runqueue.py on several nodes.
+
+The coordinator parses the configs, groups the tasks by trial (the shards
+of a trial need the same extracted archive, so they run on the same node)
+and serves the groups over HTTP. Agents, one per node, claim a group
+whenever they have free cores, so nodes with more free cores take more
+groups. An agent fetches the inputs of the group (archives of earlier runs
+for only_cov), runs its phases with the scheduler of runqueue.py in a local
+work directory and sends the results (trial archives, coverage, logs) back;
+the coordinator extracts them into its own outdirs and records the jobs in
+its journal, so a restarted coordinator skips completed trials. Groups of an
+agent that stops sending heartbeats are handed out again.
+
+Several agents with distinct work directories and cores can run on the same
+box, e.g. to test a config:
+
+    runqueue_cluster.py coordinator -l 127.0.0.1:8642 config.json
+    runqueue_cluster.py agent -C 0-7 -w /tmp/agent0 http://127.0.0.1:8642
+    runqueue_cluster.py agent -C 8-15 -w /tmp/agent1 http://127.0.0.1:8642
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import sleep, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import runqueue
+from runqueue import (CorePool, Journal, JobState, Job, Phase, Scheduler,
+                      Task, build_graph, connect_docker, default_journal, die,
+                      parse_config, parse_cpulist, taken_cores)
+
+# Seconds between claims of an idle agent and between heartbeats
+AGENT_POLL = 10
+
+
+def group_tasks(tasks: Iterable[Task]) -> List[List[Task]]:
+    """ Tasks grouped by trial (shards of a trial go together). """
+    groups: Dict[Tuple[Path, str], List[Task]] = OrderedDict()
+    for t in tasks:
+        groups.setdefault((t.outdir.absolute(), t.trial), []).append(t)
+    return list(groups.values())
+
+
+def result_paths(jobs: Iterable[Job]) -> List[Path]:
+    """ What an agent sends back after running the jobs of a group. """
+    paths = []
+    for job in jobs:
+        task = job.task
+        if job.phase == Phase.EXTRACT:
+            continue
+        if job.phase == Phase.FUZZ and task.fuzzer.type == \
+                runqueue.FuzzerType.NYX:
+            # Also logs and stats (e.g. thread_stats_*.msgp for execs/sec)
+            paths.append(task.trial_outdir)
+        else:
+            paths += task.artifacts(job.phase)
+        if task.log_path not in paths:
+            paths.append(task.log_path)
+    return paths
+
+
+def write_tar(f, root: Path, paths: Iterable[Path]):
+    """ Streams an uncompressed tar of `paths` (relative to `root`). """
+    with tarfile.open(fileobj=f, mode="w|") as tar:
+        for p in paths:
+            if p.exists():
+                tar.add(str(p), arcname=str(p.relative_to(root)))
+
+
+def extract_tar(f, root: Path):
+    """ Extracts a tar stream into `root`, refusing paths outside of it. """
+    root = root.absolute()
+    with tarfile.open(fileobj=f, mode="r|") as tar:
+        for m in tar:
+            if m.issym() or m.islnk():
+                print(f"Skipping link {m.name}")
+                continue
+            dest = root.joinpath(m.name).resolve()
+            if root.resolve() not in dest.parents:
+                raise ValueError(f"Refusing to extract {m.name}")
+            # Replace earlier copies (e.g. of a failed attempt)
+            if dest.is_file() and m.isfile():
+                dest.unlink()
+            tar.extract(m, str(root))
+
+
+class Group:
+    """ The tasks of a trial, handed to an agent as a unit. """
+    def __init__(self, gid: int, tasks: List[Task]):
+        self.gid = gid
+        self.tasks = tasks
+        self.jobs = build_graph(tasks)
+        self.agent: Optional[str] = None
+        # None while pending or running
+        self.ok: Optional[bool] = None
+
+    def __str__(self):
+        return self.tasks[0].trial
+
+    @property
+    def outdir(self) -> Path:
+        return self.tasks[0].outdir.absolute()
+
+    def inputs(self) -> List[Path]:
+        return sorted(set(p for t in self.tasks for p in t.inputs()))
+
+
+class Coordinator:
+    """ Hands groups of tasks to agents and collects their results. """
+    def __init__(self,
+                 tasks: Iterable[Task],
+                 journal: Journal,
+                 lease: float = 600):
+        self._journal = journal
+        self._lease = lease
+        self._lock = threading.Lock()
+        self._groups: Dict[int, Group] = {}
+        self._pending: List[Group] = []
+        # Last heartbeat of each agent
+        self._seen: Dict[str, float] = {}
+        self.finished = threading.Event()
+        for i, ts in enumerate(group_tasks(tasks)):
+            g = Group(i, ts)
+            self._groups[i] = g
+            if all(journal.completed(j.key) for j in g.jobs):
+                g.ok = True
+            else:
+                self._pending.append(g)
+        done = len(self._groups) - len(self._pending)
+        print(f"{len(self._groups)} trials, {done} completed in a previous "
+              "run")
+        self._check_finished()
+
+    def _check_finished(self):
+        if all(g.ok is not None for g in self._groups.values()):
+            self.finished.set()
+
+    def _expire(self):
+        """ Hands out again the groups of agents that went silent. """
+        now = time()
+        for g in self._groups.values():
+            if g.ok is None and g.agent is not None and \
+                    now - self._seen.get(g.agent, 0) > self._lease:
+                print(f"Agent {g.agent} lost, requeuing {g}")
+                g.agent = None
+                self._pending.insert(0, g)
+
+    def claim(self, agent: str, free: int) -> Dict:
+        with self._lock:
+            self._seen[agent] = time()
+            self._expire()
+            if self.finished.is_set():
+                return {"exit": True}
+            # The largest group that fits in the free cores of the agent
+            fits = [g for g in self._pending if len(g.tasks) <= free]
+            if not fits:
+                if not self._pending or free < 1:
+                    return {}
+                fits = self._pending[:1]
+            g = max(fits, key=lambda g: len(g.tasks))
+            self._pending.remove(g)
+            g.agent = agent
+        print(f"Handing {g} to {agent} ({free} free cores)")
+        return {"group": g.gid, "tasks": [t.to_dict() for t in g.tasks]}
+
+    def heartbeat(self, agent: str):
+        with self._lock:
+            self._seen[agent] = time()
+
+    def group(self, gid: int, agent: str) -> Group:
+        with self._lock:
+            g = self._groups.get(gid)
+            if g is None or g.agent != agent or g.ok is not None:
+                raise KeyError(f"Group {gid} is not assigned to {agent}")
+            return g
+
+    def report(self, gid: int, agent: str, jobs: List[Dict]):
+        """ Records the jobs of a group run by an agent. """
+        g = self.group(gid, agent)
+        by_name = {str(j): j for j in g.jobs}
+        for r in jobs:
+            job = by_name.get(r["job"])
+            if job is None or r["start"] is None:
+                continue
+            job.core, job.start, job.end = r["core"], r["start"], r["end"]
+            job.exit_code = r["exit_code"]
+            job.ok = r["ok"]
+            self._journal.started(job)
+            self._journal.finished(
+                job, JobState.DONE if job.ok else JobState.FAILED)
+        with self._lock:
+            g.ok = all(j.ok for j in g.jobs)
+            self._check_finished()
+        status = "done" if g.ok else "failed"
+        print(f"{g} {status} on {agent}")
+
+
+def make_handler(coord: Coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, obj, code: int = 200):
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> Dict:
+            n = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(n) or b"{}")
+
+        def _route(self) -> Tuple[str, Optional[int], str]:
+            """ /<action>[/<group>]?agent=<name> """
+            path, _, query = self.path.partition("?")
+            parts = path.strip("/").split("/")
+            gid = int(parts[1]) if len(parts) > 1 else None
+            agent = query[len("agent="):] if query.startswith("agent=") \
+                else ""
+            return parts[0], gid, urllib.parse.unquote(agent)
+
+        def do_GET(self):
+            action, gid, agent = self._route()
+            if action != "inputs":
+                return self._json({"error": "not found"}, 404)
+            try:
+                g = coord.group(gid, agent)
+            except KeyError as e:
+                return self._json({"error": str(e)}, 409)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-tar")
+            self.end_headers()
+            write_tar(self.wfile, g.outdir, g.inputs())
+
+        def do_POST(self):
+            action, gid, agent = self._route()
+            try:
+                if action == "claim":
+                    return self._json(coord.claim(agent, self._body()["free"]))
+                if action == "heartbeat":
+                    coord.heartbeat(agent)
+                    return self._json({})
+                if action == "report":
+                    coord.report(gid, agent, self._body()["jobs"])
+                    return self._json({})
+            except KeyError as e:
+                return self._json({"error": str(e)}, 409)
+            self._json({"error": "not found"}, 404)
+
+        def do_PUT(self):
+            action, gid, agent = self._route()
+            if action != "results":
+                return self._json({"error": "not found"}, 404)
+            try:
+                g = coord.group(gid, agent)
+                n = int(self.headers["Content-Length"])
+                with tempfile.TemporaryFile() as tmp:
+                    while n > 0:
+                        chunk = self.rfile.read(min(n, 1 << 20))
+                        if not chunk:
+                            raise ValueError("Truncated results")
+                        tmp.write(chunk)
+                        n -= len(chunk)
+                    tmp.seek(0)
+                    extract_tar(tmp, g.outdir)
+            except KeyError as e:
+                return self._json({"error": str(e)}, 409)
+            except (ValueError, tarfile.TarError) as e:
+                return self._json({"error": str(e)}, 400)
+            self._json({})
+
+    return Handler
+
+
+def run_coordinator(args):
+    tasks = []
+    journal_path = args.journal
+    for config in args.configs:
+        with config.open() as f:
+            d = json.load(f)
+        if type(d) != dict:
+            die(f"Expected top level dict, got '{type(d)}'")
+        try:
+            tasks += parse_config(d)
+        except (KeyError, ValueError) as e:
+            die(f"Invalid config {config}: {e}")
+        journal_path = journal_path or default_journal(d)
+
+    journal = Journal(journal_path)
+    coord = Coordinator(tasks, journal, lease=args.lease)
+    host, _, port = args.listen.rpartition(":")
+    server = ThreadingHTTPServer((host, int(port)), make_handler(coord))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving on {args.listen}, journal: {journal.path}")
+    try:
+        while not coord.finished.wait(timeout=AGENT_POLL):
+            pass
+        # Tell the agents to exit on their next claim
+        sleep(2 * AGENT_POLL)
+    except KeyboardInterrupt:
+        print("Received keyboard interrupt, exiting...")
+    server.shutdown()
+    journal.close()
+    print("All done!")
+
+
+class Agent:
+    """ Claims groups from a coordinator and runs them on local cores. """
+    def __init__(self, url: str, name: str, workdir: Path, pool: CorePool,
+                 disk_par: int, retries: int, backoff: float):
+        self.url = url.rstrip("/")
+        self.name = name
+        self.workdir = workdir.absolute()
+        self._pool = pool
+        self._capacity = len(pool)
+        self._disk_par = disk_par
+        self._retries = retries
+        self._backoff = backoff
+        self._lock = threading.Lock()
+        # Running groups and the cores they reserve
+        self._running: Dict[int, Tuple[threading.Thread, Scheduler, int]] = {}
+        self._stopping = False
+
+    def _url(self, action: str, gid: Optional[int] = None) -> str:
+        path = action if gid is None else f"{action}/{gid}"
+        return (f"{self.url}/{path}?agent="
+                f"{urllib.parse.quote(self.name)}")
+
+    def _post(self, action: str, obj: Dict,
+              gid: Optional[int] = None) -> Dict:
+        req = urllib.request.Request(self._url(action, gid),
+                                     data=json.dumps(obj).encode(),
+                                     headers={
+                                         "Content-Type": "application/json"
+                                     })
+        with urllib.request.urlopen(req) as r:
+            return json.load(r)
+
+    def local_outdir(self, outdir: str) -> Path:
+        """ Where the agent keeps the files of a coordinator outdir. """
+        return self.workdir.joinpath(outdir.strip("/").replace("/", "_"))
+
+    def free(self) -> int:
+        """ Cores not reserved by running groups (one per task). """
+        with self._lock:
+            reserved = sum(n for _, _, n in self._running.values())
+        return self._capacity - reserved
+
+    def _run_group(self, gid: int, tasks: List[Task], outdir: Path):
+        sched = self._running[gid][1]
+        ok = False
+        try:
+            with urllib.request.urlopen(self._url("inputs", gid)) as r:
+                extract_tar(r, outdir)
+            sched.run()
+            with tempfile.TemporaryFile() as tmp:
+                write_tar(tmp, outdir, result_paths(j for j in sched.jobs
+                                                    if j.ok))
+                size = tmp.tell()
+                tmp.seek(0)
+                req = urllib.request.Request(self._url("results", gid),
+                                             data=tmp,
+                                             method="PUT",
+                                             headers={
+                                                 "Content-Length": str(size),
+                                                 "Content-Type":
+                                                 "application/x-tar"
+                                             })
+                urllib.request.urlopen(req).close()
+            if not self._stopping:
+                self._post("report", {
+                    "jobs": [{
+                        "job": str(j),
+                        "ok": bool(j.ok),
+                        "core": j.core,
+                        "start": j.start,
+                        "end": j.end,
+                        "exit_code": j.exit_code
+                    } for j in sched.jobs]
+                }, gid)
+                ok = all(j.ok for j in sched.jobs)
+        except (OSError, ValueError, tarfile.TarError) as e:
+            print(f"Group {gid} failed: {e}")
+            if not self._stopping:
+                try:
+                    # No jobs: the coordinator marks the group as failed
+                    self._post("report", {"jobs": []}, gid)
+                except (OSError, ValueError):
+                    pass
+        finally:
+            with self._lock:
+                del self._running[gid]
+            if ok:
+                # Results are on the coordinator now
+                for t in tasks:
+                    trial = t.trial_outdir
+                    archive = trial.with_name(f"{trial.name}.tar.gz")
+                    for p in [trial, archive, t.log_path]:
+                        if p.is_dir():
+                            shutil.rmtree(p, ignore_errors=True)
+                        elif p.exists():
+                            p.unlink()
+
+    def _start(self, gid: int, task_dicts: List[Dict]):
+        tasks = [Task.from_dict(d) for d in task_dicts]
+        outdir = self.local_outdir(str(tasks[0].outdir))
+        outdir.mkdir(parents=True, exist_ok=True)
+        for t in tasks:
+            t.outdir = outdir
+        print(f"Running {tasks[0].trial} (group {gid}) in {outdir}")
+        sched = Scheduler(build_graph(tasks),
+                          self._pool,
+                          len(tasks),
+                          self._disk_par,
+                          retries=self._retries,
+                          backoff=self._backoff)
+        th = threading.Thread(target=self._run_group,
+                              args=(gid, tasks, outdir))
+        with self._lock:
+            self._running[gid] = (th, sched, len(tasks))
+        th.start()
+
+    def run(self):
+        last_beat = 0.0
+        exiting = False
+        try:
+            while not (exiting and not self._running):
+                claimed = False
+                try:
+                    if time() - last_beat > AGENT_POLL:
+                        self._post("heartbeat", {})
+                        last_beat = time()
+                    free = self.free()
+                    if not exiting and free > 0:
+                        r = self._post("claim", {"free": free})
+                        exiting = r.get("exit", False)
+                        if "group" in r:
+                            self._start(r["group"], r["tasks"])
+                            claimed = True
+                except (OSError, ValueError) as e:
+                    print(f"Coordinator unreachable: {e}")
+                if not claimed:
+                    sleep(AGENT_POLL if not exiting else 1)
+        except KeyboardInterrupt:
+            print("Received keyboard interrupt, killing workers...")
+            self._stopping = True
+            with self._lock:
+                running = list(self._running.values())
+            for _, sched, _ in running:
+                sched.stop()
+            for th, _, _ in running:
+                th.join()
+        print("All done!")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run experiments in a queue on several nodes")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p = sub.add_parser("coordinator", help="Serve the tasks of the configs")
+    p.add_argument("-l",
+                   "--listen",
+                   help="Address to listen on (default: 0.0.0.0:8642)",
+                   default="0.0.0.0:8642")
+    p.add_argument("-J",
+                   "--journal",
+                   help=("Journal of the queue (default: runqueue.sqlite in "
+                         "nyx_outdir of the first config)"),
+                   type=Path)
+    p.add_argument("-L",
+                   "--lease",
+                   help=("Seconds without heartbeats after which the trials "
+                         "of an agent are handed out again"),
+                   type=float,
+                   default=600)
+    p.add_argument("configs",
+                   help="Config files",
+                   type=Path,
+                   nargs="+",
+                   metavar="config.json")
+
+    p = sub.add_parser("agent", help="Run tasks of a coordinator")
+    p.add_argument("-C",
+                   "--cores",
+                   help=("Cores to use, e.g. 0-23,48-71; cores taken by "
+                         "other processes are skipped (default: all)"),
+                   type=parse_cpulist,
+                   default=list(range(os.cpu_count())))
+    p.add_argument("-w",
+                   "--workdir",
+                   help="Where to keep inputs and outputs of running trials",
+                   type=Path,
+                   required=True)
+    p.add_argument("-n",
+                   "--name",
+                   help="Name of the agent (default: hostname and pid)",
+                   default=f"{socket.gethostname()}-{os.getpid()}")
+    p.add_argument("-D",
+                   "--disk-par",
+                   help=("How many I/O-bound jobs (e.g. extracting "
+                         "archives) to run in parallel"),
+                   type=int,
+                   default=4)
+    p.add_argument("-R",
+                   "--retries",
+                   help="How many times to retry a failed job",
+                   type=int,
+                   default=2)
+    p.add_argument("-B",
+                   "--backoff",
+                   help=("Seconds before the first retry of a failed job; "
+                         "doubles at every attempt"),
+                   type=float,
+                   default=60)
+    p.add_argument("--docker-api",
+                   help=("Run the containers through the Docker socket "
+                         "instead of sudo docker"),
+                   action="store_true")
+    p.add_argument("url", help="Coordinator, e.g. http://node0:8642")
+
+    args = parser.parse_args()
+
+    runqueue.SCRIPTS_PATH = os.path.abspath(os.path.dirname(sys.argv[0]))
+
+    if args.mode == "coordinator":
+        run_coordinator(args)
+        return
+
+    taken = taken_cores()
+    pool = CorePool(c for c in args.cores if c not in taken)
+    if len(pool) == 0:
+        die("No free cores")
+    print(f"Agent {args.name}: {len(pool)} free cores")
+    if args.docker_api:
+        Task.docker = connect_docker()
+    try:
+        Agent(args.url, args.name, args.workdir, pool, args.disk_par,
+              args.retries, args.backoff).run()
+    finally:
+        if Task.docker is not None:
+            Task.docker.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Registry of the subjects: every subjects/<PROTO>/<Name> has a subject.json
+with what the scripts need to know about it, e.g. for Exim:
+
+    {
+        "name": "exim",
+        "protocol": "SMTP",
+        "port": 25,
+        "afl": {"delay": 10000, "poll_wait": 100},
+        "replay": {"wait": 100},
+        "coverage": {"gcda": true}
+    }
+
+- name: target name used by all the scripts (image pfb-<name>, Nyx-Net
+  spec nyx_<name>, output directories)
+- protocol: protocol of AFLNet (-P) and of its replayer
+- port: port the server listens on
+- afl: options of the AFL-based fuzzers: timeout (-t, e.g. "1000+"),
+  memory (-m, MB or "none"), delay (-D, AFLNet and AFLNwe only, usec),
+  poll_wait (-W, ms), cleanup (-c, script run between inputs)
+- aflnet: options of AFLNet only: state (state-aware flags, default
+  "-q 3 -s 3 -E"), region (-R) and local_port (-l)
+- replay: how inputs are replayed (coverage, triage): wait (poll timeout of
+  aflnet-replay, ms, default 1) and timeout (seconds the server runs for an
+  input, default 3)
+- coverage: what its coverage scripts support: gcda (reading coverage with
+  gcda_cov.py, needed by coverage.sh -g and -k, default false)
+
+The registry is loaded and validated once; runqueue.py takes the fuzzer
+options from it and common.bash declares the ports and protocols of
+`subjects.py bash`:
+
+    subjects.py check
+    subjects.py list
+    eval "$(subjects.py bash)"
+"""
+
+import argparse
+import json
+import shlex
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+SUBJECTS_DIR = Path(__file__).absolute().parents[1].joinpath("subjects")
+FILE_NAME = "subject.json"
+# State-aware options of AFLNet, unless the subject has its own
+AFLNET_STATE = "-q 3 -s 3 -E"
+FUZZERS = ("aflnet", "aflnwe", "aflpp")
+
+# Keys of each section: type and whether they are required
+SCHEMA = {
+    None: {
+        "name": (str, True),
+        "protocol": (str, True),
+        "port": (int, True),
+        "afl": (dict, True),
+        "aflnet": (dict, False),
+        "replay": (dict, False),
+        "coverage": (dict, False)
+    },
+    "afl": {
+        "timeout": ((str, int), False),
+        "memory": ((str, int), False),
+        "delay": (int, True),
+        "poll_wait": (int, False),
+        "cleanup": (str, False)
+    },
+    "aflnet": {
+        "state": (str, False),
+        "region": (bool, False),
+        "local_port": (int, False)
+    },
+    "replay": {
+        "wait": (int, False),
+        "timeout": (int, False)
+    },
+    "coverage": {
+        "gcda": (bool, False)
+    }
+}
+
+_registry: Optional[Dict[str, "Subject"]] = None
+
+
+class Subject:
+    """ A target server with its settings (see the module docstring). """
+    def __init__(self, path: Path, d: Dict):
+        self.path = path
+        self.name: str = d["name"]
+        self.protocol: str = d["protocol"]
+        self.port: int = d["port"]
+        self.afl: Dict = d["afl"]
+        self.aflnet: Dict = d.get("aflnet", {})
+        self.replay_wait: int = d.get("replay", {}).get("wait", 1)
+        self.replay_timeout: int = d.get("replay", {}).get("timeout", 3)
+        self.cov_gcda: bool = d.get("coverage", {}).get("gcda", False)
+
+    @property
+    def dir(self) -> Path:
+        return self.path.parent
+
+    def __str__(self):
+        return self.name
+
+    def fuzzer_opts(self, fuzzer: str, state: bool = True) -> str:
+        """
+        Options of an AFL-based fuzzer (aflnet, aflnwe or aflpp) on this
+        subject; `state` is AFLNet's state-awareness.
+        """
+        if fuzzer not in FUZZERS:
+            raise ValueError(f"No options for fuzzer '{fuzzer}'")
+        afl = self.afl
+        opts: List[str] = []
+        if "timeout" in afl:
+            opts += ["-t", str(afl["timeout"])]
+        if "memory" in afl:
+            opts += ["-m", str(afl["memory"])]
+        if fuzzer == "aflpp":
+            return " ".join(opts)
+        if fuzzer == "aflnet":
+            opts += ["-P", self.protocol]
+        opts += ["-D", str(afl["delay"])]
+        if fuzzer == "aflnet":
+            if state:
+                opts += self.aflnet.get("state", AFLNET_STATE).split()
+            if "local_port" in self.aflnet:
+                opts += ["-l", str(self.aflnet["local_port"])]
+        opts.append("-K")
+        if "cleanup" in afl:
+            opts += ["-c", afl["cleanup"]]
+        if fuzzer == "aflnet" and self.aflnet.get("region", False):
+            opts.append("-R")
+        if "poll_wait" in afl:
+            opts += ["-W", str(afl["poll_wait"])]
+        return " ".join(opts)
+
+
+def validate(d: object, section: Optional[str] = None) -> List[str]:
+    """ Problems of a subject file (or one of its sections). """
+    where = "" if section is None else f"{section}."
+    if type(d) != dict:
+        return [f"{section or 'subject'} is not an object"]
+    errors = []
+    schema = SCHEMA[section]
+    for key in d:
+        if key not in schema:
+            errors.append(f"unknown key '{where}{key}'")
+    for key, (typ, required) in schema.items():
+        if key not in d:
+            if required:
+                errors.append(f"missing '{where}{key}'")
+            continue
+        value = d[key]
+        # bool is an int, but not the other way around
+        if not isinstance(value, typ) or \
+           (isinstance(value, bool) and typ is not bool):
+            errors.append(f"'{where}{key}' has the wrong type")
+            continue
+        if typ is dict:
+            errors += validate(value, key)
+        elif typ is int and value < 0:
+            errors.append(f"'{where}{key}' must not be negative")
+    if section is None and not errors:
+        if not 0 < d["port"] < 65536:
+            errors.append(f"invalid port {d['port']}")
+        if d["name"] != d["name"].lower() or not d["name"] or \
+           any(c.isspace() or c == "/" for c in d["name"]):
+            errors.append(f"invalid name '{d['name']}'")
+    return errors
+
+
+def load(root: Path = SUBJECTS_DIR) -> Dict[str, Subject]:
+    """
+    All the subjects under `root` by name; raises ValueError listing the
+    problems of all the files if any is invalid.
+    """
+    subjects: Dict[str, Subject] = {}
+    errors = []
+    for path in sorted(root.glob(f"*/*/{FILE_NAME}")):
+        rel = path.relative_to(root)
+        try:
+            d = json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            errors.append(f"{rel}: {e}")
+            continue
+        problems = validate(d)
+        if problems:
+            errors += [f"{rel}: {p}" for p in problems]
+            continue
+        subject = Subject(path, d)
+        if subject.name in subjects:
+            errors.append(f"{rel}: '{subject.name}' already defined in "
+                          f"{subjects[subject.name].path.relative_to(root)}")
+            continue
+        subjects[subject.name] = subject
+    for d in sorted(p for p in root.glob("*/*") if p.is_dir()):
+        if not d.joinpath(FILE_NAME).exists():
+            errors.append(f"{d.relative_to(root)}: no {FILE_NAME}")
+    if errors:
+        raise ValueError("\n".join(errors))
+    return subjects
+
+
+def registry() -> Dict[str, Subject]:
+    """ The subjects of the repository, loaded once. """
+    global _registry
+    if _registry is None:
+        _registry = load()
+    return _registry
+
+
+def get(name: Union[str, object]) -> Subject:
+    """ The subject with this name; raises ValueError if unknown. """
+    subjects = registry()
+    try:
+        return subjects[str(name)]
+    except KeyError:
+        raise ValueError(f"Unknown target '{name}' (known: "
+                         f"{', '.join(sorted(subjects))})") from None
+
+
+def bash(subjects: Dict[str, Subject]) -> str:
+    """ Declarations of the associative arrays used by common.bash. """
+    lines = ["declare -A ports protocols subject_dirs cov_gcda"]
+    for name, s in sorted(subjects.items()):
+        q = shlex.quote(name)
+        lines.append(f"ports[{q}]={s.port}")
+        lines.append(f"protocols[{q}]={shlex.quote(s.protocol)}")
+        lines.append(f"subject_dirs[{q}]={shlex.quote(str(s.dir))}")
+        if s.cov_gcda:
+            lines.append(f"cov_gcda[{q}]=1")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registry of the subjects")
+    parser.add_argument("-d",
+                        "--dir",
+                        type=Path,
+                        default=SUBJECTS_DIR,
+                        help="Subjects directory")
+    parser.add_argument("cmd",
+                        choices=["check", "list", "bash"],
+                        help=("Validate the subjects, list their names and "
+                              "directories, or print bash declarations"))
+    args = parser.parse_args()
+
+    try:
+        subjects = load(args.dir)
+    except ValueError as e:
+        print(f"Invalid subjects:\n{e}", file=sys.stderr)
+        sys.exit(1)
+    if args.cmd == "check":
+        print(f"{len(subjects)} subjects OK")
+    elif args.cmd == "list":
+        for name, s in sorted(subjects.items()):
+            print(f"{name} {s.dir}")
+    else:
+        print(bash(subjects))
+
+
+if __name__ == "__main__":
+    main()
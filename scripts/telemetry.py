@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Live performance metrics of running fuzzing trials, sampled by runqueue.py.
+
+AFL-based fuzzers run in a docker container: their fuzzer_stats file is
+read with `docker exec` and CPU and memory come from `docker stats`. Nyx-Net
+runs on the host: the corpus is counted in the trial directory, execs/sec
+come from its thread stats and CPU and RSS are summed over the process group
+of the trial.
+
+Samples are appended to a CSV file and, optionally, the latest sample of
+every task is served in the Prometheus text format, e.g.
+
+    runqueue.py -M metrics.csv --metrics-listen 127.0.0.1:9642 config.json
+    curl http://127.0.0.1:9642/metrics
+"""
+
+import csv
+import os
+import re
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(str(Path(__file__).absolute().parent.joinpath("nyx-eval")))
+import nyx_stats  # noqa: E402
+
+# Run docker without asking for a password (the scripts use sudo)
+DOCKER = ["sudo", "-n", "docker"]
+# Working directory in the subject images
+CONT_WORKDIR = "/home/ubuntu/experiments"
+
+FIELDS = ["execs_per_sec", "execs", "corpus", "cpu", "rss"]
+HELP = {
+    "execs_per_sec": "Executions per second",
+    "execs": "Total executions",
+    "corpus": "Inputs in the corpus",
+    "cpu": "CPU usage (percent of a core)",
+    "rss": "Resident memory (bytes)"
+}
+
+Sample = Dict[str, Optional[float]]
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+SIZE_RE = re.compile(r"^([\d.]+)\s*([KMGT]?i?B)$")
+SIZE_UNITS = {
+    "B": 1,
+    "kB": 1e3,
+    "KB": 1e3,
+    "MB": 1e6,
+    "GB": 1e9,
+    "TB": 1e12,
+    "KiB": 2**10,
+    "MiB": 2**20,
+    "GiB": 2**30,
+    "TiB": 2**40
+}
+
+
+def run(cmd: List[str], timeout: float = 30) -> Optional[str]:
+    """ Output of `cmd`, None if it fails. """
+    try:
+        p = subprocess.run(cmd,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL,
+                           timeout=timeout,
+                           universal_newlines=True)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return p.stdout if p.returncode == 0 else None
+
+
+def parse_size(s: str) -> Optional[float]:
+    """ Parses sizes printed by docker, e.g. 12.5MiB. """
+    m = SIZE_RE.match(s.strip())
+    if m is None or m[2] not in SIZE_UNITS:
+        return None
+    return float(m[1]) * SIZE_UNITS[m[2]]
+
+
+def parse_fuzzer_stats(text: str) -> Sample:
+    """ execs, execs/sec and corpus size from an AFL fuzzer_stats file. """
+    stats = {}
+    for line in text.splitlines():
+        k, _, v = line.partition(":")
+        stats[k.strip()] = v.strip()
+
+    def num(*keys: str) -> Optional[float]:
+        for k in keys:
+            try:
+                return float(stats[k])
+            except (KeyError, ValueError):
+                pass
+        return None
+
+    return {
+        "execs_per_sec": num("execs_per_sec"),
+        "execs": num("execs_done"),
+        # AFL++ renamed paths_total
+        "corpus": num("corpus_count", "paths_total")
+    }
+
+
+def proc_usage(pgid: int) -> Tuple[float, float]:
+    """ CPU seconds and RSS (bytes) of the processes in a process group. """
+    cpu = rss = 0.0
+    for d in Path("/proc").glob("[0-9]*"):
+        try:
+            stat = d.joinpath("stat").read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces
+        fields = stat[stat.rindex(")") + 2:].split()
+        if int(fields[2]) != pgid:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / CLK_TCK
+        rss += int(fields[21]) * PAGE_SIZE
+    return cpu, rss
+
+
+class ContainerProbe:
+    """ Samples an AFL-based trial running in a docker container. """
+    def __init__(self, name_re: str, outdir_name: str):
+        # Containers of the scripts are named <date>-<target>-<fuzzer>-<i>
+        self.name_re = name_re
+        self.outdir_name = outdir_name
+        self._cid: Optional[str] = None
+        self._stats_path: Optional[str] = None
+
+    def _find(self) -> bool:
+        if self._cid is None:
+            out = run(DOCKER +
+                      ["ps", "-q", "--filter", f"name={self.name_re}"])
+            if not out:
+                return False
+            self._cid = out.split()[0]
+        if self._stats_path is None:
+            # The output directory is relative to the build of the subject
+            out = run(DOCKER + [
+                "exec", self._cid, "find", CONT_WORKDIR, "-maxdepth", "6",
+                "-path", f"*/{self.outdir_name}/*", "-name", "fuzzer_stats"
+            ])
+            if not out:
+                return False
+            self._stats_path = out.split()[0]
+        return True
+
+    def sample(self) -> Sample:
+        s: Sample = {}
+        if not self._find():
+            return s
+        out = run(DOCKER + ["exec", self._cid, "cat", self._stats_path])
+        if out is not None:
+            s.update(parse_fuzzer_stats(out))
+        out = run(DOCKER + [
+            "stats", "--no-stream", "--format",
+            "{{.CPUPerc}}|{{.MemUsage}}", self._cid
+        ])
+        if out:
+            cpu, _, mem = out.strip().partition("|")
+            try:
+                s["cpu"] = float(cpu.rstrip("%"))
+            except ValueError:
+                pass
+            s["rss"] = parse_size(mem.split("/")[0])
+        return s
+
+
+class HostProbe:
+    """ Samples a Nyx-Net trial running on the host. """
+    def __init__(self, trial_outdir: Path, pgid: int):
+        self.trial_outdir = trial_outdir
+        self.pgid = pgid
+        self._last: Optional[Tuple[float, float]] = None
+
+    def _execs(self) -> Sample:
+        """ Execs/sec and total execs from the thread stats. """
+        try:
+            trial = nyx_stats.Trial(self.trial_outdir,
+                                    execs_keys=nyx_stats.EXECS_KEYS,
+                                    time_keys=nyx_stats.TIME_KEYS,
+                                    time_scale=1)
+        except (OSError, ValueError):
+            return {}
+        if not trial.threads:
+            return {}
+        last = trial.last_execs_per_sec()
+        return {
+            "execs_per_sec": last if last is not None else
+            trial.execs_per_sec(),
+            "execs": sum(s[-1][1] for s in trial.threads.values())
+        }
+
+    def sample(self) -> Sample:
+        corpus = self.trial_outdir.joinpath("corpus")
+        cpu, rss = proc_usage(self.pgid)
+        now = time()
+        s: Sample = {
+            "corpus": sum(len(files) for _, _, files in os.walk(corpus)),
+            "rss": rss
+        }
+        s.update(self._execs())
+        if self._last is not None and now > self._last[0]:
+            s["cpu"] = 100 * (cpu - self._last[1]) / (now - self._last[0])
+        self._last = (now, cpu)
+        return s
+
+
+class Metrics:
+    """
+    Collects samples of running tasks: appends them to a CSV file and keeps
+    the latest one of each task for the metrics endpoint.
+    """
+    def __init__(self, path: Optional[Path] = None):
+        self._lock = threading.Lock()
+        self._latest: Dict[Tuple[str, str], Tuple[float, Sample]] = {}
+        self._file = None
+        if path is not None:
+            new = not path.exists() or path.stat().st_size == 0
+            self._file = path.open("a", newline="")
+            self._csv = csv.writer(self._file)
+            if new:
+                self._csv.writerow(["time", "task", "phase"] + FIELDS)
+                self._file.flush()
+
+    def add(self, task: str, phase: str, sample: Sample):
+        now = time()
+        with self._lock:
+            self._latest[(task, phase)] = (now, sample)
+            if self._file is None:
+                return
+            self._csv.writerow([int(now), task, phase] +
+                               [sample.get(f) for f in FIELDS])
+            self._file.flush()
+
+    def done(self, task: str, phase: str):
+        """ The task stopped, drop it from the endpoint. """
+        with self._lock:
+            self._latest.pop((task, phase), None)
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            latest = dict(self._latest)
+        for f in FIELDS:
+            lines.append(f"# HELP runqueue_{f} {HELP[f]}")
+            lines.append(f"# TYPE runqueue_{f} gauge")
+            for (task, phase), (_, s) in sorted(latest.items()):
+                if s.get(f) is not None:
+                    lines.append(f'runqueue_{f}{{task="{task}",'
+                                 f'phase="{phase}"}} {s[f]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, listen: str):
+        """ Serves /metrics on host:port in a background thread. """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        host, _, port = listen.rpartition(":")
+        server = ThreadingHTTPServer((host, int(port)), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
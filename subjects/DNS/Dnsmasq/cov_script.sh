@@ -61,6 +61,11 @@ function dump_coverage {
     set +e
 }
 
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
 #process initial seed corpus first
 for f in $(echo $folder/$testdir/*.raw); do 
   time=$(stat -c %Y $f)
@@ -74,7 +79,6 @@ for f in $(echo $folder/$testdir/*.raw); do
 done
 
 #process fuzzer-generated testcases
-count=0
 for f in $(ls -tr $folder/$testdir/id* $folder/$crashdir/id* $folder/$hangsdir/id*); do
   time=$(stat -c %Y $f)
   echo "[*] $time : $f"
@@ -83,18 +87,11 @@ for f in $(ls -tr $folder/$testdir/id* $folder/$crashdir/id* $folder/$hangsdir/i
   timeout -k 10s -s SIGTERM 3s ./dnsmasq > /dev/null 2>&1
 
   wait
-  count=$(expr $count + 1)
-  rem=$(expr $count % $step)
-  if [ "$rem" != "0" ]; then continue; fi
-  dump_coverage "$time"
+  cov_sample "$time"
 done
 
-#ouput cov data for the last testcase(s) if step > 1
-if [[ $step -gt 1 ]]
-then
-  time=$(stat -c %Y $f)
-  dump_coverage "$time"
-fi
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
 
 if [ "$not_after_run" = 1 ]; then
   covoutdir=$(dirname "$covfile")
@@ -44,7 +44,11 @@ function dump_coverage {
     set +e
 }
 
-count=0
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
 # shellcheck disable=SC2045
 for f in $(ls -tr "$folder/"*.py); do
     time=$(stat -c %Y "$f")
@@ -61,17 +65,11 @@ for f in $(ls -tr "$folder/"*.py); do
     wait
     cp /home/ubuntu/ftpshare/home/ubuntu/experiments/bftpd-gcov/*.gcda \
         /home/ubuntu/experiments/bftpd-gcov/ > /dev/null 2>&1
-    count=$((count + 1))
-    rem=$((count % step))
-    [ "$rem" != "0" ] && continue
-    dump_coverage "$time"
+    cov_sample "$time"
 done
 
-#ouput cov data for the last testcase(s) if step > 1
-if [ "$step" -gt 1 ]; then
-    time=$(stat -c %Y "$f")
-    dump_coverage "$time"
-fi
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
 
 echo "[*] Generating HTML report to $covoutdir/cov_html"
 gcovr -r . --html --html-details -o index.html
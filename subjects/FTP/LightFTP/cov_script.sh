@@ -68,10 +68,38 @@ function dump_coverage {
     set +e
 }
 
-#process initial seed corpus first
-for f in $(echo $folder/$testdir/*.raw); do 
-  time=$(stat -c %Y $f)
-  echo "[*] $time : $f"
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
+#with forksrv.so (built in the coverage image by coverage.sh) the server is
+#started once and every connection is handled by a forked child, which
+#writes its gcov counters when it exits; the parent reports it on a FIFO
+forksrv="$WORKDIR/forksrv.so"
+server=
+if [ -f "$forksrv" ]; then
+  status=$(mktemp -u)
+  mkfifo "$status"
+  exec 5<> "$status"
+  pkill fftp
+  ftpclean
+  LD_PRELOAD="$forksrv" FORKSRV_STATUS="$status" ./fftp fftp.conf $pno > /dev/null 2>&1 &
+  server=$!
+  for _ in $(seq 50); do
+    netstat -ltn | grep -q ":$pno " && break
+    sleep 0.1
+  done
+fi
+
+function replay {
+  local f=$1
+  if [ -n "$server" ]; then
+    ftpclean
+    $replayer $f FTP $pno 1 > /dev/null 2>&1
+    read -r -t 10 _ <&5 || echo "[!] No exit status for $f"
+    return
+  fi
 
   #terminate running server(s)
   pkill fftp
@@ -81,36 +109,34 @@ for f in $(echo $folder/$testdir/*.raw); do
   timeout -k 0 -s SIGUSR1 3s ./fftp fftp.conf $pno > /dev/null 2>&1
   
   wait
+}
+
+#process initial seed corpus first
+for f in $(echo $folder/$testdir/*.raw); do 
+  time=$(stat -c %Y $f)
+  echo "[*] $time : $f"
+  replay "$f"
   dump_coverage "$time"
 done
 
 #process fuzzer-generated testcases
-count=0
 for f in $(ls -tr $folder/$testdir/id* $folder/$crashdir/id* $folder/$hangsdir/id*); do
   time=$(stat -c %Y $f)
   echo "[*] $time : $f"
-
-  #terminate running server(s)
-  pkill fftp
-  
-  ftpclean  
-  $replayer $f FTP $pno 1 > /dev/null 2>&1 &
-  timeout -k 0 -s SIGUSR1 3s ./fftp fftp.conf $pno > /dev/null 2>&1
-
-  wait
-  count=$(expr $count + 1)
-  rem=$(expr $count % $step)
-  if [ "$rem" != "0" ]; then continue; fi
-  dump_coverage "$time"
+  replay "$f"
+  cov_sample "$time"
 done
 
-#ouput cov data for the last testcase(s) if step > 1
-if [[ $step -gt 1 ]]
-then
-  time=$(stat -c %Y $f)
-  dump_coverage "$time"
+if [ -n "$server" ]; then
+  kill -USR1 "$server"
+  wait "$server"
+  exec 5<&-
+  rm "$status"
 fi
 
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
+
 if [ "$not_after_run" = 1 ]; then
   covoutdir=$(dirname "$covfile")
   echo "[*] Generating HTML report to $covoutdir/cov_html"
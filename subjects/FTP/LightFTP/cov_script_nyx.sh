@@ -51,28 +51,58 @@ function dump_coverage {
     set +e
 }
 
-count=0
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
+#with forksrv.so (built in the coverage image by coverage.sh) the server is
+#started once and every connection is handled by a forked child, which
+#writes its gcov counters when it exits; the parent reports it on a FIFO
+forksrv="$WORKDIR/forksrv.so"
+server=
+if [ -f "$forksrv" ]; then
+    status=$(mktemp -u)
+    mkfifo "$status"
+    exec 5<> "$status"
+    pkill fftp
+    ftpclean
+    LD_PRELOAD="$forksrv" FORKSRV_STATUS="$status" ./fftp fftp.conf "$pno" > /dev/null 2>&1 &
+    server=$!
+    for _ in $(seq 50); do
+        netstat -ltn | grep -q ":$pno " && break
+        sleep 0.1
+    done
+fi
+
 # shellcheck disable=SC2045
 for f in $(ls -tr "$folder/"*.py); do
     time=$(stat -c %Y "$f")
     echo "[*] $time : $f"
-    pkill fftp
-    ftpclean
-    python "$replayer" "$f" tcp "$pno" &
-    timeout -k 0 -s SIGUSR1 3s ./fftp fftp.conf "$pno" > /dev/null 2>&1
-    wait
-    count=$((count + 1))
-    rem=$((count % step))
-    [ "$rem" != "0" ] && continue
-    dump_coverage "$time"
+    if [ -n "$server" ]; then
+        ftpclean
+        python "$replayer" "$f" tcp "$pno"
+        read -r -t 10 _ <&5 || echo "[!] No exit status for $f"
+    else
+        pkill fftp
+        ftpclean
+        python "$replayer" "$f" tcp "$pno" &
+        timeout -k 0 -s SIGUSR1 3s ./fftp fftp.conf "$pno" > /dev/null 2>&1
+        wait
+    fi
+    cov_sample "$time"
 done
 
-#ouput cov data for the last testcase(s) if step > 1
-if [ "$step" -gt 1 ]; then
-    time=$(stat -c %Y "$f")
-    dump_coverage "$time"
+if [ -n "$server" ]; then
+    kill -USR1 "$server"
+    wait "$server"
+    exec 5<&-
+    rm "$status"
 fi
 
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
+
 echo "[*] Generating HTML report to $covoutdir/cov_html"
 gcovr -r .. --html --html-details -o index.html
 mkdir -p "$covoutdir/cov_html/"
@@ -2,6 +2,11 @@
 
 set -e
 
+#already built in the cached coverage image (see coverage.sh)
+if [ -f "${WORKDIR}/.cov_prepared" ]; then
+  exit 0
+fi
+
 rm -rf /usr/exim/configure
 
 #Compile and install exim to collect code coverage
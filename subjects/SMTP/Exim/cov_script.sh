@@ -29,6 +29,14 @@ gcovr -r . -s -d > /dev/null 2>&1
 #Time: timestamp, l_per/b_per and l_abs/b_abs: line/branch coverage in percentage and absolutate number
 echo "Time,l_per,l_abs,b_per,b_abs" >> $covfile
 
+#with COV_GCDA=1 (coverage.sh -g) coverage is read incrementally from the gcov
+#counters by gcda_cov.py (copied by coverage.sh) instead of running gcovr; its
+#counts follow gcov, so they can slightly differ from those of gcovr
+gcda_cov="$WORKDIR/gcda_cov.py"
+if [ "$COV_GCDA" = 1 ] && [ -f "$gcda_cov" ]; then
+  coproc COV { python "$gcda_cov" -r . -o "$covfile"; }
+fi
+
 #files stored in replayable-* folders are structured
 #in such a way that messages are separated
 if [ $fmode -eq "1" ]; then
@@ -45,7 +53,13 @@ fi
 
 function dump_coverage {
     local time=$1
-    local cov_data l_per l_abs b_per b_abs
+    local cov_data l_per l_abs b_per b_abs row
+    if [ -n "$COV_PID" ]; then
+        echo "$time" >&"${COV[1]}"
+        read -r row <&"${COV[0]}"
+        echo "=== ${row##*,}"
+        return
+    fi
     set -e
     cov_data=$(gcovr -r . -s | grep "[lb][a-z]*:")
     l_per=$(echo "$cov_data" | grep lines | cut -d" " -f2 | rev | cut -c2- | rev)
@@ -63,6 +77,11 @@ function dump_coverage {
     set +e
 }
 
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
 pkill -9 exim
 #start exim daemon
 exim -bd -oX $pno
@@ -81,7 +100,6 @@ for f in $(echo $folder/$testdir/*.raw); do
 done
 
 #process other testcases
-count=0
 for f in $(ls -tr $folder/$testdir/id* $folder/$crashdir/id* $folder/$hangsdir/id*); do
   time=$(stat -c %Y $f)
   echo "[*] $time : $f"
@@ -91,18 +109,11 @@ for f in $(ls -tr $folder/$testdir/id* $folder/$crashdir/id* $folder/$hangsdir/i
   $replayer $f SMTP $pno 100 > /dev/null 2>&1
 
   wait
-  count=$(expr $count + 1)
-  rem=$(expr $count % $step)
-  if [ "$rem" != "0" ]; then continue; fi
-  dump_coverage "$time"
+  cov_sample "$time"
 done
 
-#ouput cov data for the last testcase(s) if step > 1
-if [[ $step -gt 1 ]]
-then
-  time=$(stat -c %Y $f)
-  dump_coverage "$time"
-fi
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
 
 if [ "$not_after_run" = 1 ]; then
   covoutdir=$(dirname "$covfile")
@@ -13,7 +13,6 @@ $WORKDIR/compile_exim_gcov.sh
 #delete the existing coverage file
 rm "$covfile" > /dev/null 2>&1; touch "$covfile"
 
-replayer="$WORKDIR/nyx_replay_fast.py"
 cd "$WORKDIR/exim-gcov" || exit 1
 
 #clear gcov data
@@ -26,6 +25,14 @@ gcovr -r . -s -d > /dev/null 2>&1
 #Time: timestamp, l_per/b_per and l_abs/b_abs: line/branch coverage in percentage and absolutate number
 echo "Time,l_per,l_abs,b_per,b_abs" >> "$covfile"
 
+#with COV_GCDA=1 (coverage.sh -g) coverage is read incrementally from the gcov
+#counters by gcda_cov.py (copied by coverage.sh) instead of running gcovr; its
+#counts follow gcov, so they can slightly differ from those of gcovr
+gcda_cov="$WORKDIR/gcda_cov.py"
+if [ "$COV_GCDA" = 1 ] && [ -f "$gcda_cov" ]; then
+  coproc COV { python "$gcda_cov" -r . -o "$covfile"; }
+fi
+
 pkill -9 exim
 #start exim daemon
 # TODO: kill exim!
@@ -33,7 +40,13 @@ exim -bd -oX "$pno"
 
 function dump_coverage {
     local time=$1
-    local cov_data l_per l_abs b_per b_abs
+    local cov_data l_per l_abs b_per b_abs row
+    if [ -n "$COV_PID" ]; then
+        echo "$time" >&"${COV[1]}"
+        read -r row <&"${COV[0]}"
+        echo "=== ${row##*,}"
+        return
+    fi
     set -e
     cov_data=$(gcovr -r . -s | grep "[lb][a-z]*:")
     l_per=$(echo "$cov_data" | grep lines | cut -d" " -f2 | rev | cut -c2- | rev)
@@ -51,33 +64,37 @@ function dump_coverage {
     set +e
 }
 
-count=0
-# shellcheck disable=SC2045
-#for f in $(ls -tr "$folder/"*.py); do
-for f in $(ls -tr /home/ubuntu/experiments/corpus/*/*.py); do
-    time=$(stat -c %Y "$f")
-    echo "[*] $time : $f"
+#cov_sample.sh (copied by coverage.sh or, for the coverage computed after
+#fuzzing, by profuzzbench_exec_common.sh) decides after which test cases to
+#dump coverage: every $step test cases or, with COV_RESOLUTION, by fuzzing time
+. "$WORKDIR/cov_sample.sh" || exit 1
+
+#the corpus is converted once and replayed by a single process, driven
+#through a pair of FIFOs (next -> "<mtime> <path>" or "end"), with the
+#timing of aflnet-replay /tmp/aflnet.raw SMTP $pno 100
+ctl=$(mktemp -d)
+mkfifo "$ctl/in" "$ctl/out"
+python "$WORKDIR/nyx_replay_service.py" -p "$pno" -t 100 /home/ubuntu/experiments/corpus \
+    < "$ctl/in" > "$ctl/out" &
+exec 3> "$ctl/in" 4< "$ctl/out"
+
+while true; do
     sh /home/ubuntu/experiments/clean.sh
-    python /home/ubuntu/experiments/nyx2aflnet.py $f /tmp/aflnet.raw
-
-    #du -b /tmp/aflnet.raw
-
-
-    /home/ubuntu/aflnet/aflnet-replay /tmp/aflnet.raw SMTP $pno 100 > /dev/null 2>&1
-
-    #python "$replayer" "$f" tcp "$pno"
+    echo next >&3
+    read -r reply f <&4 || break
+    [ "$reply" = "end" ] && break
+    time=$reply
+    echo "[*] $time : $f"
 
-    count=$((count + 1))
-    rem=$((count % step))
-    [ "$rem" != "0" ] && continue
-    dump_coverage "$time"
+    cov_sample "$time"
 done
+echo quit >&3
+exec 3>&- 4<&-
+wait $!
+rm -r "$ctl"
 
-#ouput cov data for the last testcase(s) if step > 1
-if [ "$step" -gt 1 ]; then
-    time=$(stat -c %Y "$f")
-    dump_coverage "$time"
-fi
+#ouput cov data for the last testcase(s) if not dumped yet
+cov_sample_end "$time"
 
 echo "[*] Generating HTML report to $covoutdir/cov_html"
 gcovr -r . --html --html-details -o index.html
@@ -1,32 +1,303 @@
+"""
+Converts Nyx-Net reproducible specs to the AFLNet replay format.
 
-import struct
+A spec is a sequence of calls to packet(data) and packet_raw(inputs,
+borrows, data) with literal arguments. Specs are never executed: the calls
+are read by a small scanner, and a spec it can't read is checked on its
+syntax tree instead, where only these calls with literal arguments are
+allowed (imports are ignored). Parsed specs are cached by the hash of their
+contents, corpora have many duplicates.
+
+    nyx2aflnet.py spec.py out.raw
+    nyx2aflnet.py [-R] corpus/ out/
+
+Given a directory, every spec in it (recursively) is converted to a file
+with the same relative path and modification time, ending in .raw (AFLNet
+format) or, with -R, in .bin (the payloads one after the other).
+"""
+
+from __future__ import print_function
+
+import argparse
+import ast
+import codecs
+import hashlib
 import os
+import re
+import struct
 import sys
 
-output_buffer = b""
+# Parameters of the calls of a spec
+PARAMS = {"packet": ("data", ), "packet_raw": ("inputs", "borrows", "data")}
+CACHE_SIZE = 1 << 16
+
+_cache = {}
+
+_SKIP_RE = re.compile(br"(?:\s+|#[^\n]*|;)*")
+_WS_RE = re.compile(br"(?:\s+|#[^\n]*)*")
+_END_RE = re.compile(br"[ \t]*(?:#[^\n]*)?(?:\n|;|\Z)")
+_CALL_RE = re.compile(br"(packet_raw|packet)[ \t]*\(")
+# A whole call as the packer writes it, with a bytes literal for data
+_LINE_RE = re.compile(
+    br"(?:packet_raw\(inputs=\[[\d, ]*\], borrows=\[[\d, ]*\], data="
+    br"|packet\((?:data=)?)"
+    br"b(['\"])((?:(?!\1)[^\\\n]|\\.)*)\1\)[ \t]*(?:#[^\n]*)?(?:\n|\Z)",
+    re.DOTALL)
+_KW_RE = re.compile(br"([A-Za-z_]\w*)\s*=(?!=)")
+_STR_RE = re.compile(br"([bBrRuU]{0,2})('''|\"\"\"|'|\")")
+_BODY_RE = {
+    b"'": re.compile(br"((?:[^'\\\n]|\\.)*)'", re.DOTALL),
+    b'"': re.compile(br'((?:[^"\\\n]|\\.)*)"', re.DOTALL),
+    b"'''": re.compile(br"((?:[^\\]|\\.)*?)'''", re.DOTALL),
+    b'"""': re.compile(br'((?:[^\\]|\\.)*?)"""', re.DOTALL)
+}
+_LIST_RE = re.compile(br"\[([\s\d,+-]*)\]")
+_ATOM_RE = re.compile(br"(None|True|False|[+-]?\d+)\b")
+_NON_ASCII_RE = re.compile(br"[\x80-\xff]")
+# Escapes that differ between str literals and escape_decode
+_STR_ESCAPE_RE = re.compile(br"\\[0-7NuU]")
+
+
+class _Unsupported(Exception):
+  """ Not in the form read by the scanner. """
+
+
+def _payload(data):
+  if isinstance(data, bytes):
+    return data
+  try:
+    return data.encode("latin-1")
+  except AttributeError:
+    raise ValueError("packet data is not a string: %r" % (data, ))
+
+
+def _string(prefix, body):
+  prefix = prefix.lower()
+  if _NON_ASCII_RE.search(body) or (b"u" in prefix and b"b" in prefix):
+    raise _Unsupported()
+  if b"r" in prefix:
+    return body
+  if b"b" not in prefix and _STR_ESCAPE_RE.search(body):
+    raise _Unsupported()
+  try:
+    return codecs.escape_decode(body)[0]
+  except ValueError:
+    raise _Unsupported()
+
+
+def _literal(source, pos):
+  """ Value of the literal at `pos` and the position after it. """
+  m = _STR_RE.match(source, pos)
+  if m:
+    body = _BODY_RE[m.group(2)].match(source, m.end())
+    if body is None:
+      raise _Unsupported()
+    end = _WS_RE.match(source, body.end()).end()
+    # Implicit concatenation
+    if _STR_RE.match(source, end):
+      raise _Unsupported()
+    return _string(m.group(1), body.group(1)), body.end()
+  m = _LIST_RE.match(source, pos)
+  if m:
+    items = [s.strip() for s in m.group(1).split(b",")]
+    if items and not items[-1]:
+      items.pop()
+    return [int(s) for s in items], m.end()
+  m = _ATOM_RE.match(source, pos)
+  if m:
+    atom = m.group(1)
+    if atom[:1] in b"+-0123456789":
+      return int(atom), m.end()
+    return {b"None": None, b"True": True, b"False": False}[atom], m.end()
+  raise _Unsupported()
+
+
+def _scan(source):
+  """ Packets of a spec made only of calls with simple literals. """
+  out = []
+  pos = 0
+  while True:
+    pos = _SKIP_RE.match(source, pos).end()
+    if pos >= len(source):
+      return out
+    m = _LINE_RE.match(source, pos)
+    if m and not _NON_ASCII_RE.search(m.group(2)):
+      body = m.group(2)
+      out.append(_string(b"b", body) if b"\\" in body else body)
+      pos = m.end()
+      continue
+    m = _CALL_RE.match(source, pos)
+    if m is None:
+      raise _Unsupported()
+    params = PARAMS[m.group(1).decode()]
+    pos = m.end()
+    values = {}
+    keywords = False
+    while True:
+      pos = _WS_RE.match(source, pos).end()
+      if source[pos:pos + 1] == b")":
+        pos += 1
+        break
+      kw = _KW_RE.match(source, pos)
+      if kw:
+        name = kw.group(1).decode()
+        keywords = True
+        pos = kw.end()
+        pos = _WS_RE.match(source, pos).end()
+      elif keywords or len(values) >= len(params):
+        raise _Unsupported()
+      else:
+        name = params[len(values)]
+      if name not in params or name in values:
+        raise _Unsupported()
+      values[name], pos = _literal(source, pos)
+      pos = _WS_RE.match(source, pos).end()
+      c = source[pos:pos + 1]
+      pos += 1
+      if c == b")":
+        break
+      if c != b",":
+        raise _Unsupported()
+    end = _END_RE.match(source, pos)
+    if end is None:
+      raise _Unsupported()
+    pos = end.end()
+    out.append(_payload(values.get("data", b"")))
+
+
+def _parse_tree(source, file_name):
+  """ Packets of a spec, checked on its syntax tree. """
+  try:
+    tree = ast.parse(source, file_name)
+  except SyntaxError as e:
+    raise ValueError("%s: %s" % (file_name, e))
+  out = []
+  for stmt in tree.body:
+    if isinstance(stmt, (ast.Import, ast.ImportFrom, ast.Pass)):
+      continue
+    call = stmt.value if isinstance(stmt, ast.Expr) else None
+    if not isinstance(call, ast.Call) or \
+       not isinstance(call.func, ast.Name) or call.func.id not in PARAMS or \
+       getattr(call, "starargs", None) or getattr(call, "kwargs", None):
+      raise ValueError("%s:%d: not a packet" % (file_name, stmt.lineno))
+    params = PARAMS[call.func.id]
+    if len(call.args) > len(params):
+      raise ValueError("%s:%d: too many arguments" % (file_name, stmt.lineno))
+    try:
+      values = dict(zip(params, [ast.literal_eval(a) for a in call.args]))
+      for kw in call.keywords:
+        if kw.arg not in params or kw.arg in values:
+          raise ValueError("bad argument %s" % kw.arg)
+        values[kw.arg] = ast.literal_eval(kw.value)
+      out.append(_payload(values.get("data", b"")))
+    except ValueError as e:
+      raise ValueError("%s:%d: %s" % (file_name, stmt.lineno, e))
+  return out
+
+
+def parse(source, file_name="<spec>"):
+  """ Payloads of the packets of the spec in `source` (its contents). """
+  if not isinstance(source, bytes):
+    source = source.encode("utf-8")
+  key = hashlib.sha1(source).digest()
+  pkts = _cache.get(key)
+  if pkts is None:
+    try:
+      pkts = _scan(source)
+    except _Unsupported:
+      pkts = _parse_tree(source, file_name)
+    pkts = tuple(pkts)
+    if len(_cache) >= CACHE_SIZE:
+      _cache.clear()
+    _cache[key] = pkts
+  return list(pkts)
+
+
+def clear_cache():
+  _cache.clear()
+
+
+def packets(file_name):
+  """ Returns the payloads of the packets of a Nyx-Net reproducible spec. """
+  with open(file_name, "rb") as f:
+    return parse(f.read(), file_name)
+
+
+def encode(pkts, buf=None, raw=False):
+  """
+  Appends packets to buf (a bytearray) in the AFLNet replay format, or just
+  their payloads with `raw`.
+  """
+  if buf is None:
+    buf = bytearray()
+  for data in pkts:
+    if not raw:
+      buf += struct.pack("i", len(data))
+    buf += data
+  return buf
+
+
+def convert(file_name, buf=None):
+  """ Appends the spec to buf (a bytearray) in the AFLNet replay format. """
+  return encode(packets(file_name), buf)
+
+
+def convert_dir(src, dst, raw=False):
+  """
+  Converts all the specs in `src` into `dst`, keeping relative paths and
+  modification times. Returns the number of specs converted and failed.
+  """
+  ext = ".bin" if raw else ".raw"
+  done = failed = 0
+  for dirpath, dirnames, files in os.walk(src):
+    dirnames.sort()
+    outdir = os.path.join(dst, os.path.relpath(dirpath, src))
+    for f in sorted(files):
+      if not f.endswith(".py"):
+        continue
+      path = os.path.join(dirpath, f)
+      try:
+        buf = encode(packets(path), raw=raw)
+      except (IOError, OSError, ValueError) as e:
+        print("[!] Skipping %s" % e, file=sys.stderr)
+        failed += 1
+        continue
+      if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+      out = os.path.join(outdir, f[:-len(".py")] + ext)
+      with open(out, "wb") as o:
+        o.write(buf)
+      st = os.stat(path)
+      os.utime(out, (st.st_atime, st.st_mtime))
+      done += 1
+  return done, failed
 
-def packet_raw(inputs=None, borrows=None, data=""):
-  global output_buffer
-  #print(data)
-  #print(len(data))
-  output_buffer += struct.pack("i", len(data))
-  output_buffer += data
 
-def packet(data=""):
-  global output_buffer
-  #print(data)
-  #print(len(data))
-  output_buffer += struct.pack("i", len(data))
-  output_buffer += data
+def main():
+  parser = argparse.ArgumentParser(
+      description="Convert Nyx-Net specs to the AFLNet replay format")
+  parser.add_argument("-R",
+                      "--raw",
+                      action="store_true",
+                      help="Write only the payloads, without lengths")
+  parser.add_argument("src", help="Spec or directory of specs")
+  parser.add_argument("dst", help="Output file or directory")
+  args = parser.parse_args()
 
-file_name = sys.argv[1]
-out_file_name = sys.argv[2]
+  if os.path.isdir(args.src):
+    done, failed = convert_dir(args.src, args.dst, args.raw)
+    print("%d specs converted, %d failed" % (done, failed))
+    sys.exit(1 if failed and not done else 0)
 
-print(file_name)
-execfile(file_name)
+  print(args.src)
+  try:
+    buf = encode(packets(args.src), raw=args.raw)
+  except (IOError, OSError, ValueError) as e:
+    print("[!] %s" % e, file=sys.stderr)
+    sys.exit(1)
+  with open(args.dst, "wb") as f:
+    f.write(buf)
 
-#print(os.path.basename(file_name))
-f = open(out_file_name, "w")
-f.write(output_buffer)
-f.close()
 
+if __name__ == "__main__":
+  main()
@@ -1,60 +1,206 @@
-import sys
-import socket
+#!/usr/bin/env python
+"""
+Replays Nyx-Net reproducible specs against the target.
+
+Instead of sleeping before every packet, the replayer waits for the server
+to answer: the response to a packet is read until the server is quiet for
+a short while (or the response timeout expires), then the next packet is
+sent. Single byte packets do not wait for an answer, like before.
+
+    nyx_replay_fast.py <file> <tcp/udp/stdout> [port]
+    nyx_replay_fast.py <dir> tcp <port> [--stats stats.csv] [--reuse]
+
+Given a directory, all its specs are replayed in modification time order and
+the time taken by each input is written as CSV (path,packets,bytes,seconds).
+With --reuse the connection is kept open across inputs as long as the server
+does not close it (UDP sockets are always reused).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
 import select
+import socket
+import sys
 import time
 
-def print_usage():
-  print("USAGE <file> <tcp/udp/stdout> <port>")
-
-def packet(data=""):
-  global mode
-  if mode == "stdout":
-    sys.stdout.write(data)
-  else:
-    ready = select.select([s], [], [], 0)
-    if ready[0]:
-      try:
-        s.recv(4096)
-      except:
-        print("    cannot recv")
-    if len(data) != 1:
-    	time.sleep(0.1)
-    s.send(data)
-  #print("SEND %d bytes"%(len(data)))
-  #print(data)
-
-if len(sys.argv) >= 3:
-
-  payload_file = sys.argv[1]
-  mode = sys.argv[2]
-
-  if mode == "stdout":
-    execfile(sys.argv[1])
-  elif (mode == "tcp" or mode == "udp") and len(sys.argv) == 4:
-    host = "localhost"
-    port = int(sys.argv[3])
-    if mode == "tcp":
-      s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    elif mode == "udp":
-      s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setblocking(0)
-    s.settimeout(1)
-
-    connected = False
-    for _ in range(100):
-      try:
-        s.connect((host, port))
-        connected = True
-        break
-      except:
-        time.sleep(0.3)
-    if not connected:
-      print("Could not connect")
-      sys.exit(1)
-    execfile(sys.argv[1])
-  else:
-    print_usage()
-
-else:
-  print_usage()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import nyx2aflnet  # noqa: E402
+
+
+def find_specs(paths):
+    """ Spec files in `paths` (directories are searched for *.py files). """
+    specs = []
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, _, files in os.walk(p):
+                specs.extend(
+                    os.path.join(dirpath, f) for f in files
+                    if f.endswith(".py"))
+        else:
+            specs.append(p)
+    return specs
+
+
+def by_mtime(specs):
+    """ Sorts specs like ls -tr, returns (mtime, path) pairs. """
+    return sorted((int(os.stat(p).st_mtime), p) for p in specs)
+
+
+class Target(object):
+    def __init__(self, port, mode="tcp", host="localhost", timeout=0.1,
+                 poll_wait=0.001, connect_timeout=30, reuse=False):
+        self.addr = (host, port)
+        self.mode = mode
+        self.timeout = timeout
+        self.poll_wait = poll_wait
+        self.connect_timeout = connect_timeout
+        self.reuse = reuse or mode == "udp"
+        self.sock = None
+
+    def connect(self):
+        """ Connects as soon as the server accepts connections. """
+        kind = socket.SOCK_STREAM if self.mode == "tcp" else socket.SOCK_DGRAM
+        deadline = time.time() + self.connect_timeout
+        delay = 0.001
+        while True:
+            s = socket.socket(socket.AF_INET, kind)
+            try:
+                s.connect(self.addr)
+                return s
+            except socket.error:
+                s.close()
+                if time.time() > deadline:
+                    raise IOError("Could not connect to %s:%d" % self.addr)
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def recv(self, timeout):
+        """
+        Reads the server response: waits up to `timeout` for the first byte,
+        then keeps reading while data arrives within `poll_wait`. Returns
+        False if the server closed the connection.
+        """
+        wait = timeout
+        while True:
+            ready, _, _ = select.select([self.sock], [], [], wait)
+            if not ready:
+                return True
+            try:
+                data = self.sock.recv(4096)
+            except socket.error:
+                return False
+            if not data and self.mode == "tcp":
+                return False
+            wait = self.poll_wait
+
+    def replay(self, packets):
+        """ Sends the packets of an input, returns the number sent. """
+        if self.sock is None:
+            self.sock = self.connect()
+            # Greeting (if any)
+            alive = self.recv(self.timeout if self.mode == "tcp" else 0)
+        else:
+            alive = self.recv(0)
+        sent = 0
+        for data in packets:
+            if not alive:
+                break
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                alive = False
+                break
+            sent += 1
+            alive = self.recv(self.timeout if len(data) != 1 else 0)
+        if not alive or not self.reuse:
+            self.close()
+        return sent
+
+
+def replay_batch(target, specs, stats):
+    stats.write("path,packets,bytes,seconds\n")
+    total = 0.0
+    slowest = (0.0, None)
+    n = 0
+    for _, path in by_mtime(specs):
+        try:
+            pkts = nyx2aflnet.packets(path)
+        except Exception as e:
+            print("[!] Skipping %s: %r" % (path, e), file=sys.stderr)
+            continue
+        start = time.time()
+        try:
+            target.replay(pkts)
+        except IOError as e:
+            print("[!] %s: %s" % (path, e), file=sys.stderr)
+            target.close()
+        elapsed = time.time() - start
+        stats.write("%s,%d,%d,%.6f\n" %
+                    (path, len(pkts), sum(len(p) for p in pkts), elapsed))
+        total += elapsed
+        slowest = max(slowest, (elapsed, path))
+        n += 1
+    target.close()
+    if n:
+        print("[*] Replayed %d inputs in %.3fs (mean %.4fs, max %.4fs for %s)"
+              % (n, total, total / n, slowest[0], slowest[1]),
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay Nyx-Net specs without fixed delays")
+    parser.add_argument("spec", help="Spec file or directory of specs")
+    parser.add_argument("mode", choices=("tcp", "udp", "stdout"))
+    parser.add_argument("port", type=int, nargs="?")
+    parser.add_argument("-t",
+                        "--timeout",
+                        type=int,
+                        default=100,
+                        help="Response timeout in ms")
+    parser.add_argument("--reuse",
+                        action="store_true",
+                        help="Keep the connection open across inputs")
+    parser.add_argument("--stats",
+                        help="Per-input timing CSV (batch mode, "
+                        "default: stdout)")
+    args = parser.parse_args()
+
+    if args.mode == "stdout":
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        for _, path in by_mtime(find_specs([args.spec])):
+            for data in nyx2aflnet.packets(path):
+                out.write(data)
+        out.flush()
+        return
+    if args.port is None:
+        parser.error("port is required in %s mode" % args.mode)
+
+    target = Target(args.port,
+                    args.mode,
+                    timeout=args.timeout / 1000.0,
+                    reuse=args.reuse)
+    if os.path.isdir(args.spec):
+        stats = open(args.stats, "w") if args.stats else sys.stdout
+        replay_batch(target, find_specs([args.spec]), stats)
+        if stats is not sys.stdout:
+            stats.close()
+        return
+    try:
+        target.replay(nyx2aflnet.packets(args.spec))
+    except IOError as e:
+        print(e)
+        sys.exit(1)
+    target.close()
+
 
+if __name__ == "__main__":
+    main()
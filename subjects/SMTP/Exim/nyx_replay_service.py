@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Long-lived replayer for a whole Nyx-Net corpus.
+
+All the specs are converted once at start-up (see nyx2aflnet.py) into a
+single buffer; inputs are then replayed on request. This avoids starting an
+interpreter, writing /tmp/aflnet.raw and starting aflnet-replay for every
+input.
+
+Packets are sent with the same timing as `aflnet-replay <file> SMTP <port>
+100` used to, so that coverage over time is the same as before: a new
+connection for every input and, around every packet, waiting up to --poll
+ms for a response and reading it until nothing arrives for --timeout us.
+
+The service is driven by line commands on stdin, answers are on stdout:
+
+    next   replay the next input (in modification time order, then by name);
+           answers "<mtime> <path>" when done, "end" if there are no more
+    count  answers the number of inputs
+    quit   exits
+
+Example (as in cov_script_nyx.sh):
+
+    python nyx_replay_service.py -p 5000 corpus < in.fifo > out.fifo &
+    exec 3> in.fifo 4< out.fifo
+    echo next >&3; read -r time f <&4
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import nyx2aflnet  # noqa: E402
+from nyx_replay_fast import Target, find_specs  # noqa: E402
+
+
+class AflnetTarget(Target):
+    """ Target replaying inputs like aflnet-replay does. """
+    def replay(self, packets):
+        if self.sock is None:
+            self.sock = self.connect()
+        sent = 0
+        for data in packets:
+            # Responses are read before and after sending every packet
+            if not self.recv(self.timeout):
+                break
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                break
+            sent += 1
+            if not self.recv(self.timeout):
+                break
+        self.close()
+        return sent
+
+
+def mtime_ns(st):
+    """ Modification time in ns (Python 2 has no st_mtime_ns). """
+    ns = getattr(st, "st_mtime_ns", None)
+    return ns if ns is not None else int(st.st_mtime * 1e9)
+
+
+class Corpus(object):
+    """ All the packets of all the inputs in a single buffer. """
+    def __init__(self, specs):
+        self.buf = bytearray()
+        # (mtime in ns, path, [(offset, length), ...])
+        self.inputs = []
+        for path in specs:
+            try:
+                mtime = mtime_ns(os.stat(path))
+                pkts = nyx2aflnet.packets(path)
+            except Exception as e:
+                print("[!] Skipping %s: %r" % (path, e), file=sys.stderr)
+                continue
+            regions = []
+            for data in pkts:
+                regions.append((len(self.buf), len(data)))
+                self.buf += data
+            self.inputs.append((mtime, path, regions))
+        self.inputs.sort(key=lambda i: (i[0], i[1]))
+        self.view = memoryview(self.buf)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def packets(self, idx):
+        for off, length in self.inputs[idx][2]:
+            yield self.view[off:off + length]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a Nyx-Net corpus driven by commands on stdin")
+    parser.add_argument("-p", "--port", type=int, required=True)
+    parser.add_argument("-m", "--mode", choices=("tcp", "udp"), default="tcp")
+    # yapf: disable
+    parser.add_argument("-t", "--timeout", type=int, default=100,
+                        help="Timeout in us for the rest of a response, once "
+                        "it started (as the 4th argument of aflnet-replay)")
+    parser.add_argument("-w", "--poll", type=int, default=1,
+                        help="Timeout in ms for the start of a response (as "
+                        "the 5th argument of aflnet-replay)")
+    # yapf: enable
+    parser.add_argument("specs",
+                        nargs="+",
+                        help="Spec files or directories containing them")
+    args = parser.parse_args()
+
+    corpus = Corpus(find_specs(args.specs))
+    print("[*] Loaded %d inputs (%d bytes)" % (len(corpus), len(corpus.buf)),
+          file=sys.stderr)
+    # aflnet-replay tries to connect 1000 times, 1ms apart
+    target = AflnetTarget(args.port,
+                          args.mode,
+                          timeout=args.poll / 1000.0,
+                          poll_wait=args.timeout / 1000000.0,
+                          connect_timeout=1)
+
+    def answer(line):
+        print(line)
+        sys.stdout.flush()
+
+    idx = 0
+    for line in iter(sys.stdin.readline, ""):
+        cmd = line.strip()
+        if cmd == "next":
+            if idx >= len(corpus):
+                answer("end")
+                continue
+            mtime, path, _ = corpus.inputs[idx]
+            try:
+                target.replay(corpus.packets(idx))
+            except IOError as e:
+                print("[!] %s: %s" % (path, e), file=sys.stderr)
+                target.close()
+            idx += 1
+            answer("%d %s" % (mtime // 10**9, path))
+        elif cmd == "count":
+            answer(str(len(corpus)))
+        elif cmd == "quit":
+            break
+        elif cmd:
+            print("[!] Unknown command %r" % cmd, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
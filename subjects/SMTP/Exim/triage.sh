@@ -0,0 +1,74 @@
+#!/usr/bin/env bash
+
+# Replays the inputs in $INPUTS against the ASan build of exim for
+# scripts/nyx-eval/triage.py: for every input, the exit code of the exim
+# daemon and whether the children handling the connection hung go to
+# $OUTPUT/codes.csv and the stderr of exim (the sanitizer reports, also those
+# of the children) to $OUTPUT/<input>.log. *.raw inputs are in the AFLNet
+# replay format, *.bin inputs only have the payloads.
+
+INPUTS=$1
+OUTPUT=$2
+PORT=$3
+
+if [ ! -d "$WORKDIR/exim-asan" ]; then
+    "${WORKDIR}/compile_exim_asan.sh" || exit 1
+fi
+cd "$WORKDIR/exim-asan" || exit 1
+
+asan_code=42
+# Hung children are killed with SIGABRT so that ASan shows where they were stuck
+export ASAN_OPTIONS="exitcode=$asan_code:allocator_may_return_null=1:detect_leaks=0:handle_abort=1"
+
+# Whether the children of process $1 are still running (not zombies)
+function running {
+    ps --ppid "$1" -o stat= | grep -qv '^Z'
+}
+
+mkdir -p "$OUTPUT"
+: > "$OUTPUT/codes.csv"
+
+inputs=("$INPUTS/"*)
+total=0
+for input in "${inputs[@]}"; do
+    [ -f "$input" ] || continue
+    total=$((total + 1))
+    name=$(basename "$input")
+    name=${name%.*}
+    echo "[+] $total/${#inputs[@]} : $input"
+
+    sh /home/ubuntu/experiments/clean.sh
+
+    case $input in
+        *.raw)
+            replayer=aflnet-replay
+            ;;
+        *)
+            replayer=afl-replay
+            ;;
+    esac
+    exim -bdf -oX "$PORT" > /dev/null 2> "$OUTPUT/$name.log" &
+    daemon=$!
+    timeout -k 1s 3s $replayer "$input" SMTP "$PORT" 100 > /dev/null 2>&1
+
+    # The daemon never exits on its own: the input hangs if the children
+    # handling the connection are still running 3s after the replay
+    hung=1
+    for _ in $(seq 30); do
+        if ! running "$daemon"; then
+            hung=0
+            break
+        fi
+        sleep 0.1
+    done
+    if [ $hung = 1 ]; then
+        pkill -ABRT -P "$daemon"
+        sleep 1
+        pkill -KILL -P "$daemon"
+    fi
+    # SIGTERM unless it already exited (e.g. with a sanitizer report)
+    kill "$daemon" 2> /dev/null
+    wait "$daemon"
+    code=$?
+    echo "$name,$code,$hung" >> "$OUTPUT/codes.csv"
+done